@@ -0,0 +1,335 @@
+"""
+Memory-mapped kline archive.
+
+A KlineArchive keeps the klines of every (symbol, interval, contract type)
+in one file below its root directory, `<SYMBOL>-<interval>.klines` (or
+`<SYMBOL>-<CONTRACT TYPE>-<interval>.klines`). A file is a 64 byte header of
+little-endian int64 values (see HEADER) followed by one float64 column per
+kline field (see candles.FIELDS) of `capacity` values each:
+
+    data = np.memmap(path, "<f8", "r", offset=64, shape=(8, capacity))
+
+The first `count` values of every column are closed candles, oldest first,
+and only ever appended to. When `open` is 1 the next value is the candle
+that was still open at the last sync, it is replaced by the next one. A file
+doubles its capacity by rewriting it under a temporary name, views of the
+old mapping stay readable. One process writes a file, any number read it.
+
+`request` tells which klines a sync needs: none while the open candle held
+has not closed yet, otherwise only the candles after the last closed one,
+or the latest `history` candles for a new file or one that missed more than
+that. `append` stores the answer. helper.get_klines and
+async_helper.get_klines sync through the archive set by
+helper.init_kline_archive and read their klines from it without copying.
+
+Reading an archive does not need the exchange, see read_archive. Run this
+module to sync archives from the command line, `--start` backfills a new
+file from a date.
+"""
+import argparse
+import os
+import threading
+import time
+
+import numpy as np
+from binance.helpers import interval_to_milliseconds
+
+from candles import FIELDS, Candles
+
+# header values, the magic number reads b"KLINES01"
+HEADER = ("magic", "interval_ms", "capacity", "count", "open")
+HEADER_BYTES = 64
+MAGIC = int(np.frombuffer(b"KLINES01", dtype="<i8")[0])
+
+# the exchange answers at most this many klines per request
+MAX_LIMIT = 1500
+
+OPEN_TIME = FIELDS.index("open_time")
+CLOSE_TIME = FIELDS.index("close_time")
+
+
+# file name of the klines of a symbol, interval and contract type
+def archive_name(symbol, interval, contract_type=None):
+    if contract_type is None:
+        return "%s-%s.klines" % (symbol, interval)
+    return "%s-%s-%s.klines" % (symbol, contract_type, interval)
+
+
+# the klines of an archive file as a read only memmap view, one row per candle like the REST klines.
+# Closed candles only unless with_open. Needs neither the exchange nor a KlineArchive.
+def read_klines(path, with_open=False):
+    header = np.fromfile(path, dtype="<i8", count=len(HEADER))
+    if len(header) < len(HEADER) or header[0] != MAGIC:
+        raise ValueError("Not a kline archive: " + str(path))
+    capacity, count, open_ = (int(v) for v in header[2:5])
+    rows = count + open_ if with_open else count
+    if rows == 0:
+        return np.zeros((0, len(FIELDS)), dtype="float64")
+    data = np.memmap(path,
+                     dtype="<f8",
+                     mode="r",
+                     offset=HEADER_BYTES,
+                     shape=(len(FIELDS), capacity))
+    return data[:, :rows].T
+
+
+# see read_klines, as candles.Candles of column views
+def read_archive(path, with_open=False):
+    return Candles(*read_klines(path, with_open).T)
+
+
+class ArchiveFile():
+    def __init__(self, path, interval, history=500, clock=time.time):
+        """
+        history:int: klines fetched for a new file, and at most after a pause.
+        """
+        self.path = path
+        self.interval = interval
+        self.interval_ms = interval_to_milliseconds(interval)
+        self.history = int(history)
+        self.clock = clock
+        self.lock = threading.RLock()
+        self.header = None
+        self.data = None
+        if os.path.exists(path):
+            self._map()
+        else:
+            self._create(max(self.history * 2, 1024))
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def capacity(self):
+        return int(self.header[2])
+
+    @property
+    def count(self):
+        return int(self.header[3])
+
+    @property
+    def open(self):
+        return int(self.header[4])
+
+    # open time of the last closed candle, None while there is none
+    @property
+    def last_open_time(self):
+        if self.count == 0:
+            return None
+        return int(self.data[OPEN_TIME, self.count - 1])
+
+    def _map(self):
+        self.header = np.memmap(self.path,
+                                dtype="<i8",
+                                mode="r+",
+                                shape=(len(HEADER), ))
+        if self.header[0] != MAGIC:
+            raise ValueError("Not a kline archive: " + str(self.path))
+        if self.header[1] != self.interval_ms:
+            raise ValueError("%s holds %s ms klines, not %s ms" %
+                             (self.path, self.header[1], self.interval_ms))
+        self.data = np.memmap(self.path,
+                              dtype="<f8",
+                              mode="r+",
+                              offset=HEADER_BYTES,
+                              shape=(len(FIELDS), self.capacity))
+
+    # write a file of `capacity` holding the candles of this one and map it
+    def _create(self, capacity):
+        rows = 0 if self.header is None else self.count + self.open
+        tmp = self.path + ".tmp"
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(tmp, "wb") as f:
+            f.truncate(HEADER_BYTES + len(FIELDS) * capacity * 8)
+        header = np.memmap(tmp, dtype="<i8", mode="r+", shape=(len(HEADER), ))
+        header[:] = [MAGIC, self.interval_ms, capacity, 0, 0]
+        if rows > 0:
+            data = np.memmap(tmp,
+                             dtype="<f8",
+                             mode="r+",
+                             offset=HEADER_BYTES,
+                             shape=(len(FIELDS), capacity))
+            data[:, :rows] = self.data[:, :rows]
+            data.flush()
+            header[3:5] = self.header[3:5]
+        header.flush()
+        del header
+        os.replace(tmp, self.path)
+        self._map()
+
+    def request(self, now_ms=None, backfill=False):
+        """
+        Parameters of the klines request a sync needs next: `limit` and maybe `startTime`.
+
+        None while the candle held as open has not closed yet, the archive is up to date then. With
+        backfill every missed candle is requested, page by page.
+        """
+        if now_ms is None:
+            now_ms = int(self.clock() * 1000)
+        with self.lock:
+            if self.open and self.data[CLOSE_TIME, self.count] >= now_ms:
+                return None
+            if self.count == 0:
+                return {"limit": self.history}
+            start = self.last_open_time + self.interval_ms
+            missing = (now_ms - start) // self.interval_ms + 1
+            if missing > self.history and not backfill:
+                # too many missed to fetch on the way, the file keeps a gap
+                return {"limit": self.history}
+            return {
+                "startTime": start,
+                "limit": int(min(max(missing, 1), MAX_LIMIT))
+            }
+
+    def append(self, candles, now_ms=None):
+        """
+        Store klines of the REST client, oldest first.
+
+        Candles up to the last closed one held are skipped, the closed ones after it are appended and a
+        candle still open at `now_ms` is held as the open one. `now_ms` is the time the request was
+        sent: a candle that closed after it may have been answered while it was open, it is held as
+        open and downloaded again. Returns the number of candles appended.
+        """
+        if now_ms is None:
+            now_ms = int(self.clock() * 1000)
+        if len(candles) == 0:
+            return 0
+        width = min(len(candles[0]), len(FIELDS))
+        block = np.zeros((len(FIELDS), len(candles)), dtype="float64")
+        block[:width] = np.array([row[:width] for row in candles],
+                                 dtype="float64").T
+        with self.lock:
+            last = self.last_open_time
+            if last is not None:
+                block = block[:, block[OPEN_TIME] > last]
+            closed = int(np.count_nonzero(block[CLOSE_TIME] < now_ms))
+            rows = self.count + len(block[0])
+            if rows > self.capacity:
+                capacity = self.capacity
+                while capacity < rows:
+                    capacity *= 2
+                self._create(capacity)
+            self.data[:, self.count:rows] = block
+            self.data.flush()
+            # the header is written last, a crash leaves the candles before unchanged
+            self.header[3] = self.count + closed
+            self.header[4] = min(len(block[0]) - closed, 1)
+            self.header.flush()
+            return closed
+
+    # view of the last n candles (all when n is None) with the open one, one row per candle like the
+    # REST klines
+    def klines(self, n=None):
+        with self.lock:
+            rows = self.count + self.open
+            if n is None or n > rows:
+                n = rows
+            return self.data[:, rows - n:rows].T
+
+    # see klines, as candles.Candles of column views
+    def columns(self, n=None):
+        return Candles(*self.klines(n).T)
+
+
+class KlineArchive():
+    def __init__(self, root, history=500, clock=time.time):
+        self.root = root
+        self.history = history
+        self.clock = clock
+        self._files = {}
+        self._lock = threading.Lock()
+
+    def path(self, symbol, interval, contract_type=None):
+        return os.path.join(self.root,
+                            archive_name(symbol, interval, contract_type))
+
+    # the file of a symbol, interval and contract type, created empty when there is none
+    def open(self, symbol, interval, contract_type=None):
+        key = (symbol, interval, contract_type)
+        with self._lock:
+            file = self._files.get(key)
+            if file is None:
+                file = self._files[key] = ArchiveFile(
+                    self.path(symbol, interval, contract_type), interval,
+                    self.history, self.clock)
+            return file
+
+    # parameters of the first request of a sync, see sync
+    def _first_request(self, file, start):
+        if start is not None and file.count == 0:
+            return {"startTime": int(start), "limit": MAX_LIMIT}
+        return file.request(backfill=start is not None)
+
+    def sync(self, fetch, symbol, interval, contract_type=None, start=None):
+        """
+        Bring a file up to date.
+
+        fetch:callable: called with the request parameters (`limit`, maybe `startTime`), returns klines.
+        start:int: open time (ms) a new file is filled from instead of the latest `history` candles, a
+        file that missed candles gets all of them.
+        Returns the file.
+        """
+        file = self.open(symbol, interval, contract_type)
+        with file.lock:
+            params = self._first_request(file, start)
+            while params is not None:
+                # a candle is closed if it closed before the request was sent, the answer may be older
+                # than the time it arrives at
+                sent = int(file.clock() * 1000)
+                candles = fetch(**params)
+                # a short page is the last one, a page without new candles too
+                if (file.append(candles, sent) == 0
+                        or len(candles) < params["limit"]):
+                    break
+                params = file.request(backfill=start is not None)
+        return file
+
+    # see sync, fetch is a coroutine function
+    async def sync_async(self,
+                         fetch,
+                         symbol,
+                         interval,
+                         contract_type=None,
+                         start=None):
+        file = self.open(symbol, interval, contract_type)
+        params = self._first_request(file, start)
+        while params is not None:
+            sent = int(file.clock() * 1000)
+            candles = await fetch(**params)
+            if (file.append(candles, sent) == 0
+                    or len(candles) < params["limit"]):
+                break
+            params = file.request(backfill=start is not None)
+        return file
+
+    def close(self):
+        with self._lock:
+            self._files.clear()
+
+
+def main(argv=None):
+    from backtest import parse_date
+    import helper as h
+
+    parser = argparse.ArgumentParser(
+        description="Sync kline archives from the exchange.")
+    parser.add_argument("symbols", nargs="+")
+    parser.add_argument("--archive", default="data/archive")
+    parser.add_argument("--intervals", default="1m,5m,15m")
+    parser.add_argument("--start", help="YYYY-MM-DD, backfills new files")
+    args = parser.parse_args(argv)
+
+    client = h.init_client()
+    archive = h.init_kline_archive(args.archive)
+    for symbol in args.symbols:
+        for interval in args.intervals.split(","):
+            file = h.sync_archive(client,
+                                  symbol,
+                                  interval,
+                                  _start=parse_date(args.start))
+            print("%s %s: %d klines" % (symbol, interval, len(file)))
+    archive.close()
+
+
+if __name__ == '__main__':
+    main()
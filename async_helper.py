@@ -0,0 +1,560 @@
+"""
+Asyncio versions of the helper functions that talk to the exchange.
+
+Every coroutine takes a binance AsyncClient and mirrors the function of the
+same name in helper.py. The signal math, the kline cache, the exchange
+information and the trade log are shared with helper.py.
+"""
+import asyncio
+import time
+
+import numpy as np
+from binance import AsyncClient
+from binance.client import Client
+from binance.helpers import interval_to_milliseconds
+
+import config as cfg
+import engine
+import helper as h
+import metrics
+import orders
+import scheduler
+from candles import Candles, stack
+from wilder import WilderState, wilder_batch
+
+
+# create a binance async client, it owns one http session for all requests
+# base_url points the client to another server, see helper.init_client
+# the requests of the client wait for helper.request_scheduler and are timed, see metrics.InstrumentedClient.
+# The pool size and timeout are the ones of helper.transport.
+async def init_client(base_url=None):
+    client_class = AsyncClient
+    if base_url is not None:
+        client_class = h.with_base_url(AsyncClient, base_url)
+    client = await client_class.create(
+        api_key=cfg.getPublicKey(),
+        api_secret=cfg.getPrivateKey(),
+        **h.transport.async_client_params(client_class))
+    return scheduler.ScheduledClient(metrics.InstrumentedClient(client),
+                                     h.request_scheduler)
+
+
+@metrics.timed
+async def get_market_price(client, _market):
+    price = await client.futures_mark_price(symbol=_market)
+    return float(price['markPrice'])
+
+
+@metrics.timed
+async def get_futures_balance(client, _asset="USDT"):
+    balances = await client.futures_account_balance()
+    asset_balance = 0
+    for balance in balances:
+        if balance['asset'] == _asset:
+            asset_balance = balance['balance']
+            break
+    return asset_balance
+
+
+@metrics.timed
+async def initialise_futures(client,
+                             _market,
+                             _leverage=1,
+                             _margin_type="ISOLATED"):
+    try:
+        await client.futures_change_leverage(symbol=_market,
+                                             leverage=_leverage)
+        await client.futures_change_margin_type(symbol=_market,
+                                                marginType=_margin_type)
+    except Exception as e:
+        if "No need to change margin type" in str(e):
+            return
+        msg = "Adjust margin/leaverage: " + str(e)
+        raise Exception(msg)
+
+
+@metrics.timed
+async def execute_order(
+    client,
+    _market,
+    _type="MARKET",
+    _side="BUY",
+    _position_side="BOTH",
+    _qty=1.0,
+):
+    await client.futures_create_order(
+        symbol=_market,
+        type=_type,
+        side=_side,
+        positionSide=_position_side,
+        quantity=str(_qty),
+    )
+
+
+@metrics.timed
+async def get_positon_by_market(client, market):
+    position = await client.futures_position_information(symbol=market)
+    return position[0]  # We have only one position
+
+
+@metrics.timed
+async def check_in_position(client, market):
+    position = await get_positon_by_market(client, market)
+    return float(position['positionAmt']) != 0.0
+
+
+@metrics.timed
+async def close_position_by_market(client, _market):
+    position = await get_positon_by_market(client, _market)
+    _qty = float(position['positionAmt'])
+    if int(_qty) != 0:
+        _side = "BUY"
+        if _qty > 0.0:
+            _side = "SELL"
+
+        if _qty < 0.0:
+            _qty = _qty * -1
+
+        await execute_order(client, _market=_market, _qty=str(_qty), _side=_side)
+
+
+@metrics.timed
+async def cancel_open_orders_by_market(client, _market):
+    await client.futures_cancel_all_open_orders(symbol=_market)
+
+
+@metrics.timed
+async def submit_trailing_order(
+    client,
+    _market,
+    _type="TRAILING_STOP_MARKET",
+    _side="BUY",
+    _qty=1.0,
+    _callbackRate=4,
+):
+    await client.futures_create_order(
+        symbol=_market,
+        type=_type,
+        side=_side,
+        callbackRate=_callbackRate,
+        quantity=_qty,
+        workingType="CONTRACT_PRICE",
+    )
+
+
+# same store as helper.get_exchange_metadata, refreshed here once its ttl passed
+async def get_exchange_metadata(client):
+    if h.exchange_metadata.expired():
+        h.exchange_metadata.update(await client.futures_exchange_info())
+    return h.exchange_metadata
+
+
+# see helper.preflight, the modules are imported on a thread while the requests run
+async def preflight(client):
+    start = time.monotonic()
+    await asyncio.gather(asyncio.to_thread(h.import_lazy_modules),
+                         client.futures_ping(), get_exchange_metadata(client),
+                         get_futures_balance(client))
+    return time.monotonic() - start
+
+
+# quantity precision of a market, read from the exchange metadata
+async def get_market_precision(client, _market):
+    market_data = (await get_exchange_metadata(client)).get(_market)
+    if market_data is not None:
+        return market_data.quantity_precision
+    return 3
+
+
+# _margin is the USDT to put in the position, the whole balance when None
+@metrics.timed
+async def calculate_position(client, _market, _leverage=1, _margin=None):
+    if _margin is None:
+        usdt, price, precision = await asyncio.gather(
+            get_futures_balance(client, _asset="USDT"),
+            get_market_price(client, _market),
+            get_market_precision(client, _market),
+        )
+    else:
+        usdt = _margin
+        price, precision = await asyncio.gather(
+            get_market_price(client, _market),
+            get_market_precision(client, _market),
+        )
+    qty = (float(usdt) / price) * _leverage
+    qty = qty * 0.99
+    return h.round_to_precision(qty, precision)
+
+
+# see helper.prepare_order, the requests run concurrently
+@metrics.timed
+async def prepare_order(client,
+                        _market,
+                        _leverage=1,
+                        _callbackRate=2.0,
+                        _margin=None):
+    if _margin is None:
+        _margin, price, precision = await asyncio.gather(
+            get_futures_balance(client, _asset="USDT"),
+            get_market_price(client, _market),
+            get_market_precision(client, _market),
+        )
+    else:
+        price, precision = await asyncio.gather(
+            get_market_price(client, _market),
+            get_market_precision(client, _market),
+        )
+    return orders.OrderPlan(_market, _margin, price, precision, _leverage,
+                            _callbackRate)
+
+
+# see helper.place_position
+@metrics.timed
+async def place_position(client, plan, order_side="BUY"):
+    start = time.perf_counter()
+    entry = plan.entry_order(order_side)
+    stop = None
+    batched = hasattr(client, "futures_place_batch_order")
+    if batched:
+        entry, stop = await client.futures_place_batch_order(
+            batchOrders=[entry, plan.stop_order(order_side)])
+        if orders.is_error(entry):
+            if "orderId" in stop:
+                # the stop alone would be left on the book
+                await client.futures_cancel_order(symbol=plan.market,
+                                                 orderId=stop["orderId"])
+            raise orders.rejected(entry)
+    else:
+        entry = await client.futures_create_order(**entry)
+    entry_at = time.perf_counter()
+
+    if stop is None or orders.is_error(stop):
+        batched = False
+        try:
+            stop = await client.futures_create_order(
+                **plan.stop_order(order_side))
+        except Exception:
+            await execute_order(client,
+                                _market=plan.market,
+                                _side=orders.STOP_SIDES[order_side],
+                                _qty=plan.qty)
+            raise
+    return orders.result(plan, order_side, entry, stop, batched, start,
+                         entry_at, time.perf_counter())
+
+
+# see helper.open_position, _margin sizes a plan made here, also one made for a stale plan
+@metrics.timed
+async def open_position(
+    client,
+    market="BTCUSDT",
+    leverage=3,
+    order_side="BUY",
+    stop_side="SELL",
+    _callbackRate=2.0,
+    _margin=None,
+    plan=None,
+):
+    if plan is None or plan.market != market:
+        await initialise_futures(client, _market=market, _leverage=leverage)
+        plan = await prepare_order(client, market, leverage, _callbackRate,
+                                   _margin)
+    elif plan.stale():
+        # the price or the balance may have moved too far for its quantity
+        plan = await prepare_order(client, market, leverage, _callbackRate,
+                                   _margin)
+    placed = await place_position(client, plan, order_side)
+    if order_side == "BUY":
+        side = 1
+    elif order_side == "SELL":
+        side = -1
+    msg = (f"{order_side}: {placed.qty} ${placed.price} using x{leverage} leverage, "
+           f"stop placed after {placed.timings['stop'] * 1000:.0f} ms")
+    await asyncio.to_thread(
+        h.log_trade,
+        _qty=placed.qty,
+        _market=market,
+        _leverage=leverage,
+        _side=side,
+        _cause="Signal Change",
+        _trigger_price=0,
+        _market_price=placed.price,
+        _type=order_side,
+    )
+
+    return placed.qty, side, msg
+
+
+@metrics.timed
+async def handle_siganl(client,
+                        entry,
+                        market="BTCUSDT",
+                        leverage=3,
+                        _callbackRate=2.0,
+                        _margin=None,
+                        plan=None):
+    if entry[-2] == -1:
+        return await open_position(client,
+                                   market=market,
+                                   leverage=leverage,
+                                   order_side="SELL",
+                                   stop_side="BUY",
+                                   _callbackRate=_callbackRate,
+                                   _margin=_margin,
+                                   plan=plan)
+
+    elif entry[-2] == 1:
+        return await open_position(client,
+                                   market=market,
+                                   leverage=leverage,
+                                   order_side="BUY",
+                                   stop_side="SELL",
+                                   _callbackRate=_callbackRate,
+                                   _margin=_margin,
+                                   plan=plan)
+
+
+# see helper.download_klines
+async def download_klines(client,
+                          _market,
+                          _interval,
+                          _contract_type=None,
+                          **params):
+    if _contract_type is None:
+        return await client.futures_klines(symbol=_market,
+                                           interval=_interval,
+                                           **params)
+    return await client.futures_continous_klines(symbol=_market,
+                                                 contractType=_contract_type,
+                                                 interval=_interval,
+                                                 **params)
+
+
+# see helper.sync_archive
+async def sync_archive(client,
+                       _market,
+                       _interval,
+                       _contract_type=None,
+                       _start=None):
+    async def fetch(**params):
+        return await download_klines(client, _market, _interval,
+                                     _contract_type, **params)
+
+    return await h.kline_archive.sync_async(fetch, _market, _interval,
+                                            _contract_type, _start)
+
+
+# klines through helper.kline_cache and helper.kline_archive, see helper.get_klines
+@metrics.timed
+async def get_klines(client,
+                     _market,
+                     _interval,
+                     _contract_type=None,
+                     _limit=500):
+    candles = h.kline_cache.get(_market, _interval, _contract_type, _limit)
+    if candles is None:
+        if h.kline_archive is not None:
+            file = await sync_archive(client, _market, _interval,
+                                      _contract_type)
+            candles = file.klines(_limit)
+        else:
+            candles = await download_klines(client,
+                                            _market,
+                                            _interval,
+                                            _contract_type,
+                                            limit=_limit)
+        h.kline_cache.put(_market, _interval, candles, _contract_type,
+                          _limit)
+    return candles
+
+
+# see helper.get_candles
+async def get_candles(client,
+                      _market,
+                      _interval,
+                      _contract_type=None,
+                      _limit=500):
+    if h.resampled(_interval, _contract_type):
+        return await get_resampled_candles(client, _market, _interval, _limit)
+    candles = await get_klines(client, _market, _interval, _contract_type,
+                               _limit)
+    if isinstance(candles, np.ndarray):
+        return Candles(*candles.T)
+    return h.kline_cache.columns(_market, _interval, candles, _contract_type)
+
+
+# see helper.get_resampled_candles
+async def get_resampled_candles(client, _market, _interval, _limit=500):
+    base = await get_candles(client,
+                             _market,
+                             h.resample_base,
+                             _limit=h.RESAMPLE_BASE_LIMIT)
+    resampler = h.kline_cache.store.resampler(_market, _interval,
+                                              h.resample_base)
+    if not resampler.update(base):
+        resampler.seed(await get_klines(client, _market, _interval))
+        resampler.update(base)
+    return resampler.columns(_limit)
+
+
+# see helper.get_kline_rows
+async def get_kline_rows(client, _market, _interval, _limit=500):
+    if h.resampled(_interval):
+        return np.column_stack(await get_resampled_candles(
+            client, _market, _interval, _limit))
+    return await get_klines(client, _market, _interval, _limit=_limit)
+
+
+# see helper.prefetch_base
+async def prefetch_base(client,
+                        _market,
+                        _periods,
+                        _limit=h.RESAMPLE_BASE_LIMIT):
+    if any(h.resampled(period) for period in _periods):
+        if h.resample_base not in _periods:
+            _limit = h.RESAMPLE_BASE_LIMIT
+        await get_klines(client,
+                         _market,
+                         h.resample_base,
+                         _limit=max(_limit, h.RESAMPLE_BASE_LIMIT))
+
+
+async def advance_signal_state(client, _market, states, _period, _limit=5):
+    state = states.get((_market, _period))
+    candles = None
+    if state is not None and state.open_time is not None:
+        candles = await get_kline_rows(client,
+                                       _market,
+                                       _period,
+                                       _limit=_limit)
+        next_open_time = state.open_time + interval_to_milliseconds(_period)
+        if len(candles) == 0 or int(candles[0][0]) > next_open_time:
+            candles = None
+
+    if candles is None:
+        state = engine.SignalState(_market, _period)
+        states[(_market, _period)] = state
+        candles = await get_kline_rows(client, _market, _period)
+        state.seed(candles)
+    else:
+        for candle in candles[:-1]:
+            state.update(candle)
+
+    return state.entry, state.peek(candles[-1])
+
+
+@metrics.timed
+async def get_streaming_signal(client, _market, states, _periods=["1m"],
+                               _limit=5):
+    await prefetch_base(client, _market, _periods)
+    results = await asyncio.gather(*[
+        advance_signal_state(client, _market, states, period, _limit)
+        for period in _periods
+    ])
+    closed = [r[0] for r in results]
+    current = [r[1] for r in results]
+
+    return [h.combine_signals(closed), h.combine_signals(current)]
+
+
+# see helper.advance_wilder_state
+async def advance_wilder_state(client,
+                               _market,
+                               _interval,
+                               _contract_type=None,
+                               _limit=5):
+    key = (_market, _interval, _contract_type)
+    state = h.wilder_states.get(key)
+    if state is not None and state.resume(await get_candles(
+            client, _market, _interval, _contract_type, _limit)):
+        return state
+
+    state = WilderState(_market, _interval)
+    candles = await get_candles(client, _market, _interval, _contract_type)
+    state.seed(np.column_stack(candles).tolist())
+    h.wilder_states[key] = state
+    return state
+
+
+@metrics.timed
+async def is_trend(client, market, adx_threshold):
+    await prefetch_base(client, market, ["5m", "15m"])
+    state_15min, state_5min = await asyncio.gather(
+        advance_wilder_state(client, market, Client.KLINE_INTERVAL_15MINUTE),
+        advance_wilder_state(client, market, Client.KLINE_INTERVAL_5MINUTE),
+    )
+    adx_15min_ = state_15min.adx
+    adx_5min_ = state_5min.adx
+    if adx_15min_ >= adx_threshold and adx_5min_ >= adx_threshold:
+        return True, adx_5min_, adx_15min_
+    else:
+        return False, adx_5min_, adx_15min_
+
+
+# see helper.get_candle_matrix, at most _max_workers markets are downloaded at the same time
+async def get_candle_matrix(client,
+                            _markets,
+                            _interval,
+                            _limit=500,
+                            _max_workers=8):
+    semaphore = asyncio.Semaphore(_max_workers)
+
+    async def download(market):
+        async with semaphore:
+            return await get_candles(client, market, _interval, _limit=_limit)
+
+    candles = await asyncio.gather(*[download(market) for market in _markets])
+    return stack(candles, _limit)
+
+
+# see helper.batch_is_trend
+@metrics.timed
+async def batch_is_trend(client, markets, adx_threshold, max_workers=8):
+    adx = []
+    for interval in (Client.KLINE_INTERVAL_5MINUTE,
+                     Client.KLINE_INTERVAL_15MINUTE):
+        candles = await get_candle_matrix(client, markets, interval,
+                                          _max_workers=max_workers)
+        adx.append(
+            wilder_batch(candles.high, candles.low, candles.close)[0][:, -2])
+    adx_5min_, adx_15min_ = adx
+    return [(bool(a >= adx_threshold and b >= adx_threshold), a, b)
+            for a, b in zip(adx_5min_.tolist(), adx_15min_.tolist())]
+
+
+# see helper.scan_markets, at most max_workers markets are checked at the same time
+@metrics.timed
+@scheduler.with_priority(scheduler.SCAN)
+async def scan_markets(client,
+                       adx_threshold=25,
+                       volume_threshold=200000000.00,
+                       max_workers=8):
+    metadata, tickers = await asyncio.gather(get_exchange_metadata(client),
+                                             client.futures_ticker())
+    perpetuals = set()
+    for item in metadata.symbols():
+        if item.contract_type == 'PERPETUAL' and item.margin_asset == 'USDT':
+            perpetuals.add(item.symbol)
+
+    volumes = {}
+    for ticker in tickers:
+        if ticker['symbol'] in perpetuals:
+            volume = float(ticker['quoteVolume'])
+            if volume >= volume_threshold:
+                volumes[ticker['symbol']] = volume
+
+    semaphore = asyncio.Semaphore(max_workers)
+
+    async def check(symbol):
+        async with semaphore:
+            return await is_trend(client, symbol, adx_threshold)
+
+    symbols = list(volumes)
+    trends = await asyncio.gather(*[check(symbol) for symbol in symbols])
+
+    markets = []
+    for symbol, (is_trend_, adx_5min_, adx_15min_) in zip(symbols, trends):
+        if is_trend_:
+            markets.append((symbol, adx_5min_, adx_15min_, volumes[symbol]))
+    markets.sort(key=lambda m: min(m[1], m[2]), reverse=True)
+    return markets
@@ -0,0 +1,475 @@
+import argparse
+import asyncio
+import logging
+import signal
+import sys
+import time
+import traceback
+from datetime import datetime
+
+import aiohttp
+from binance.exceptions import BinanceAPIException, BinanceRequestException
+
+import async_helper as ah
+import config as cfg
+import helper as h
+import metrics
+from stream import AccountFeed, KlineFeed
+
+logging.basicConfig(
+    stream=sys.stdout,
+    format='%(asctime)s %(name)-12s %(levelname)-8s %(message)s',
+    datefmt='%y-%m-%d %H:%M:%S',
+    level=logging.INFO)
+
+logger = logging.getLogger('bot')
+
+RETRY_EXCEPTIONS = (BinanceAPIException, BinanceRequestException,
+                    aiohttp.ClientError, asyncio.TimeoutError)
+
+
+# done callback of a step run in its own task, a failed step is logged and retried by its task
+def log_step_error(task):
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("step failed: %s", task.exception(),
+                     exc_info=task.exception())
+
+
+class MarketSlot():
+    """
+    The market, signal and position state of one traded market.
+
+    AsyncMegalodon trades one slot, portfolio.Portfolio `portfolio.slots` of them. A slot steps under
+    its own lock, so a slow order on one market does not hold the others.
+    """
+    def __init__(self, index, bot):
+        self.index = index
+        self.bot = bot
+        # the log lines of a slot name it when the bot trades several
+        self.prefix = "Slot %d: " % index if bot.slot_count > 1 else ""
+        self.market = None
+        self.side = 0
+        self.qty = 0.0
+        self.last_trend_check = None
+        self.signal_states = {}
+        self.order_plan = None
+        self.opened_at = None
+        self.feed = None
+        self.lock = asyncio.Lock()
+
+    def __repr__(self):
+        return "slot %d (%s)" % (self.index, self.market)
+
+    async def assign(self, market):
+        self.market = market
+        self.side = 0
+        self.last_trend_check = datetime.now()
+        self.signal_states.clear()
+        logger.info('%sTrend market detected: %s', self.prefix, market)
+        self.start_feed()
+        # Initialise the market leverage and margin type.
+        await ah.initialise_futures(self.bot.client,
+                                    _market=market,
+                                    _leverage=self.bot.leverage,
+                                    _margin_type=self.bot.margin_type)
+
+    def start_feed(self):
+        self.stop_feed()
+        self.feed = KlineFeed(self.market,
+                              self.bot.confirmation_periods,
+                              fetch_klines=self.bot.fetch_klines,
+                              on_close=self.on_candle_close,
+                              url=self.bot.stream_url)
+        asyncio.ensure_future(self.feed.run())
+
+    def stop_feed(self):
+        if self.feed != None:
+            self.feed.stop()
+            self.feed = None
+
+    async def on_candle_close(self, close_time):
+        await self.signal_step()
+
+    def release(self):
+        self.stop_feed()
+        self.market = None
+        self.side = 0
+        self.order_plan = None
+        self.bot.market_released.set()
+
+    async def signal_step(self):
+        async with self.lock:
+            if self.market == None:
+                return
+            await self.check_signal()
+            # Market detected but, no BUY or SELL detected yet.
+            if self.side == 0:
+                waiting_time_min = ((
+                    (datetime.now() - self.last_trend_check).total_seconds())
+                                    / 60)
+                if waiting_time_min >= self.bot.market_time_out_minutes:
+                    logger.info('%s%s: %s min ended, market reset.',
+                                self.prefix, self.market,
+                                str(self.bot.market_time_out_minutes))
+                    self.release()
+                else:
+                    await self.prepare_order()
+
+    # fetch what the next position needs before its signal, see helper.prepare_order
+    async def prepare_order(self):
+        if (self.order_plan == None or self.order_plan.market != self.market
+                or self.order_plan.stale()):
+            self.order_plan = await ah.prepare_order(
+                self.bot.client, self.market, self.bot.leverage,
+                self.bot.trailing_percentage, await self.bot.slot_margin())
+
+    async def check_signal(self):
+        if self.feed != None and self.feed.ready:
+            entry = h.get_feed_signal(self.market, self.signal_states,
+                                      self.feed)
+        else:
+            entry = await ah.get_streaming_signal(
+                self.bot.client,
+                _market=self.market,
+                states=self.signal_states,
+                _periods=self.bot.confirmation_periods)
+
+        # Signal changed
+        if entry[-2] != self.side:
+            # No position oppened yet
+            if self.side == 0:
+                margin = None
+                if self.order_plan == None or self.order_plan.stale():
+                    margin = await self.bot.slot_margin()
+                self.opened_at = time.monotonic()
+                self.qty, self.side, msg = await ah.handle_siganl(
+                    self.bot.client,
+                    entry,
+                    self.market,
+                    self.bot.leverage,
+                    self.bot.trailing_percentage,
+                    margin,
+                    plan=self.order_plan)
+                self.order_plan = None
+                logger.info('%s%s: Position opend: %s', self.prefix,
+                            self.market, msg)
+
+            # We are an opposit position
+            else:
+                await self.close_position()
+                logger.info(
+                    '%s%s : Signal changed from %s to %s, current postion closed.',
+                    self.prefix, self.market, str(self.side), str(entry[-2]))
+                await self.log_trade(
+                    "EXIT", await ah.get_market_price(self.bot.client,
+                                                      self.market))
+                self.side = 0
+
+    async def position_step(self):
+        async with self.lock:
+            if self.market == None or self.side == 0:
+                return
+            # if trailing stop tiggered and therefor the postion closed
+            position_active = await self.bot.position_active(
+                self.market, self.opened_at)
+            if position_active == False:
+                # close any open trailing stops we have one
+                await ah.cancel_open_orders_by_market(self.bot.client,
+                                                      _market=self.market)
+                logger.info('%s%s : Trailing Stop Triggered.', self.prefix,
+                            self.market)
+                await self.log_trade(
+                    "Trailing Stop", await self.bot.exit_price(
+                        self.market, self.side, self.opened_at))
+                self.release()
+
+    async def close_position(self):
+        await asyncio.gather(
+            ah.close_position_by_market(self.bot.client, _market=self.market),
+            ah.cancel_open_orders_by_market(self.bot.client,
+                                            _market=self.market))
+
+    async def log_trade(self, _type, market_price):
+        await asyncio.to_thread(h.log_trade,
+                                _qty=self.qty,
+                                _market=self.market,
+                                _leverage=self.bot.leverage,
+                                _side=self.side,
+                                _cause="Signal Change",
+                                _market_price=market_price,
+                                _type=_type)
+
+
+class AsyncMegalodon():
+    """
+    Asyncio version of Megalodon.
+
+    Three tasks share one event loop and one client session:
+    - the scanner keeps a ranked list of trending markets and hands the next market to a free
+      MarketSlot as soon as one is released,
+    - the signal is checked as soon as the kline stream of the market reports closed candles,
+      the signal task checks it every minute over REST while the stream is down,
+    - the position task watches the open position for the trailing stop, it is woken by the account
+      stream as soon as the position closes and only polls over REST while the stream is down.
+    The tasks step every one of the `slot_count` slots, AsyncMegalodon trades one.
+    """
+
+    SIGNAL_CHECK_SECONDS = 60
+    POSITION_CHECK_SECONDS = 15
+    SCAN_SECONDS = 60
+    # how long a stop fill is waited for once the stream reported the position closed
+    EXIT_FILL_SECONDS = 2.0
+
+    def __init__(self):
+
+        # Load settings from settings.json
+        settings = cfg.getBotSettings()
+        h.init_transport(settings.http.pool_size, settings.http.timeout,
+                         settings.http.keep_alive_seconds)
+        self.leverage = int(settings.leverage)
+        self.margin_type = settings.margin_type
+        self.confirmation_periods = settings.trading_periods.split(",")
+        self.trailing_percentage = float(settings.trailing_percentage)
+        self.stream_url = settings.stream_url
+        self.adx_threshold = float(settings.market.adx_threshold)
+        self.volume_threshold = float(settings.market.volume_threshold)
+        self.market_time_out_minutes = float(
+            settings.market.market_time_out_minutes)
+        self.scan_workers = int(settings.market.scan_workers)
+        self.metrics_settings = settings.metrics
+        h.init_request_scheduler(settings.rate_limit.weight_per_minute,
+                                 settings.rate_limit.orders_per_minute,
+                                 settings.rate_limit.orders_per_10s,
+                                 settings.rate_limit.reserve)
+        h.init_trade_journal(settings.trade_log.path,
+                             settings.trade_log.format,
+                             settings.trade_log.max_mb,
+                             settings.trade_log.rotate_daily)
+        h.init_kline_archive(settings.kline_archive.path,
+                             settings.kline_archive.history)
+        h.init_resampling(settings.resample_base)
+
+        # global values used by bot to keep track of state
+        self.client = None
+        self.slot_count = 1
+        self.slots = []
+        self.account = None
+        self.candidates = []
+        self.last_scan = None
+        self.stopping = None
+        self.market_released = None
+
+    # preflight warms the connections and caches up before the first cycle
+    def start(self, preflight=False):
+        asyncio.run(self.run(preflight))
+
+    async def run(self, preflight=False):
+        self.slots = [MarketSlot(i, self) for i in range(self.slot_count)]
+        self.stopping = asyncio.Event()
+        self.market_released = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        loop.add_signal_handler(signal.SIGTERM, self.signal_term_handler)
+
+        metrics.start(self.metrics_settings)
+        self.client = await self.connect()
+        self.start_account_feed()
+        if preflight:
+            await self.preflight()
+        logger.info("Bot started.")
+        try:
+            await asyncio.gather(
+                self.run_task(self.scan_step, self.SCAN_SECONDS,
+                              self.market_released),
+                self.run_task(self.signal_step, self.SIGNAL_CHECK_SECONDS),
+                self.run_task(self.position_step,
+                              self.POSITION_CHECK_SECONDS),
+                self.run_task(self.keep_alive_step,
+                              h.transport.keep_alive_seconds),
+            )
+        except asyncio.CancelledError:
+            logger.error("Keyboard interrupt catched.")
+        finally:
+            await self.stop()
+
+    async def connect(self):
+        return await ah.init_client()
+
+    # see helper.preflight, a failed request is left to the first cycle
+    async def preflight(self):
+        try:
+            logger.info("Preflight done in %.2f s.", await ah.preflight(
+                self.client))
+        except RETRY_EXCEPTIONS as e:
+            logger.warning("Preflight failed: %s", e)
+
+    # run step every `interval` seconds until the bot stops, `wake` cuts the wait short
+    async def run_task(self, step, interval, wake=None):
+        while not self.stopping.is_set():
+            start = time.monotonic()
+            try:
+                await step()
+                metrics.cycle_seconds.observe(time.monotonic() - start,
+                                              loop=step.__name__)
+            except RETRY_EXCEPTIONS as e:
+                logger.error(e, exc_info=True)
+                logger.info('retry ... ')
+            except Exception:
+                logger.error("uncaught exception: %s", traceback.format_exc())
+                self.stopping.set()
+                break
+            await self.wait(interval, wake)
+
+    async def wait(self, interval, wake=None):
+        events = [asyncio.ensure_future(self.stopping.wait())]
+        if wake is not None:
+            events.append(asyncio.ensure_future(wake.wait()))
+        await asyncio.wait(events,
+                           timeout=interval,
+                           return_when=asyncio.FIRST_COMPLETED)
+        for event in events:
+            event.cancel()
+        if wake is not None:
+            wake.clear()
+
+    async def scan_step(self):
+        free = [slot for slot in self.slots if slot.market == None]
+        # while trading the scan keeps the candidates fresh, so a released market is replaced without waiting
+        if len(free) < len(self.slots) or not self.candidates_fresh():
+            self.candidates = await ah.scan_markets(self.client,
+                                                    self.adx_threshold,
+                                                    self.volume_threshold,
+                                                    self.scan_workers)
+            self.last_scan = time.monotonic()
+        await self.fill_slots()
+
+    # hand every free slot the strongest candidate no other slot holds
+    async def fill_slots(self):
+        held = self.markets()
+        candidates = [c for c in self.candidates if c[0] not in held]
+        for slot in self.slots:
+            async with slot.lock:
+                if slot.market != None:
+                    continue
+                if len(candidates) == 0:
+                    logger.info('%sNo trend market detected.', slot.prefix)
+                    break
+                market = candidates.pop(0)[0]
+                self.candidates = [
+                    c for c in self.candidates if c[0] != market
+                ]
+                await slot.assign(market)
+
+    def markets(self):
+        return set(slot.market for slot in self.slots if slot.market != None)
+
+    # keep a connection of the client open for the orders, every keep_alive_seconds
+    async def keep_alive_step(self):
+        if h.transport.keep_alive_seconds:
+            await self.client.futures_ping()
+        else:
+            await self.stopping.wait()
+
+    def candidates_fresh(self):
+        return (self.last_scan is not None
+                and time.monotonic() - self.last_scan < self.SCAN_SECONDS)
+
+    # backfill for the feeds, the history comes from the kline archive when there is one
+    async def fetch_klines(self, **params):
+        if h.kline_archive != None and "startTime" not in params:
+            return await ah.get_klines(self.client,
+                                       params["symbol"],
+                                       params["interval"],
+                                       _limit=params["limit"])
+        return await self.client.futures_klines(**params)
+
+    def start_account_feed(self):
+        self.account = AccountFeed(
+            self.client.futures_stream_get_listen_key,
+            self.client.futures_stream_keepalive,
+            fetch_positions=self.client.futures_position_information,
+            fetch_orders=self.client.futures_get_open_orders,
+            on_fill=self.on_fill,
+            on_position=self.on_position,
+            url=self.stream_url)
+        asyncio.ensure_future(self.account.run())
+
+    def on_fill(self, fill):
+        logger.info('%s: %s %s %s filled at %s', fill.symbol, fill.type,
+                    fill.side, fill.qty, fill.price)
+
+    # the fill of the stop may come after the position update, the step runs in its own task so the feed reads it
+    def on_position(self, symbol, amount, entry):
+        if amount == 0.0:
+            asyncio.ensure_future(self.position_step()).add_done_callback(
+                log_step_error)
+
+    # see Megalodon.position_active
+    async def position_active(self, market, opened_at):
+        if self.account != None and self.account.ready:
+            return not self.account.position_closed(market, opened_at)
+        return await ah.check_in_position(self.client, market)
+
+    # see Megalodon.exit_price
+    async def exit_price(self, market, side, opened_at):
+        if self.account != None:
+            exit_side = "SELL" if side == 1 else "BUY"
+            if self.account.ready:
+                fill = await self.account.wait_fill(market, exit_side,
+                                                    opened_at,
+                                                    self.EXIT_FILL_SECONDS)
+            else:
+                fill = self.account.last_fill(market, exit_side, opened_at)
+            if fill != None:
+                return fill.price
+        return await ah.get_market_price(self.client, market)
+
+    # the margin of a new position, None for the whole USDT balance
+    async def slot_margin(self):
+        return None
+
+    async def signal_step(self):
+        await asyncio.gather(*[slot.signal_step() for slot in self.slots])
+
+    async def position_step(self):
+        await asyncio.gather(*[slot.position_step() for slot in self.slots])
+
+    async def stop(self):
+        for slot in self.slots:
+            slot.stop_feed()
+        if self.account != None:
+            self.account.stop()
+        if self.client is None:
+            return
+        try:
+            if any(slot.side != 0 for slot in self.slots):
+                # close any open positions and open trailing stops
+                await asyncio.gather(*[
+                    slot.close_position() for slot in self.slots
+                    if slot.side != 0
+                ])
+                logger.warning(
+                    'All open positions closed and all open orders canceled.')
+        finally:
+            await asyncio.to_thread(h.trade_journal.close)
+            await self.client.close_connection()
+            self.client = None
+            logger.warning('Bot stopped.')
+
+    def signal_term_handler(self):
+        logger.warning('SIGTERM signal received.')
+        self.stopping.set()
+
+
+def main(bot_class=None, argv=None):
+    parser = argparse.ArgumentParser(
+        description="Trade the trending futures markets.")
+    parser.add_argument(
+        "--preflight",
+        action="store_true",
+        help="warm the connections and caches up before the first cycle")
+    args = parser.parse_args(argv)
+    (bot_class or AsyncMegalodon)().start(preflight=args.preflight)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,434 @@
+"""
+Offline backtest of the Talon Sniper + ADX strategy.
+
+Klines are read from local csv files in the layout of the binance public
+data dumps (`<SYMBOL>-<interval>-<date>.csv`, with or without a header row),
+anywhere below the data directory, or with `--archive` from the kline
+archive of the bot (see archive.py). Nothing is requested from the exchange.
+
+The replay follows the bot:
+
+- the signal of every trading period is engine.trading_signal with
+  use_last=True over the whole history, which is what the SignalStates of
+  the bot hold once seeded. At the close of a base candle a period uses its
+  last closed candle and the periods are combined like combine_signals.
+- a market is selected while the 5m and the 15m ADX of the last closed
+  candles are at or above the threshold (is_trend) and, when a volume
+  threshold is given, the quote volume of the last 24 hours is high enough.
+- a position opens at the close of the first base candle with a combined
+  signal, closes at the close of the first candle where the signal differs
+  from the side and is protected by a TRAILING_STOP_MARKET order with the
+  callback rate of submit_trailing_order, activated at the entry price.
+- without a position the market is released after market_time_out_minutes,
+  after a trailing stop it is released at once.
+
+Signals, the ADX gate and the alignment of the periods are computed on whole
+arrays, the simulation only loops over trades and scans each trade once for
+the trailing stop. The bot acts at most once per base candle. Liquidation is
+not modelled, a trade can lose at most the balance.
+"""
+import argparse
+import glob
+import os
+from collections import namedtuple
+from datetime import datetime, timezone
+
+import numpy as np
+import talib
+from binance.helpers import interval_to_milliseconds
+
+import engine
+
+# columns of the kline arrays, same order as the client klines
+OPEN_TIME, OPEN, HIGH, LOW, CLOSE, VOLUME, CLOSE_TIME, QUOTE_VOLUME = range(8)
+
+DAY_MS = 24 * 60 * 60 * 1000
+
+Trade = namedtuple("Trade", [
+    "side", "entry_time", "entry_price", "exit_time", "exit_price", "cause",
+    "qty", "pnl", "balance"
+])
+
+BacktestResult = namedtuple("BacktestResult",
+                            ["symbol", "trades", "close_time", "equity",
+                             "stats"])
+
+
+# kline files of a symbol and interval, oldest first
+def kline_files(data_dir, symbol, interval):
+    pattern = symbol + "-" + interval
+    files = glob.glob(os.path.join(data_dir, "**", pattern + "*.csv"),
+                      recursive=True)
+    # BTCUSDT-1m-... must not pick up BTCUSDT-1mo-...
+    return sorted(f for f in files
+                  if os.path.basename(f)[len(pattern)] in "-.")
+
+
+# load the stored klines of a symbol as a float64 array, one row per candle
+def load_klines(data_dir, symbol, interval):
+    import pandas as pd
+
+    frames = []
+    for file in kline_files(data_dir, symbol, interval):
+        df = pd.read_csv(file, header=None, float_precision="round_trip")
+        # the newer dumps start with a header row
+        if not str(df.iat[0, 0]).isdigit():
+            df = df.iloc[1:]
+        frames.append(df.iloc[:, :QUOTE_VOLUME + 1].astype("float64"))
+    if len(frames) == 0:
+        raise FileNotFoundError("No klines for %s %s in %s" %
+                                (symbol, interval, data_dir))
+
+    klines = pd.concat(frames).to_numpy()
+    klines = klines[np.argsort(klines[:, OPEN_TIME], kind="stable")]
+    keep = np.ones(len(klines), dtype=bool)
+    keep[1:] = klines[1:, OPEN_TIME] != klines[:-1, OPEN_TIME]
+    return klines[keep]
+
+
+# load the closed klines of a symbol from the kline archive in data_dir, see archive.py
+def load_archive(data_dir, symbol, interval):
+    from archive import archive_name, read_klines
+
+    return read_klines(os.path.join(data_dir, archive_name(symbol, interval)))
+
+
+# store client klines in the format load_klines reads
+def save_klines(path, candles):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as f:
+        for candle in candles:
+            f.write(",".join(str(v) for v in candle) + "\n")
+
+
+# trading_signal of every candle: the value get_signal(..., use_last)[-2] gives once the candle closed
+def signal_series(klines, use_last=True):
+    o, h, l, c, v = engine.convert_candles(klines)
+    h_o, h_h, h_l, h_c = engine.construct_heikin_ashi(o, h, l, c)
+    signal = np.zeros(len(klines), dtype="int64")
+    if len(klines) > 1:
+        signal[1:] = engine.trading_signal(h_o, h_h, h_l, h_c, use_last)
+    return signal
+
+
+# values of the last candle closed at every time of `close_time`, `fill` before the first one
+def align(source_close_time, values, close_time, fill=0):
+    idx = np.searchsorted(source_close_time, close_time, side="right") - 1
+    out = np.asarray(values)[np.maximum(idx, 0)]
+    return np.where(idx >= 0, out, fill)
+
+
+# combine the aligned signals of several periods, see helper.combine_signals
+def combine_series(signals):
+    signals = np.asarray(signals)
+    combined = np.zeros(signals.shape[1], dtype="int64")
+    combined[np.all(signals == 1, axis=0)] = 1
+    combined[np.all(signals == -1, axis=0)] = -1
+    return combined
+
+
+# ADX of every candle, nan during the warm up
+def adx_series(klines, timeperiod=14):
+    return talib.ADX(klines[:, HIGH], klines[:, LOW], klines[:, CLOSE],
+                     timeperiod=timeperiod)
+
+
+# is_trend at every base candle close: the 5m and the 15m ADX at or above the threshold.
+# klines and adx are dicts per interval, see indicators
+def trend_gate(close_time, klines, adx, adx_threshold):
+    adx_5m = align(klines["5m"][:, CLOSE_TIME], adx["5m"], close_time, np.nan)
+    adx_15m = align(klines["15m"][:, CLOSE_TIME], adx["15m"], close_time,
+                    np.nan)
+    # nan compares as False, markets without enough history are never selected
+    return (adx_5m >= adx_threshold) & (adx_15m >= adx_threshold)
+
+
+# the parameter free series of a market: signal_series of every period and the ADX of 5m and 15m
+def indicators(klines, periods, timeperiod=14):
+    signals = dict((p, signal_series(klines[p])) for p in periods)
+    adx = dict((i, adx_series(klines[i], timeperiod)) for i in ("5m", "15m"))
+    return signals, adx
+
+
+# quote volume of the last 24 hours is at or above the threshold, like is_high_volume
+def volume_gate(klines, volume_threshold):
+    if klines.shape[1] <= QUOTE_VOLUME:
+        raise ValueError("The klines have no quote volume column")
+    total = np.concatenate([[0.0], np.cumsum(klines[:, QUOTE_VOLUME])])
+    start = np.searchsorted(klines[:, OPEN_TIME],
+                            klines[:, CLOSE_TIME] + 1 - DAY_MS)
+    volume = total[1:] - total[start]
+    return volume >= volume_threshold
+
+
+# first index in `positions` (sorted) that is >= start, None if there is none
+def _next(positions, start):
+    i = np.searchsorted(positions, start)
+    return positions[i] if i < len(positions) else None
+
+
+# first candle after `entry` hit by the trailing stop, up to and including `last`.
+# returns (index, fill price) or None
+def _trailing_stop(klines, entry, last, side, entry_price, callback):
+    if last <= entry:
+        return None
+    high = klines[entry + 1:last + 1, HIGH]
+    low = klines[entry + 1:last + 1, LOW]
+    if side == 1:
+        peak = np.maximum.accumulate(np.concatenate([[entry_price], high[:-1]]))
+        stop = peak * (1 - callback)
+        hit = np.flatnonzero(low <= stop)
+    else:
+        peak = np.minimum.accumulate(np.concatenate([[entry_price], low[:-1]]))
+        stop = peak * (1 + callback)
+        hit = np.flatnonzero(high >= stop)
+    if len(hit) == 0:
+        return None
+    i = hit[0]
+    open_ = klines[entry + 1 + i, OPEN]
+    # the price gapped through the stop, the market order fills at the open
+    price = min(open_, stop[i]) if side == 1 else max(open_, stop[i])
+    return entry + 1 + i, price
+
+
+def simulate(klines,
+             signal,
+             gate,
+             leverage=10,
+             callback_rate=1.0,
+             timeout_bars=60,
+             fee=0.0004,
+             balance=1000.0):
+    """
+    Replay the bot over base klines.
+
+    signal: combined signal at the close of every base candle.
+    gate: True where the market would be selected by the scanner.
+    callback_rate: trailing stop callback in percent, timeout_bars: market_time_out_minutes in base candles.
+    fee: taker fee per side on the notional.
+
+    Returns (list of Trade, equity at every base candle close).
+    """
+    n = len(klines)
+    close = klines[:, CLOSE]
+    signal = np.asarray(signal)
+    callback = callback_rate / 100
+
+    gate_at = np.flatnonzero(gate)
+    signal_at = np.flatnonzero(signal != 0)
+    # first candle of every run of equal signals, the run of candle i ends before change_at[i]
+    change_at = np.concatenate([np.flatnonzero(np.diff(signal) != 0) + 1, [n]])
+
+    trades = []
+    equity = np.empty(n)
+    realized_to = 0
+    i = 0
+    while i < n:
+        # look for market
+        selected = _next(gate_at, i)
+        if selected is None:
+            break
+        release = min(selected + timeout_bars, n - 1)
+        i = selected
+        while i <= release:
+            # listen for a signal
+            entry = _next(signal_at, i)
+            if entry is None or entry > release:
+                i = release + 1
+                break
+            side = int(signal[entry])
+            entry_price = close[entry]
+            qty = balance / entry_price * leverage * 0.99
+
+            exit_ = min(change_at[np.searchsorted(change_at, entry, "right")],
+                        n - 1)
+            cause = "Signal Change" if exit_ > entry and signal[exit_] != side \
+                else "End of data"
+            exit_price = close[exit_]
+            stop = _trailing_stop(klines, entry, exit_, side, entry_price,
+                                  callback)
+            if stop is not None:
+                # the stop works inside the candle, before its close is seen
+                exit_, exit_price = stop
+                cause = "Trailing Stop"
+
+            cost = fee * qty * (entry_price + exit_price)
+            pnl = max(side * qty * (exit_price - entry_price) - cost, -balance)
+
+            equity[realized_to:entry] = balance
+            equity[entry:exit_] = (balance +
+                                   side * qty * (close[entry:exit_] - entry_price) -
+                                   fee * qty * entry_price)
+            balance += pnl
+            realized_to = exit_
+
+            trades.append(
+                Trade(side, int(klines[entry, CLOSE_TIME]), entry_price,
+                      int(klines[exit_, CLOSE_TIME]), exit_price, cause, qty,
+                      pnl, balance))
+
+            i = exit_ + 1
+            if cause != "Signal Change":
+                # the market is released after a trailing stop
+                break
+            if exit_ >= release:
+                break
+
+    equity[realized_to:] = balance
+    return trades, equity
+
+
+# PnL, drawdown and trade statistics of a simulation
+def summarize(trades, equity, balance=1000.0):
+    pnl = np.array([t.pnl for t in trades], dtype="float64")
+    wins = pnl[pnl > 0]
+    losses = pnl[pnl <= 0]
+    peak = np.maximum.accumulate(equity) if len(equity) else equity
+    drawdown = 1 - equity / peak if len(equity) else np.zeros(1)
+    causes = {}
+    for t in trades:
+        causes[t.cause] = causes.get(t.cause, 0) + 1
+
+    return {
+        "trades": len(trades),
+        "long": sum(1 for t in trades if t.side == 1),
+        "short": sum(1 for t in trades if t.side == -1),
+        "wins": len(wins),
+        "win_rate": len(wins) / len(trades) if trades else 0.0,
+        "pnl": float(pnl.sum()),
+        "final_balance": float(equity[-1]) if len(equity) else balance,
+        "total_return": (float(equity[-1]) / balance - 1) if len(equity) else 0.0,
+        "max_drawdown": float(np.max(drawdown)) if len(drawdown) else 0.0,
+        "avg_pnl": float(pnl.mean()) if trades else 0.0,
+        "profit_factor": float(wins.sum() / -losses.sum())
+        if losses.sum() < 0 else float("inf") if len(wins) else 0.0,
+        "causes": causes,
+    }
+
+
+def backtest(klines,
+             periods=["1m", "5m", "15m"],
+             adx_threshold=30,
+             volume_threshold=None,
+             leverage=10,
+             trailing_percentage=1.0,
+             market_time_out_minutes=60,
+             fee=0.0004,
+             balance=1000.0,
+             start=None,
+             end=None,
+             symbol=None,
+             signals=None,
+             adx=None):
+    """
+    Backtest one market.
+
+    klines:dict: kline array per interval, it needs every trading period plus 5m and 15m for the ADX.
+    The smallest trading period is the base timeline. start and end are milliseconds timestamps, the
+    history before start is still used to warm up the indicators.
+    signals, adx: the series of indicators, computed from klines when not given.
+    """
+    base = min(periods, key=interval_to_milliseconds)
+    base_klines = klines[base]
+    close_time = base_klines[:, CLOSE_TIME]
+
+    if signals is None or adx is None:
+        signals, adx = indicators(klines, periods)
+
+    signal = combine_series([
+        align(klines[p][:, CLOSE_TIME], signals[p], close_time)
+        for p in periods
+    ])
+    gate = trend_gate(close_time, klines, adx, adx_threshold)
+    if volume_threshold is not None:
+        gate &= volume_gate(base_klines, volume_threshold)
+
+    lo = 0 if start is None else np.searchsorted(close_time, start)
+    hi = len(close_time) if end is None else np.searchsorted(
+        close_time, end, "right")
+    base_ms = interval_to_milliseconds(base)
+    timeout_bars = int(np.ceil(market_time_out_minutes * 60000 / base_ms))
+
+    trades, equity = simulate(base_klines[lo:hi], signal[lo:hi], gate[lo:hi],
+                              leverage, trailing_percentage, timeout_bars,
+                              fee, balance)
+    return BacktestResult(symbol, trades, close_time[lo:hi], equity,
+                          summarize(trades, equity, balance))
+
+
+# load the klines of a symbol from data_dir and backtest it, see backtest for the options.
+# archive reads a kline archive instead of csv files.
+def backtest_symbol(data_dir,
+                    symbol,
+                    periods=["1m", "5m", "15m"],
+                    archive=False,
+                    **kwargs):
+    intervals = set(periods) | set(["5m", "15m"])
+    load = load_archive if archive else load_klines
+    klines = dict(
+        (interval, load(data_dir, symbol, interval)) for interval in intervals)
+    return backtest(klines, periods, symbol=symbol, **kwargs)
+
+
+# milliseconds timestamp of a YYYY-MM-DD date in UTC
+def parse_date(date):
+    if date is None:
+        return None
+    return int(
+        datetime.strptime(date, "%Y-%m-%d").replace(
+            tzinfo=timezone.utc).timestamp() * 1000)
+
+
+def main(argv=None):
+    import config as cfg
+
+    settings = cfg.getBotSettings()
+    parser = argparse.ArgumentParser(
+        description="Backtest the strategy on stored klines.")
+    parser.add_argument("symbols", nargs="+")
+    parser.add_argument("--data", default="data")
+    parser.add_argument("--archive",
+                        action="store_true",
+                        help="--data is a kline archive")
+    parser.add_argument("--start", help="YYYY-MM-DD")
+    parser.add_argument("--end", help="YYYY-MM-DD")
+    parser.add_argument("--balance", type=float, default=1000.0)
+    parser.add_argument("--fee", type=float, default=0.0004)
+    parser.add_argument("--volume-threshold", type=float, default=None)
+    parser.add_argument("--periods", default=settings.trading_periods)
+    parser.add_argument("--leverage", type=int, default=int(settings.leverage))
+    parser.add_argument("--trailing-percentage",
+                        type=float,
+                        default=float(settings.trailing_percentage))
+    parser.add_argument("--adx-threshold",
+                        type=float,
+                        default=float(settings.market.adx_threshold))
+    parser.add_argument("--market-time-out-minutes",
+                        type=float,
+                        default=float(settings.market.market_time_out_minutes))
+    args = parser.parse_args(argv)
+
+    for symbol in args.symbols:
+        result = backtest_symbol(
+            args.data,
+            symbol,
+            periods=args.periods.split(","),
+            archive=args.archive,
+            adx_threshold=args.adx_threshold,
+            volume_threshold=args.volume_threshold,
+            leverage=args.leverage,
+            trailing_percentage=args.trailing_percentage,
+            market_time_out_minutes=args.market_time_out_minutes,
+            fee=args.fee,
+            balance=args.balance,
+            start=parse_date(args.start),
+            end=parse_date(args.end))
+        stats = result.stats
+        print("%s: %d trades, win rate %.1f%%, return %.2f%%, max drawdown %.2f%%, %s" %
+              (symbol, stats["trades"], stats["win_rate"] * 100,
+               stats["total_return"] * 100, stats["max_drawdown"] * 100,
+               stats["causes"]))
+
+
+if __name__ == '__main__':
+    main()
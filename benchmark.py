@@ -0,0 +1,604 @@
+"""
+Benchmarks of the signal and market scan hot paths.
+
+Every benchmark runs on kline fixtures: 1m klines recorded from the exchange
+(`python3 benchmark.py record BTCUSDT ... --fixtures benchmarks/klines`) or,
+without recorded ones, seeded synthetic paths of fake_exchange.py, so two
+runs see the same candles. The functions that talk to the exchange run
+against a local fake_exchange.FakeExchangeServer with an empty kline cache,
+so every call downloads its klines like a cold call of the bot does.
+
+Each benchmark reports the median and the fastest time of a call and the
+peak memory traced by tracemalloc during one call. The peak covers every
+thread, the fake server included. `megalodon_cycle` runs Megalodon.start
+on the fake server, one cycle per 1m candle, the bot sleeps are skipped and
+reported as `sleep_ms` instead.
+
+The results are compared with a stored baseline (benchmarks/baseline.json),
+a fastest time or peak memory more than `tolerance` above it fails the run;
+the fastest call is the one least disturbed by the rest of the machine.
+Baselines are only comparable on the machine and fixtures they were taken
+on, `--update` stores a new one.
+"""
+import argparse
+import glob
+import json
+import logging
+import os
+import platform
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from types import SimpleNamespace
+from unittest import mock
+
+import numpy as np
+
+import backtest as bt
+import config as cfg
+import engine
+import helper as h
+import metrics
+from cache import KlineCache
+from candles import CandleBuffer, stack
+from fake_exchange import FakeExchange, FakeExchangeServer, synthetic_klines
+from wilder import WilderState
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+BASELINE = os.path.join(BASE_DIR, "benchmarks", "baseline.json")
+
+FIXTURES = os.path.join(BASE_DIR, "benchmarks", "klines")
+
+# synthetic fixtures: one random walk per symbol
+SYNTHETIC_SYMBOLS = [
+    "BTCUSDT", "ETHUSDT", "BNBUSDT", "XRPUSDT", "ADAUSDT", "DOTUSDT",
+    "LTCUSDT", "LINKUSDT"
+]
+SYNTHETIC_CANDLES = 12000
+
+# modules the bot starts without, they are imported on first use or not at all
+HEAVY_MODULES = ["pandas", "talib", "binance_f"]
+
+# the exchange starts here, 500 15m candles of history are needed
+START_CANDLE = 8000
+
+PERIODS = ["1m", "5m", "15m"]
+
+# markets of the batch_indicators benchmark, a universe of USDT perpetuals
+BATCH_SYMBOLS = 200
+
+# differences below these over the baseline are noise
+TIME_SLACK_MS = 0.05
+MEMORY_SLACK_KB = 64
+
+
+# 1m klines of the recorded fixtures, synthetic ones when there are none
+def load_fixtures(path=None):
+    klines = {}
+    if path is not None:
+        for file in sorted(glob.glob(os.path.join(path, "*-1m*.csv"))):
+            symbol = os.path.basename(file).split("-")[0]
+            if symbol not in klines:
+                klines[symbol] = bt.load_klines(path, symbol, "1m")
+    if len(klines) > 0:
+        return "recorded", klines
+    return "synthetic", dict(
+        (symbol, synthetic_klines(SYNTHETIC_CANDLES, seed=seed))
+        for seed, symbol in enumerate(SYNTHETIC_SYMBOLS))
+
+
+# download the last `candles` closed 1m klines of every symbol into fixture files
+def record(client, symbols, path, candles=SYNTHETIC_CANDLES, limit=1500):
+    now = int(time.time() * 1000)
+    for symbol in symbols:
+        start = now - candles * 60 * 1000
+        rows = []
+        while True:
+            page = client.futures_klines(symbol=symbol,
+                                         interval="1m",
+                                         startTime=start,
+                                         limit=limit)
+            page = [c for c in page if int(c[6]) < now]
+            rows.extend(page)
+            if len(page) < limit:
+                break
+            start = int(page[-1][0]) + 1
+        bt.save_klines(os.path.join(path, symbol + "-1m.csv"), rows)
+        print("%s: %d klines" % (symbol, len(rows)))
+
+
+class Context():
+    """
+    Fixtures of one run; the fake exchange, its server and a client on it.
+    """
+    def __init__(self, klines, latency=0.0):
+        self.klines = klines
+        self.symbol = sorted(klines)[0]
+        self.exchange = FakeExchange(klines, balance=10000.0)
+        self.exchange.advance(START_CANDLE)
+        self.server = FakeExchangeServer(self.exchange,
+                                         latency=latency).start()
+        with mock.patch.object(cfg, "getAPIKeys", _keys):
+            self.client = h.init_client(self.server.url)
+        self.candles = self.exchange.get_klines(self.symbol, "15m", 500)
+        # the 15m candle after the last one
+        last = self.candles[-1]
+        self.next_candle = [last[0] + 900000] + last[1:6] + [
+            last[6] + 900000
+        ] + last[7:]
+
+    def close(self):
+        self.server.stop()
+
+
+# never send real keys to the fake server
+def _keys():
+    return SimpleNamespace(api_key="benchmark", api_secret="benchmark")
+
+
+def _measure(func, repeat, setup=None):
+    if setup is not None:
+        setup()
+    func()
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    if setup is not None:
+        setup()
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {
+        "calls": repeat,
+        "median_ms": statistics.median(times) * 1000,
+        "min_ms": min(times) * 1000,
+        "peak_kb": peak / 1024,
+    }
+
+
+def _python_path(ctx):
+    o, hi, lo, c, v = h.convert_candles(ctx.candles)
+    return (o, hi, lo, c) + h.construct_heikin_ashi(o, hi, lo, c)
+
+
+def _engine_path(ctx):
+    o, hi, lo, c, v = engine.convert_candles(ctx.candles)
+    return (o, hi, lo, c) + engine.construct_heikin_ashi(o, hi, lo, c)
+
+
+def _cold():
+    h.kline_cache.clear()
+
+
+def bench_convert_candles(ctx, repeat):
+    return _measure(lambda: h.convert_candles(ctx.candles), repeat)
+
+
+def bench_engine_convert_candles(ctx, repeat):
+    return _measure(lambda: engine.convert_candles(ctx.candles), repeat)
+
+
+def bench_construct_heikin_ashi(ctx, repeat):
+    o, hi, lo, c = _python_path(ctx)[:4]
+    return _measure(lambda: h.construct_heikin_ashi(o, hi, lo, c), repeat)
+
+
+def bench_candle_buffer_load(ctx, repeat):
+    buffer = CandleBuffer(interval="15m")
+    return _measure(lambda: buffer.update(ctx.candles), repeat, buffer.clear)
+
+
+# the download of the next cycle, one candle closed and a new one opened
+def bench_candle_buffer_update(ctx, repeat):
+    buffer = CandleBuffer(interval="15m")
+    download = ctx.candles[1:] + [ctx.next_candle]
+
+    def setup():
+        buffer.clear()
+        buffer.update(ctx.candles)
+
+    return _measure(lambda: buffer.update(download), repeat, setup)
+
+
+# one closed candle through the streaming ADX and ATR of a seeded state
+def bench_wilder_state_update(ctx, repeat):
+    state = WilderState(ctx.symbol, "15m")
+    return _measure(lambda: state.update(ctx.candles[-1]), repeat,
+                    lambda: state.seed(ctx.candles))
+
+
+# ADX, ATR and signal of BATCH_SYMBOLS markets in one pass, the candles of the symbol scaled per market
+def bench_batch_indicators(ctx, repeat):
+    buffer = CandleBuffer(interval="15m")
+    buffer.update(ctx.candles)
+    scale = np.linspace(0.5, 2.0, BATCH_SYMBOLS)[:, None]
+    matrix = stack([buffer.columns()] * BATCH_SYMBOLS)
+    matrix = matrix._replace(open=matrix.open * scale,
+                             high=matrix.high * scale,
+                             low=matrix.low * scale,
+                             close=matrix.close * scale)
+    return _measure(lambda: h.batch_indicators(matrix), repeat)
+
+
+def bench_engine_construct_heikin_ashi(ctx, repeat):
+    o, hi, lo, c = _engine_path(ctx)[:4]
+    return _measure(lambda: engine.construct_heikin_ashi(o, hi, lo, c),
+                    repeat)
+
+
+def bench_avarage_true_range(ctx, repeat):
+    h_o, h_h, h_l, h_c = _python_path(ctx)[4:]
+    return _measure(lambda: h.avarage_true_range(h_h, h_l, h_c), repeat)
+
+
+def bench_engine_avarage_true_range(ctx, repeat):
+    h_o, h_h, h_l, h_c = _engine_path(ctx)[4:]
+    return _measure(lambda: engine.avarage_true_range(h_h, h_l, h_c), repeat)
+
+
+def bench_trading_signal(ctx, repeat):
+    h_o, h_h, h_l, h_c = _python_path(ctx)[4:]
+    return _measure(lambda: h.trading_signal(h_o, h_h, h_l, h_c, True),
+                    repeat)
+
+
+def bench_engine_trading_signal(ctx, repeat):
+    h_o, h_h, h_l, h_c = _engine_path(ctx)[4:]
+    return _measure(lambda: engine.trading_signal(h_o, h_h, h_l, h_c, True),
+                    repeat)
+
+
+def bench_get_multi_scale_signal(ctx, repeat):
+    return _measure(
+        lambda: h.get_multi_scale_signal(ctx.client, ctx.symbol, PERIODS),
+        repeat, _cold)
+
+
+def bench_adx_5min(ctx, repeat):
+    return _measure(lambda: h.adx_5min(ctx.client, ctx.symbol), repeat,
+                    _cold)
+
+
+def bench_adx_15min(ctx, repeat):
+    return _measure(lambda: h.adx_15min(ctx.client, ctx.symbol), repeat,
+                    _cold)
+
+
+def bench_get_valid_market(ctx, repeat):
+    return _measure(lambda: h.get_valid_market(ctx.client, 0, 0), repeat,
+                    _cold)
+
+
+def bench_log_trade(ctx, repeat):
+    with tempfile.TemporaryDirectory() as tmp:
+        journal = h.trade_journal
+        h.trade_journal = h.TradeJournal(os.path.join(tmp, "trade_log.csv"))
+        try:
+            return _measure(
+                lambda: h.log_trade(_qty=1.0,
+                                    _market=ctx.symbol,
+                                    _leverage=10,
+                                    _side=1,
+                                    _cause="Signal Change",
+                                    _market_price=100.0,
+                                    _type="BUY"), repeat)
+        finally:
+            h.trade_journal.close()
+            h.trade_journal = journal
+
+
+# the time module of the bot without its sleeps, the seconds it would have slept are added up
+class _NoSleep():
+    def __init__(self):
+        self.slept = 0.0
+
+    def sleep(self, seconds):
+        self.slept += seconds
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+
+# settings.json with every market passing the scan, the journal in `path`, no metrics endpoint and no pings
+def _bot_settings(path):
+    with open(os.path.join(BASE_DIR, "settings.json")) as f:
+        settings = json.load(f, object_hook=lambda d: SimpleNamespace(**d))
+    settings.trading_periods = ",".join(PERIODS)
+    settings.market.adx_threshold = 0
+    settings.market.volume_threshold = 0
+    settings.trade_log.path = os.path.join(path, "trade_log.csv")
+    settings.metrics.port = None
+    settings.http.keep_alive_seconds = None
+    settings.metrics.summary_minutes = None
+    settings.kline_archive.path = None
+    return settings
+
+
+def _run_bot(klines, cycles, latency, traced):
+    from megalodon import Megalodon
+
+    class BenchBot(Megalodon):
+        # check the signal and the position every cycle with requests, like the bot does until its feeds are ready
+        def start_feed(self):
+            pass
+
+        def start_account_feed(self):
+            pass
+
+        # one cycle per candle: the time moves one minute instead of waiting for the stream
+        def wait_for_candle(self, timeout):
+            now = time.perf_counter()
+            times.append(now - self.cycle_start)
+            sleeps.append(no_sleep.slept)
+            no_sleep.slept = 0.0
+            if traced:
+                peaks.append(tracemalloc.get_traced_memory()[1])
+            if len(times) == cycles:
+                raise KeyboardInterrupt
+            ctx.exchange.advance()
+            if traced:
+                tracemalloc.reset_peak()
+            self.cycle_start = time.perf_counter()
+
+        def stop(self):
+            h.trade_journal.close()
+
+    times, sleeps, peaks = [], [], []
+    no_sleep = _NoSleep()
+    ctx = Context(klines, latency)
+    journal = h.trade_journal
+    resample_base = h.resample_base
+    logger = logging.getLogger("bot")
+    level = logger.level
+    logger.setLevel(logging.CRITICAL)
+    # Megalodon installs its SIGTERM handler for the whole process
+    sigterm = signal.getsignal(signal.SIGTERM)
+    with tempfile.TemporaryDirectory() as tmp:
+        try:
+            with mock.patch.object(cfg, "getBotSettings",
+                                   lambda: _bot_settings(tmp)), \
+                    mock.patch.object(h, "init_client",
+                                      lambda: ctx.client), \
+                    mock.patch.object(metrics, "time", no_sleep):
+                # klines expire on the time of the fake exchange
+                h.kline_cache = KlineCache(
+                    clock=lambda: ctx.exchange.now / 1000)
+                bot = BenchBot()
+                if traced:
+                    tracemalloc.start()
+                bot.cycle_start = time.perf_counter()
+                bot.start()
+        finally:
+            if traced:
+                tracemalloc.stop()
+            h.trade_journal = journal
+            h.resample_base = resample_base
+            signal.signal(signal.SIGTERM, sigterm)
+            logger.setLevel(level)
+            ctx.close()
+    if len(times) < cycles:
+        raise RuntimeError("Megalodon stopped after %d of %d cycles" %
+                           (len(times), cycles))
+    return times, sleeps, peaks
+
+
+def import_times(module="megalodon"):
+    """
+    Import `module` in a new interpreter with `python -X importtime`.
+
+    Returns {name: (self seconds, cumulative seconds)} of every module the import loaded.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import " + module],
+        cwd=BASE_DIR,
+        capture_output=True,
+        text=True,
+        check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        fields = line.split("|")
+        if not line.startswith("import time:") or len(fields) != 3:
+            continue
+        try:
+            self_us = int(fields[0][len("import time:"):])
+            cumulative_us = int(fields[1])
+        except ValueError:
+            # the header line
+            continue
+        times[fields[2].strip()] = (self_us / 1e6, cumulative_us / 1e6)
+    return times
+
+
+# a bot process up to its first cycle: the imports of megalodon in a new interpreter
+def bench_startup(ctx, repeat):
+    return _measure(
+        lambda: subprocess.run([sys.executable, "-c", "import megalodon"],
+                               cwd=BASE_DIR,
+                               check=True), repeat)
+
+
+def bench_megalodon_cycle(ctx, cycles):
+    times, sleeps, peaks = _run_bot(ctx.klines, cycles,
+                                    ctx.server.latency, False)
+    peaks = _run_bot(ctx.klines, cycles, ctx.server.latency, True)[2]
+    return {
+        "calls": cycles,
+        "median_ms": statistics.median(times) * 1000,
+        "min_ms": min(times) * 1000,
+        "max_ms": max(times) * 1000,
+        "sleep_ms": sum(sleeps) / cycles * 1000,
+        "peak_kb": max(peaks) / 1024,
+    }
+
+
+# name, function and calls of every benchmark
+BENCHMARKS = [
+    ("convert_candles", bench_convert_candles, 200),
+    ("engine.convert_candles", bench_engine_convert_candles, 200),
+    ("candle_buffer.load", bench_candle_buffer_load, 200),
+    ("candle_buffer.update", bench_candle_buffer_update, 200),
+    ("wilder_state.update", bench_wilder_state_update, 200),
+    ("batch_indicators", bench_batch_indicators, 10),
+    ("construct_heikin_ashi", bench_construct_heikin_ashi, 200),
+    ("engine.construct_heikin_ashi", bench_engine_construct_heikin_ashi, 200),
+    ("avarage_true_range", bench_avarage_true_range, 50),
+    ("engine.avarage_true_range", bench_engine_avarage_true_range, 200),
+    ("trading_signal", bench_trading_signal, 50),
+    ("engine.trading_signal", bench_engine_trading_signal, 200),
+    ("get_multi_scale_signal", bench_get_multi_scale_signal, 20),
+    ("adx_5min", bench_adx_5min, 20),
+    ("adx_15min", bench_adx_15min, 20),
+    ("get_valid_market", bench_get_valid_market, 10),
+    ("log_trade", bench_log_trade, 1000),
+    ("megalodon_cycle", bench_megalodon_cycle, 30),
+    ("startup", bench_startup, 5),
+]
+
+
+def run_benchmarks(names=None, fixtures=None, repeat=None, latency=0.0):
+    """
+    Run the benchmarks called `names`, all of them by default.
+
+    repeat: calls of every benchmark instead of its default.
+    Returns {"fixtures": "recorded" or "synthetic", "results": {name: result}}.
+    """
+    known = [b[0] for b in BENCHMARKS]
+    unknown = set(names or []) - set(known)
+    if unknown:
+        raise ValueError("Unknown benchmarks: " + ", ".join(sorted(unknown)))
+
+    source, klines = load_fixtures(fixtures)
+    cache = h.kline_cache
+    ctx = Context(klines, latency)
+    results = {}
+    try:
+        for name, func, calls in BENCHMARKS:
+            if names is None or name in names:
+                results[name] = func(ctx, calls if repeat is None else repeat)
+    finally:
+        ctx.close()
+        h.kline_cache = cache
+    return {"fixtures": source, "results": results}
+
+
+# (name, field, value, baseline value) of every result more than `tolerance` above the baseline
+def compare(run, baseline, tolerance=1.0):
+    if run["fixtures"] != baseline["fixtures"]:
+        raise ValueError("The baseline was taken on %s fixtures, not %s" %
+                         (baseline["fixtures"], run["fixtures"]))
+    regressions = []
+    for name, result in sorted(run["results"].items()):
+        base = baseline["results"].get(name)
+        if base is None:
+            continue
+        if (result["min_ms"] > base["min_ms"] * (1 + tolerance)
+                and result["min_ms"] - base["min_ms"] > TIME_SLACK_MS):
+            regressions.append(
+                (name, "min_ms", result["min_ms"], base["min_ms"]))
+        if (result["peak_kb"] > base["peak_kb"] * (1 + tolerance)
+                and result["peak_kb"] - base["peak_kb"] > MEMORY_SLACK_KB):
+            regressions.append(
+                (name, "peak_kb", result["peak_kb"], base["peak_kb"]))
+    return regressions
+
+
+def load_baseline(path=BASELINE):
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_baseline(run, path=BASELINE):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    baseline = dict(run,
+                    python=platform.python_version(),
+                    machine=platform.machine())
+    with open(path, "w") as f:
+        json.dump(baseline, f, indent=4, sort_keys=True)
+        f.write("\n")
+
+
+def report(run, baseline=None):
+    print("%-30s %7s %11s %11s %11s %11s" %
+          ("benchmark", "calls", "median ms", "min ms", "peak KB",
+           "base min"))
+    for name, result in run["results"].items():
+        base = ""
+        if baseline is not None and name in baseline["results"]:
+            base = "%.3f" % baseline["results"][name]["min_ms"]
+        print("%-30s %7d %11.3f %11.3f %11.1f %11s" %
+              (name, result["calls"], result["median_ms"], result["min_ms"],
+               result["peak_kb"], base))
+        if "sleep_ms" in result:
+            print("%-30s %7s %11.3f" % ("  bot sleeps", "", result["sleep_ms"]))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the signal and market scan hot paths.")
+    subparsers = parser.add_subparsers(dest="command")
+    run_parser = subparsers.add_parser("run", help="run the benchmarks")
+    run_parser.add_argument("names", nargs="*", help="all when not given")
+    run_parser.add_argument("--fixtures", default=FIXTURES)
+    run_parser.add_argument("--baseline", default=BASELINE)
+    run_parser.add_argument("--update",
+                            action="store_true",
+                            help="store the results as the new baseline")
+    run_parser.add_argument("--tolerance", type=float, default=1.0)
+    run_parser.add_argument("--repeat", type=int)
+    run_parser.add_argument("--latency",
+                            type=float,
+                            default=0.0,
+                            help="seconds added to every fake exchange answer")
+    record_parser = subparsers.add_parser(
+        "record", help="record 1m kline fixtures from the exchange")
+    record_parser.add_argument("symbols", nargs="+")
+    record_parser.add_argument("--fixtures", default=FIXTURES)
+    record_parser.add_argument("--candles",
+                               type=int,
+                               default=SYNTHETIC_CANDLES)
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if len(argv) == 0 or argv[0] not in ("run", "record", "-h", "--help"):
+        argv = ["run"] + argv
+    args = parser.parse_args(argv)
+
+    if args.command == "record":
+        record(h.init_client(), args.symbols, args.fixtures, args.candles)
+        return 0
+
+    run = run_benchmarks(args.names or None, args.fixtures, args.repeat,
+                         args.latency)
+    baseline = load_baseline(args.baseline)
+    report(run, baseline)
+    if args.update:
+        save_baseline(run, args.baseline)
+        print("Baseline stored in %s" % args.baseline)
+        return 0
+    if baseline is None:
+        print("No baseline in %s, run with --update to store one." %
+              args.baseline)
+        return 0
+
+    regressions = compare(run, baseline, args.tolerance)
+    for name, field, value, base in regressions:
+        print("REGRESSION %s %s: %.3f, baseline %.3f" %
+              (name, field, value, base))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,77 @@
+"""
+Kline cache shared by the signal and trend helpers.
+
+Entries are keyed by (symbol, interval, contract type) and stay valid until
+the candle that was open when they were downloaded closes, so every closed
+candle read from the cache is the same one the exchange would return. Only
+the last (still open) candle may be stale. The cache keeps at most
+`max_symbols` symbols, the least recently used one is dropped first.
+
+The candles are parsed into the columnar buffers of `store` (see candles.py)
+by `columns`, each candle only once.
+"""
+import time
+from collections import OrderedDict
+from threading import Lock
+
+from candles import CandleStore
+
+
+class KlineCache():
+    def __init__(self, max_symbols=64, clock=time.time):
+        self.max_symbols = max_symbols
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._symbols = OrderedDict()
+        self._lock = Lock()
+        self.store = CandleStore(max_symbols=max_symbols)
+
+    def __len__(self):
+        return len(self._symbols)
+
+    # return cached candles or None, served if the entry was downloaded with at least `limit` candles
+    def get(self, symbol, interval, contract_type=None, limit=500):
+        now_ms = int(self.clock() * 1000)
+        with self._lock:
+            entries = self._symbols.get(symbol)
+            entry = None
+            if entries is not None:
+                entry = entries.get((interval, contract_type))
+            if entry is None or now_ms >= entry[0] or entry[1] < limit:
+                self.misses += 1
+                return None
+            self._symbols.move_to_end(symbol)
+            self.hits += 1
+            return entry[2][-limit:]
+
+    def put(self, symbol, interval, candles, contract_type=None, limit=500):
+        if len(candles) == 0:
+            return
+        # close time of the candle still open, the entry expires right after it
+        expires_ms = int(candles[-1][6]) + 1
+        with self._lock:
+            entries = self._symbols.setdefault(symbol, {})
+            entries[(interval, contract_type)] = (expires_ms, limit, candles)
+            self._symbols.move_to_end(symbol)
+            while len(self._symbols) > self.max_symbols:
+                self._symbols.popitem(last=False)
+
+    # candles.Candles of klines of a symbol: column views of its buffer in store, the new klines are parsed into it
+    def columns(self, symbol, interval, candles, contract_type=None):
+        buffer = self.store.update(symbol, interval, candles, contract_type)
+        return buffer.columns(len(candles))
+
+    def clear(self):
+        self.store.clear()
+        with self._lock:
+            self._symbols.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "symbols": len(self._symbols)
+        }
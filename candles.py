@@ -0,0 +1,309 @@
+"""
+Columnar candle store.
+
+A CandleBuffer holds the klines of one (symbol, interval, contract type) in
+a preallocated float64 block, one row per field (see FIELDS), used as a ring
+of `capacity` candles. Every candle is written twice, at its ring position
+and `capacity` further, so the last n candles are always one contiguous
+slice: `columns(n)` returns views of it without copying, ready for the
+engine and talib functions.
+
+`update` merges a kline download of the REST client or a stream: only the
+candles from the last one held on are parsed, the older ones are already
+in the buffer. A download that does not reach back to the buffer, or whose
+newest closed candle differs from the one held, starts it over, so does
+one reaching further back than a buffer that is not full yet. A view
+stays valid until the next update of its buffer.
+
+A Resampler builds the klines of a longer interval from base candles, e.g.
+the 5m and 15m klines from the 1m ones: open, high, low and close are the
+first, highest, lowest and last ones of every bucket, the volumes are
+summed. It is seeded with a download of the longer interval once, after
+that the base candles keep it up to date.
+
+`stack` puts the candles of several symbols into (symbols, candles)
+matrices for the `_batch` functions of engine.py and wilder.py.
+
+CandleStore keeps the buffers and resamplers of at most `max_symbols`
+symbols, the least recently used one is dropped first, like the KlineCache.
+"""
+from collections import OrderedDict, namedtuple
+from threading import Lock
+
+import numpy as np
+from binance.helpers import interval_to_milliseconds
+
+FIELDS = ('open_time', 'open', 'high', 'low', 'close', 'volume', 'close_time',
+          'quote_volume')
+
+Candles = namedtuple('Candles', FIELDS)
+
+DAY_MS = 24 * 60 * 60 * 1000
+
+
+class CandleBuffer():
+    def __init__(self, capacity=512, interval=None):
+        """
+        interval:str: kline interval of the candles, needed to tell a download that leaves a gap.
+        """
+        self.capacity = int(capacity)
+        self.interval_ms = None
+        if interval is not None:
+            self.interval_ms = interval_to_milliseconds(interval)
+        self.data = np.zeros((len(FIELDS), 2 * self.capacity),
+                             dtype="float64")
+        self.head = 0
+        self.count = 0
+        self.parsed = 0
+        self._lock = Lock()
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def last_open_time(self):
+        if self.count == 0:
+            return None
+        return int(self.data[0, self.head - 1 + self.capacity])
+
+    def _first_open_time(self):
+        return int(self.data[0, self.head - self.count + self.capacity])
+
+    def clear(self):
+        with self._lock:
+            self.head = 0
+            self.count = 0
+
+    def _write(self, block):
+        n = len(block)
+        if n > self.capacity:
+            block = block[-self.capacity:]
+            n = self.capacity
+        first = min(n, self.capacity - self.head)
+        for rows, start in ((block[:first], self.head),
+                            (block[first:], 0)):
+            if len(rows) == 0:
+                continue
+            columns = rows.T
+            self.data[:, start:start + len(rows)] = columns
+            self.data[:, start + self.capacity:start + self.capacity +
+                      len(rows)] = columns
+        self.head = (self.head + n) % self.capacity
+        self.count = min(self.count + n, self.capacity)
+
+    def update(self, candles):
+        """
+        Merge klines, oldest first, in the list format of the REST client.
+
+        The candle open at the end of the buffer is replaced, newer ones are appended. Returns the
+        number of candles parsed.
+        """
+        if len(candles) == 0:
+            return 0
+        with self._lock:
+            last = self.last_open_time
+            start = 0
+            if last is not None:
+                first = int(candles[0][0])
+                if (first > last and self.interval_ms is not None
+                        and first - last > self.interval_ms):
+                    # candles are missing in between, start over
+                    self.head = 0
+                    self.count = 0
+                elif (first < self._first_open_time()
+                      and self.count < self.capacity):
+                    # a longer download than the one held, take all of it
+                    self.head = 0
+                    self.count = 0
+                else:
+                    start = len(candles)
+                    while start > 0 and int(candles[start - 1][0]) >= last:
+                        start -= 1
+                    if start > 0 and self._differs(candles[start - 1]):
+                        # the history differs from the one held, start over
+                        self.head = 0
+                        self.count = 0
+                        start = 0
+                    elif (start < len(candles)
+                          and int(candles[start][0]) == last):
+                        # the last candle held is replaced
+                        self.head = (self.head - 1) % self.capacity
+                        self.count -= 1
+            rows = candles[start:]
+            if len(rows) == 0:
+                return 0
+            # shorter rows leave the fields they lack at zero
+            width = min(len(rows[0]), len(FIELDS))
+            block = np.zeros((len(rows), len(FIELDS)), dtype="float64")
+            if isinstance(rows, np.ndarray):
+                block[:, :width] = rows[:, :width]
+            else:
+                block[:, :width] = np.fromiter(
+                    (float(value) for row in rows for value in row[:width]),
+                    dtype="float64",
+                    count=len(rows) * width).reshape(len(rows), width)
+            self._write(block)
+            self.parsed += len(rows)
+            return len(rows)
+
+    # a candle of the held time span is missing or has another close than this one
+    def _differs(self, candle):
+        held = self.columns()
+        open_time = float(candle[0])
+        if open_time < held.open_time[0]:
+            return False
+        i = np.searchsorted(held.open_time, open_time)
+        return (i == self.count or held.open_time[i] != open_time
+                or held.close[i] != float(candle[4]))
+
+    # view of the last n values of a field, all of them when n is None
+    def column(self, name, n=None):
+        return self.columns(n)[FIELDS.index(name)]
+
+    # Candles of views of the last n candles, all of them when n is None
+    def columns(self, n=None):
+        if n is None or n > self.count:
+            n = self.count
+        end = self.head + self.capacity
+        return Candles(*self.data[:, end - n:end])
+
+
+# Candles of one kline per interval_ms bucket of candles, the buckets start at multiples of interval_ms
+# like the klines of the exchange
+def resample(candles, interval_ms):
+    open_time = np.asarray(candles.open_time)
+    if len(open_time) == 0:
+        return Candles(*np.zeros((len(FIELDS), 0), dtype="float64"))
+    keys = open_time // interval_ms
+    starts = np.flatnonzero(np.diff(keys, prepend=keys[0] - 1))
+    ends = np.append(starts[1:], len(keys)) - 1
+    bucket = keys[starts] * interval_ms
+    return Candles(open_time=bucket,
+                   open=candles.open[starts],
+                   high=np.maximum.reduceat(candles.high, starts),
+                   low=np.minimum.reduceat(candles.low, starts),
+                   close=candles.close[ends],
+                   volume=np.add.reduceat(candles.volume, starts),
+                   close_time=bucket + interval_ms - 1,
+                   quote_volume=np.add.reduceat(candles.quote_volume,
+                                                starts))
+
+
+class Resampler():
+    """
+    Klines of `interval` kept up to date from the klines of a shorter base interval.
+
+    The history is seeded once with klines of `interval`, then every `update` rebuilds the klines from
+    the last one held on out of the base candles, the last one is still open while its bucket is.
+    """
+    def __init__(self, interval, base_interval="1m", capacity=512):
+        if not can_resample(base_interval, interval):
+            raise ValueError("Cannot build %s klines from %s klines" %
+                             (interval, base_interval))
+        self.interval = interval
+        self.base_interval = base_interval
+        self.interval_ms = interval_to_milliseconds(interval)
+        self.bars = CandleBuffer(capacity, interval)
+
+    def __len__(self):
+        return len(self.bars)
+
+    # klines of `interval` in the list format of the REST client, or an array of rows
+    def seed(self, candles):
+        self.bars.clear()
+        self.bars.update(candles)
+
+    def update(self, base):
+        """
+        Merge candles.Candles of base candles, oldest first.
+
+        Returns False when there is nothing to merge into: no klines were seeded, or the base candles
+        start after the open of the last kline held, it has to be seeded again.
+        """
+        last = self.bars.last_open_time
+        if (last is None or len(base.open_time) == 0
+                or base.open_time[0] > last):
+            return False
+        start = int(np.searchsorted(base.open_time, last))
+        rows = resample(Candles(*(column[start:] for column in base)),
+                        self.interval_ms)
+        if len(rows.open_time) > 0:
+            self.bars.update(np.column_stack(rows))
+        return True
+
+    # see CandleBuffer.columns
+    def columns(self, n=None):
+        return self.bars.columns(n)
+
+
+# klines of `interval` can be built from klines of base_interval: the buckets of both divide a day, so
+# they are aligned like the ones of the exchange
+def can_resample(base_interval, interval):
+    base_ms = interval_to_milliseconds(base_interval)
+    ms = interval_to_milliseconds(interval)
+    if base_ms is None or ms is None or interval[-1] not in "mhd":
+        return False
+    return ms > base_ms and ms % base_ms == 0 and DAY_MS % ms == 0
+
+
+# candles.Candles of (symbols, n) matrices holding the last n candles of every candles.Candles, right aligned:
+# the row of one with fewer candles starts with nan. n defaults to the most candles of one.
+def stack(candles, n=None):
+    if n is None:
+        n = max([len(c.open_time) for c in candles], default=0)
+    data = np.full((len(FIELDS), len(candles), n), np.nan)
+    for row, columns in enumerate(candles):
+        m = min(len(columns.open_time), n)
+        if m > 0:
+            data[:, row, n - m:] = np.stack(columns)[:, -m:]
+    return Candles(*data)
+
+
+class CandleStore():
+    def __init__(self, capacity=512, max_symbols=64):
+        self.capacity = capacity
+        self.max_symbols = max_symbols
+        self._symbols = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._symbols)
+
+    # the entries of a symbol, it becomes the most recently used one. Call with the lock held.
+    def _entries(self, symbol):
+        entries = self._symbols.setdefault(symbol, {})
+        self._symbols.move_to_end(symbol)
+        while len(self._symbols) > self.max_symbols:
+            self._symbols.popitem(last=False)
+        return entries
+
+    # the buffer of a symbol, interval and contract type, created empty when there is none
+    def get(self, symbol, interval, contract_type=None):
+        with self._lock:
+            buffers = self._entries(symbol)
+            key = (interval, contract_type)
+            buffer = buffers.get(key)
+            if buffer is None:
+                buffer = buffers[key] = CandleBuffer(self.capacity, interval)
+            return buffer
+
+    # the Resampler of a symbol building interval klines from base_interval ones, created unseeded
+    def resampler(self, symbol, interval, base_interval="1m"):
+        with self._lock:
+            buffers = self._entries(symbol)
+            key = ("resample", interval, base_interval)
+            resampler = buffers.get(key)
+            if resampler is None:
+                resampler = buffers[key] = Resampler(interval, base_interval,
+                                                     self.capacity)
+            return resampler
+
+    # merge klines into their buffer and return it
+    def update(self, symbol, interval, candles, contract_type=None):
+        buffer = self.get(symbol, interval, contract_type)
+        buffer.update(candles)
+        return buffer
+
+    def clear(self):
+        with self._lock:
+            self._symbols.clear()
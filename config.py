@@ -2,17 +2,29 @@ import json
 from types import SimpleNamespace
 import os
 
+# settings and keys are read once per file, reload() reads them again
+_loaded = {}
+
+
+def _load(path):
+    path = os.path.abspath(path)
+    if path not in _loaded:
+        with open(path, "r") as f:
+            _loaded[path] = json.load(
+                f, object_hook=lambda d: SimpleNamespace(**d))  #convert array to object
+    return _loaded[path]
+
+
+def reload():
+    _loaded.clear()
+
 
 def getBotSettings():
-    return json.load(
-        open("settings.json", "r"),
-        object_hook=lambda d: SimpleNamespace(**d))  #convert array to object
+    return _load("settings.json")
 
 
 def getAPIKeys():
-    return json.load(
-        open("keys.json", "r"),
-        object_hook=lambda d: SimpleNamespace(**d))  #convert array to object
+    return _load("keys.json")
 
 
 def getPublicKey():
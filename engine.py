@@ -0,0 +1,339 @@
+"""
+Array based implementation of the Talon Sniper strategy.
+
+Every function here mirrors one of the list based functions in helper.py and
+returns bit-identical values, only the data lives in numpy arrays. The few
+recursive parts (heikin ashi open, trend bands) are run through
+itertools.accumulate on plain floats, everything else is vectorized.
+
+The `_batch` functions take (symbols, candles) matrices instead, one row per
+symbol, and run the recursions one column at a time for all the rows at
+once. A symbol with a shorter history is right aligned, its row starts with
+nan where it has no candles yet. Every row gives the values the 1-D
+function gives for its candles.
+"""
+from itertools import accumulate
+
+import numpy as np
+
+
+# convert raw client candle data into open, high, low, close and volume arrays
+def convert_candles(candles):
+    arr = np.asarray(candles)
+    if arr.ndim != 2 or len(arr) == 0:
+        empty = np.empty(0, dtype="float64")
+        return empty, empty, empty, empty, empty
+    ohlcv = arr[:, 1:6].astype("float64")
+    return ohlcv[:, 0], ohlcv[:, 1], ohlcv[:, 2], ohlcv[:, 3], ohlcv[:, 4]
+
+
+# convert ohlc arrays into heikin ashi candles
+def construct_heikin_ashi(o, h, l, c):
+    o = np.asarray(o, dtype="float64")
+    h = np.asarray(h, dtype="float64")
+    l = np.asarray(l, dtype="float64")
+    c = np.asarray(c, dtype="float64")
+
+    h_c = (o + h + l + c) / 4
+    if len(h_c) == 0:
+        return h_c.copy(), h_c.copy(), h_c.copy(), h_c
+
+    # open[i] = (open[i - 1] + close[i - 1]) / 2, seeded with the first close
+    closes = h_c.tolist()
+    h_o = np.fromiter(accumulate(closes[:-1],
+                                 lambda prev, close: (prev + close) / 2,
+                                 initial=closes[0]),
+                      dtype="float64",
+                      count=len(closes))
+
+    h_h = np.maximum(np.maximum(h, h_c), h_o)
+    h_l = np.minimum(np.minimum(l, h_c), h_o)
+
+    return h_o, h_h, h_l, h_c
+
+
+# true range of every candle but the first one
+def avarage_true_range(high, low, close):
+    high = np.asarray(high, dtype="float64")
+    low = np.asarray(low, dtype="float64")
+    close = np.asarray(close, dtype="float64")
+
+    prev_close = close[:-1]
+    return np.maximum(
+        np.maximum(high[1:] - low[1:], np.abs(high[1:] - prev_close)),
+        np.abs(low[1:] - prev_close),
+    )
+
+
+def _trend_up_step(prev, item):
+    close, up = item
+    if close > prev:
+        return up if up >= prev else prev
+    return up
+
+
+def _trend_down_step(prev, item):
+    close, dn = item
+    if close < prev:
+        return dn if dn <= prev else prev
+    return dn
+
+
+# carry the last non zero value forward, leading zeros stay zero
+def _forward_fill(values):
+    idx = np.where(values != 0, np.arange(len(values)), 0)
+    np.maximum.accumulate(idx, out=idx)
+    return values[idx]
+
+
+# Our trading strategy on arrays - same contract as helper.trading_signal but returns a numpy array
+# signals are -1 for short, 1 for long and 0 for do nothing
+def trading_signal(h_o, h_h, h_l, h_c, use_last=False):
+    factor = 1
+
+    h_h = np.asarray(h_h, dtype="float64")
+    h_l = np.asarray(h_l, dtype="float64")
+    h_c = np.asarray(h_c, dtype="float64")
+
+    n = len(h_c)
+    if n < 2:
+        return np.zeros(1, dtype="int64")
+
+    hl2 = ((h_h + h_l) / 2)[1:]
+    atr = avarage_true_range(h_h, h_l, h_c)
+
+    up = hl2 - (factor * atr)
+    dn = hl2 + (factor * atr)
+
+    # the bands are recursive, the legacy code compares against h_c[i - 1] of the full series
+    closes = h_c[:n - 2].tolist()
+    trend_up = np.fromiter(accumulate(zip(closes,
+                                          up[1:].tolist()),
+                                      _trend_up_step,
+                                      initial=0.0),
+                           dtype="float64",
+                           count=n - 1)
+    trend_down = np.fromiter(accumulate(zip(closes,
+                                            dn[1:].tolist()),
+                                        _trend_down_step,
+                                        initial=0.0),
+                             dtype="float64",
+                             count=n - 1)
+
+    close = h_c[1:]
+    raw = np.where(close > trend_down, 1, np.where(close < trend_up, -1, 0))
+    trend = _forward_fill(raw)
+
+    entry = np.zeros(n - 1, dtype="int64")
+    entry[1:] = np.where((trend[1:] == 1) & (trend[:-1] == -1), 1,
+                         np.where((trend[1:] == -1) & (trend[:-1] == 1), -1,
+                                  0))
+    if use_last:
+        entry = _forward_fill(entry)
+
+    return entry
+
+
+class SignalState():
+    """
+    Streaming version of trading_signal for one (market, interval).
+
+    The state is seeded once from a kline history and then advanced one
+    closed candle at a time, carrying only what the recursion needs: the
+    heikin ashi open/close, the previous trend bands, the trend and the last
+    entry. `entry` is the value get_signal(..., use_last=True)[-2] returns
+    when the history is fed through the same candles.
+    """
+    def __init__(self, market, interval, use_last=True):
+        self.market = market
+        self.interval = interval
+        self.use_last = use_last
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.open_time = None
+        self.ha_open = 0.0
+        self.ha_close = 0.0
+        # heikin ashi close two candles back, the trend bands compare against it
+        self.ha_close_prev = 0.0
+        self.trend_up = 0.0
+        self.trend_down = 0.0
+        self.trend = 0
+        self.last_entry = 0
+        self.entry = 0
+
+    # seed the state from raw klines, the last one is the candle still open and is skipped
+    def seed(self, candles):
+        self.reset()
+        for candle in candles[:-1]:
+            self.update(candle)
+        return self.entry
+
+    def _step(self, candle):
+        o, h, l, c = (float(candle[1]), float(candle[2]), float(candle[3]),
+                      float(candle[4]))
+        k = self.count
+
+        ha_close = (o + h + l + c) / 4
+        ha_open = ha_close if k == 0 else (self.ha_open + self.ha_close) / 2
+        ha_high = max([h, ha_close, ha_open])
+        ha_low = min([l, ha_close, ha_open])
+
+        if k == 0:
+            return (ha_open, ha_close, self.ha_close, self.trend_up,
+                    self.trend_down, self.trend, self.last_entry, self.entry)
+
+        hl2 = (ha_high + ha_low) / 2
+        atr = max([
+            ha_high - ha_low,
+            abs(ha_high - self.ha_close),
+            abs(ha_low - self.ha_close),
+        ])
+        up = hl2 - atr
+        dn = hl2 + atr
+
+        if k == 1:
+            trend_up, trend_down = 0.0, 0.0
+        else:
+            trend_up = up
+            if self.ha_close_prev > self.trend_up:
+                trend_up = up if up >= self.trend_up else self.trend_up
+            trend_down = dn
+            if self.ha_close_prev < self.trend_down:
+                trend_down = dn if dn <= self.trend_down else self.trend_down
+
+        if ha_close > trend_down:
+            trend = 1
+        elif ha_close < trend_up:
+            trend = -1
+        else:
+            trend = self.trend
+
+        last_entry = self.last_entry
+        entry = 0
+        if k > 1:
+            if trend == 1 and self.trend == -1:
+                entry = last_entry = 1
+            elif trend == -1 and self.trend == 1:
+                entry = last_entry = -1
+            elif self.use_last:
+                entry = last_entry
+
+        return (ha_open, ha_close, self.ha_close, trend_up, trend_down, trend,
+                last_entry, entry)
+
+    # advance the state with one closed candle, candles already seen are ignored
+    def update(self, candle):
+        open_time = int(candle[0])
+        if self.open_time is not None and open_time <= self.open_time:
+            return self.entry
+        (self.ha_open, self.ha_close, self.ha_close_prev, self.trend_up,
+         self.trend_down, self.trend, self.last_entry,
+         self.entry) = self._step(candle)
+        self.count += 1
+        self.open_time = open_time
+        return self.entry
+
+    # entry the still open candle would give if it closed now, the state is left untouched
+    def peek(self, candle):
+        if self.open_time is not None and int(candle[0]) <= self.open_time:
+            return self.entry
+        return self._step(candle)[-1]
+
+
+# index of the first candle of every row of a (symbols, candles) matrix, rows without one get the width
+def first_candles(close):
+    valid = ~np.isnan(close)
+    return np.where(valid.any(axis=1), valid.argmax(axis=1), close.shape[1])
+
+
+# construct_heikin_ashi of every row of (symbols, candles) matrices
+def construct_heikin_ashi_batch(o, h, l, c):
+    o = np.asarray(o, dtype="float64")
+    h = np.asarray(h, dtype="float64")
+    l = np.asarray(l, dtype="float64")
+    c = np.asarray(c, dtype="float64")
+
+    h_c = (o + h + l + c) / 4
+    first = first_candles(h_c)
+    # the recursion runs over the candles, one contiguous row of all the symbols at a time
+    closes = np.ascontiguousarray(h_c.T)
+    opens = np.empty_like(closes)
+    for i in range(len(closes)):
+        if i == 0:
+            opens[0] = closes[0]
+            continue
+        opens[i] = (opens[i - 1] + closes[i - 1]) / 2
+        np.copyto(opens[i], closes[i], where=first == i)
+    h_o = opens.T
+
+    h_h = np.maximum(np.maximum(h, h_c), h_o)
+    h_l = np.minimum(np.minimum(l, h_c), h_o)
+
+    return h_o, h_h, h_l, h_c
+
+
+# trading_signal of every row of (symbols, candles) matrices, a (symbols, candles - 1) matrix.
+# The entries of a row are right aligned like its candles, zero before them.
+def trading_signal_batch(h_o, h_h, h_l, h_c, use_last=False):
+    h_h = np.asarray(h_h, dtype="float64")
+    h_l = np.asarray(h_l, dtype="float64")
+    h_c = np.asarray(h_c, dtype="float64")
+
+    rows, n = h_c.shape
+    if n < 2:
+        return np.zeros((rows, 1), dtype="int64")
+
+    first = first_candles(h_c)
+    hl2 = ((h_h + h_l) / 2)[:, 1:]
+    prev_close = h_c[:, :-1]
+    atr = np.maximum(
+        np.maximum(h_h[:, 1:] - h_l[:, 1:], np.abs(h_h[:, 1:] - prev_close)),
+        np.abs(h_l[:, 1:] - prev_close))
+    up = hl2 - atr
+    dn = hl2 + atr
+
+    # row j holds candle j + 1 of every symbol, the bands start at zero on the second candle of a symbol
+    closes = np.ascontiguousarray(h_c.T)
+    ups = np.ascontiguousarray(up.T)
+    dns = np.ascontiguousarray(dn.T)
+    trend_up = np.zeros((n - 1, rows))
+    trend_down = np.zeros((n - 1, rows))
+    for j in range(1, n - 1):
+        close = closes[j - 1]
+        prev_up = trend_up[j - 1]
+        prev_down = trend_down[j - 1]
+        band_up = np.where(close > prev_up,
+                           np.where(ups[j] >= prev_up, ups[j], prev_up),
+                           ups[j])
+        band_down = np.where(close < prev_down,
+                             np.where(dns[j] <= prev_down, dns[j], prev_down),
+                             dns[j])
+        started = first < j
+        np.copyto(trend_up[j], band_up, where=started)
+        np.copyto(trend_down[j], band_down, where=started)
+    trend_up = trend_up.T
+    trend_down = trend_down.T
+
+    close = h_c[:, 1:]
+    raw = np.where(close > trend_down, 1, np.where(close < trend_up, -1, 0))
+    # the first candle of a row has no entry
+    raw[np.arange(n - 1) < first[:, None]] = 0
+    trend = _forward_fill_rows(raw)
+
+    entry = np.zeros((rows, n - 1), dtype="int64")
+    entry[:, 1:] = np.where(
+        (trend[:, 1:] == 1) & (trend[:, :-1] == -1), 1,
+        np.where((trend[:, 1:] == -1) & (trend[:, :-1] == 1), -1, 0))
+    if use_last:
+        entry = _forward_fill_rows(entry)
+
+    return entry
+
+
+# _forward_fill of every row
+def _forward_fill_rows(values):
+    idx = np.where(values != 0, np.arange(values.shape[1]), 0)
+    np.maximum.accumulate(idx, axis=1, out=idx)
+    return np.take_along_axis(values, idx, axis=1)
@@ -0,0 +1,103 @@
+"""
+Exchange metadata store.
+
+The futures exchange information is downloaded once, indexed by symbol and
+refreshed every `ttl` seconds, either by a background thread (start) or by
+the caller when `expired()` says so.
+"""
+import logging
+import threading
+import time
+from collections import namedtuple
+
+logger = logging.getLogger('exchange')
+
+SymbolInfo = namedtuple('SymbolInfo', [
+    'symbol', 'contract_type', 'margin_asset', 'status',
+    'quantity_precision', 'price_precision', 'step_size', 'min_qty',
+    'tick_size', 'min_notional'
+])
+
+
+# read the filters we care about from one symbol of the exchange information
+def parse_symbol(item):
+    step_size, min_qty, tick_size, min_notional = 0.0, 0.0, 0.0, 0.0
+    for f in item.get('filters', []):
+        if f['filterType'] == 'LOT_SIZE':
+            step_size = float(f['stepSize'])
+            min_qty = float(f['minQty'])
+        elif f['filterType'] == 'PRICE_FILTER':
+            tick_size = float(f['tickSize'])
+        elif f['filterType'] == 'MIN_NOTIONAL':
+            min_notional = float(f.get('notional', f.get('minNotional', 0)))
+    return SymbolInfo(symbol=item['symbol'],
+                      contract_type=item.get('contractType'),
+                      margin_asset=item.get('marginAsset'),
+                      status=item.get('status'),
+                      quantity_precision=int(
+                          item.get('quantityPrecision', 3)),
+                      price_precision=int(item.get('pricePrecision', 2)),
+                      step_size=step_size,
+                      min_qty=min_qty,
+                      tick_size=tick_size,
+                      min_notional=min_notional)
+
+
+class ExchangeMetadata():
+    def __init__(self, fetch=None, ttl=3600, clock=time.time):
+        """
+        fetch:callable: returns the futures exchange information, e.g. Client.futures_exchange_info.
+        """
+        self.fetch = fetch
+        self.ttl = ttl
+        self.clock = clock
+        self.info = None
+        self.loaded_at = None
+        self._symbols = {}
+        self._thread = None
+        self._stopping = threading.Event()
+
+    @property
+    def loaded(self):
+        return self.info is not None
+
+    def expired(self):
+        return self.loaded_at is None or self.clock() - self.loaded_at >= self.ttl
+
+    # index a freshly downloaded exchange information
+    def update(self, info):
+        symbols = {}
+        for item in info['symbols']:
+            symbols[item['symbol']] = parse_symbol(item)
+        # swap both at once, readers never see a half built index
+        self._symbols = symbols
+        self.info = info
+        self.loaded_at = self.clock()
+
+    def load(self):
+        self.update(self.fetch())
+        return self
+
+    # SymbolInfo of a symbol, None if the exchange does not list it
+    def get(self, symbol):
+        return self._symbols.get(symbol)
+
+    def symbols(self):
+        return list(self._symbols.values())
+
+    def _refresh_loop(self):
+        while not self._stopping.wait(self.ttl):
+            try:
+                self.load()
+            except Exception as e:
+                logger.warning('exchange information refresh failed: %s', e)
+
+    # refresh the metadata every ttl seconds on a daemon thread
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._refresh_loop,
+                                            daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
@@ -0,0 +1,675 @@
+"""
+Local stand-in for the Binance USDT futures REST API.
+
+FakeExchange holds a simulated market: one 1m kline path per symbol
+(recorded, see backtest.load_klines, or synthetic_klines), a USDT wallet,
+one-way positions, leverage and margin type, and open orders. Time only
+moves with advance(), one 1m candle at a time, so a run is deterministic.
+MARKET orders fill at the current price, TRAILING_STOP_MARKET orders are
+checked against every new candle like the backtest does.
+
+FakeExchangeServer serves it over HTTP on the paths python-binance uses, so
+a client from helper.init_client(base_url=server.url) talks to it instead of
+Binance. Latency, a request weight limit and one-off errors can be injected.
+Signatures and keys are not checked.
+
+    python3 fake_exchange.py BTCUSDT ETHUSDT --data data --port 8080
+"""
+import argparse
+import itertools
+import json
+import math
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlparse
+
+import numpy as np
+from binance.helpers import interval_to_milliseconds
+
+# columns of the kline arrays, see backtest.py
+OPEN_TIME, OPEN, HIGH, LOW, CLOSE, VOLUME, CLOSE_TIME, QUOTE_VOLUME = range(8)
+
+MINUTE_MS = 60000
+
+# request weights of the endpoints, the others weigh 1
+WEIGHTS = {
+    "exchangeInfo": 1,
+    "ticker/24hr": 40,
+    "balance": 5,
+    "positionRisk": 5,
+    "account": 5,
+    "batchOrders": 5,
+}
+
+
+class ExchangeError(Exception):
+    """
+    An error answer of the exchange, the client raises it as a BinanceAPIException.
+    """
+    def __init__(self, status, code, msg):
+        super().__init__(msg)
+        self.status = status
+        self.code = code
+        self.msg = msg
+
+
+# random walk 1m klines, same columns as backtest.load_klines
+def synthetic_klines(n,
+                     start=1609459200000,
+                     price=100.0,
+                     volatility=0.001,
+                     quote_volume=1e6,
+                     seed=None):
+    rng = np.random.RandomState(seed)
+    close = price * np.exp(np.cumsum(rng.normal(0, volatility, n)))
+    open_ = np.concatenate([[price], close[:-1]])
+    high = np.maximum(open_, close) * (1 + rng.uniform(0, volatility, n))
+    low = np.minimum(open_, close) * (1 - rng.uniform(0, volatility, n))
+    open_time = start + np.arange(n) * MINUTE_MS
+    volume = rng.uniform(0.5, 1.5, n) * quote_volume / close
+    return np.column_stack([
+        open_time, open_, high, low, close, volume,
+        open_time + MINUTE_MS - 1, volume * close
+    ])
+
+
+# numbers are strings in the answers of binance
+def _num(value):
+    return repr(float(value))
+
+
+def _kline_row(open_time, o, h, l, c, v, close_time, q):
+    return [
+        int(open_time), _num(o), _num(h), _num(l), _num(c), _num(v),
+        int(close_time), _num(q), 0, "0", "0", "0"
+    ]
+
+
+class FakeExchange():
+    """
+    The simulated market and account.
+
+    klines: {symbol: 1m kline array}. The exchange starts at candle `start` of the paths (or the
+    first one), the current candle is the one still open and its close is the price.
+    """
+    def __init__(self,
+                 klines,
+                 balance=10000.0,
+                 start=None,
+                 fee=0.0,
+                 quantity_precision=3,
+                 price_precision=2):
+        self.klines = dict(
+            (symbol, np.asarray(k, dtype="float64"))
+            for symbol, k in klines.items())
+        self.now = int(
+            min(k[0, OPEN_TIME] for k in self.klines.values())
+            if start is None else start)
+        self.balance = float(balance)
+        self.fee = fee
+        self.quantity_precision = quantity_precision
+        self.price_precision = price_precision
+        self.positions = dict((symbol, [0.0, 0.0]) for symbol in self.klines)
+        self.leverage = dict((symbol, 20) for symbol in self.klines)
+        self.margin_type = dict((symbol, "CROSSED") for symbol in self.klines)
+        self.orders = {}
+        self.fills = []
+        # False rejects conditional orders in batches, like accounts that route them to the algo endpoint
+        self.conditional_in_batch = True
+        self._ids = itertools.count(1)
+        self.lock = threading.RLock()
+
+    def _path(self, symbol):
+        if symbol not in self.klines:
+            raise ExchangeError(400, -1121, "Invalid symbol.")
+        return self.klines[symbol]
+
+    # index of the candle open at self.now
+    def _index(self, symbol):
+        path = self._path(symbol)
+        return max(
+            int(np.searchsorted(path[:, OPEN_TIME], self.now, "right")) - 1, 0)
+
+    def price(self, symbol):
+        with self.lock:
+            return float(self._path(symbol)[self._index(symbol), CLOSE])
+
+    # move the time by n minutes, the trailing stops see every new candle
+    def advance(self, n=1):
+        with self.lock:
+            for _ in range(n):
+                self.now += MINUTE_MS
+                for order in list(self.orders.values()):
+                    self._check_trailing_stop(order)
+
+    def _check_trailing_stop(self, order):
+        candle = self._path(order["symbol"])[self._index(order["symbol"])]
+        rate = order["callbackRate"] / 100
+        if order["side"] == "SELL":
+            stop = order["peak"] * (1 - rate)
+            hit = candle[LOW] <= stop
+            price = min(candle[OPEN], stop)
+            order["peak"] = max(order["peak"], candle[HIGH])
+        else:
+            stop = order["peak"] * (1 + rate)
+            hit = candle[HIGH] >= stop
+            price = max(candle[OPEN], stop)
+            order["peak"] = min(order["peak"], candle[LOW])
+        if hit:
+            del self.orders[order["orderId"]]
+            amount = self.positions[order["symbol"]][0]
+            qty = min(order["quantity"], abs(amount))
+            if qty > 0:
+                self._fill(order["symbol"], order["side"], qty, price,
+                           order["orderId"])
+
+    def _fill(self, symbol, side, qty, price, order_id):
+        position = self.positions[symbol]
+        amount, entry = position
+        delta = qty if side == "BUY" else -qty
+        if amount == 0 or (amount > 0) == (delta > 0):
+            position[1] = (abs(amount) * entry + qty * price) / (abs(amount) +
+                                                                 qty)
+        else:
+            closed = min(abs(amount), qty)
+            self.balance += closed * (price - entry) * (1 if amount > 0 else
+                                                        -1)
+            if qty > abs(amount):
+                position[1] = price
+        position[0] = round(amount + delta, 8)
+        if position[0] == 0:
+            position[1] = 0.0
+        self.balance -= self.fee * qty * price
+        self.fills.append((self.now, symbol, side, qty, price, order_id))
+
+    def server_time(self):
+        return self.now
+
+    def get_klines(self, symbol, interval, limit=500, startTime=None,
+                   endTime=None):
+        """
+        Klines of any interval, aggregated from the 1m path up to the current candle.
+        """
+        with self.lock:
+            path = self._path(symbol)[:self._index(symbol) + 1]
+            ms = interval_to_milliseconds(interval)
+            limit = min(int(limit), 1500)
+            if startTime is not None:
+                path = path[path[:, OPEN_TIME] >= int(startTime) // ms * ms]
+            if endTime is not None:
+                path = path[path[:, OPEN_TIME] <= int(endTime)]
+            if len(path) == 0:
+                return []
+            keys = path[:, OPEN_TIME] // ms
+            starts = np.flatnonzero(np.diff(keys, prepend=-1) != 0)
+            end = len(path)
+            if startTime is not None:
+                if len(starts) > limit:
+                    end = starts[limit]
+                starts = starts[:limit]
+            else:
+                starts = starts[-limit:]
+            rows = path[starts[0]:end]
+            open_time = keys[starts] * ms
+            starts = starts - starts[0]
+            high = np.maximum.reduceat(rows[:, HIGH], starts)
+            low = np.minimum.reduceat(rows[:, LOW], starts)
+            volume = np.add.reduceat(rows[:, VOLUME], starts)
+            quote = np.add.reduceat(rows[:, QUOTE_VOLUME], starts)
+            last = np.concatenate([starts[1:], [len(rows)]]) - 1
+            return [
+                _kline_row(open_time[i], rows[starts[i], OPEN], high[i],
+                           low[i], rows[last[i], CLOSE], volume[i],
+                           open_time[i] + ms - 1, quote[i])
+                for i in range(len(starts))
+            ]
+
+    def ticker(self, symbol=None):
+        with self.lock:
+            symbols = list(self.klines) if symbol is None else [symbol]
+            tickers = []
+            for s in symbols:
+                path = self._path(s)
+                i = self._index(s)
+                day = path[max(i - 1439, 0):i + 1]
+                tickers.append({
+                    "symbol": s,
+                    "priceChange": _num(day[-1, CLOSE] - day[0, OPEN]),
+                    "lastPrice": _num(day[-1, CLOSE]),
+                    "openPrice": _num(day[0, OPEN]),
+                    "highPrice": _num(day[:, HIGH].max()),
+                    "lowPrice": _num(day[:, LOW].min()),
+                    "volume": _num(day[:, VOLUME].sum()),
+                    "quoteVolume": _num(day[:, QUOTE_VOLUME].sum()),
+                    "openTime": int(day[0, OPEN_TIME]),
+                    "closeTime": self.now,
+                })
+            return tickers if symbol is None else tickers[0]
+
+    def mark_price(self, symbol=None):
+        with self.lock:
+            symbols = list(self.klines) if symbol is None else [symbol]
+            prices = [{
+                "symbol": s,
+                "markPrice": _num(self.price(s)),
+                "indexPrice": _num(self.price(s)),
+                "lastFundingRate": "0.00010000",
+                "nextFundingTime": self.now + 8 * 60 * MINUTE_MS,
+                "time": self.now,
+            } for s in symbols]
+            return prices if symbol is None else prices[0]
+
+    def exchange_info(self):
+        step = 10**-self.quantity_precision
+        tick = 10**-self.price_precision
+        return {
+            "timezone": "UTC",
+            "serverTime": self.now,
+            "rateLimits": [],
+            "symbols": [{
+                "symbol": s,
+                "pair": s,
+                "contractType": "PERPETUAL",
+                "status": "TRADING",
+                "baseAsset": s[:-4],
+                "quoteAsset": "USDT",
+                "marginAsset": "USDT",
+                "pricePrecision": self.price_precision,
+                "quantityPrecision": self.quantity_precision,
+                "filters": [{
+                    "filterType": "PRICE_FILTER",
+                    "tickSize": _num(tick)
+                }, {
+                    "filterType": "LOT_SIZE",
+                    "stepSize": _num(step),
+                    "minQty": _num(step)
+                }, {
+                    "filterType": "MIN_NOTIONAL",
+                    "notional": "5"
+                }]
+            } for s in self.klines]
+        }
+
+    def _unrealized(self, symbol):
+        amount, entry = self.positions[symbol]
+        return amount * (self.price(symbol) - entry)
+
+    def account_balance(self):
+        with self.lock:
+            unrealized = sum(self._unrealized(s) for s in self.klines)
+            return [{
+                "accountAlias": "fake",
+                "asset": "USDT",
+                "balance": _num(self.balance),
+                "crossWalletBalance": _num(self.balance),
+                "crossUnPnl": _num(unrealized),
+                "availableBalance": _num(self.balance + unrealized),
+                "maxWithdrawAmount": _num(self.balance),
+                "updateTime": self.now,
+            }]
+
+    def position_information(self, symbol=None):
+        with self.lock:
+            symbols = list(self.klines) if symbol is None else [symbol]
+            return [{
+                "symbol": s,
+                "positionAmt": _num(self.positions[s][0]),
+                "entryPrice": _num(self.positions[s][1]),
+                "markPrice": _num(self.price(s)),
+                "unRealizedProfit": _num(self._unrealized(s)),
+                "liquidationPrice": "0",
+                "leverage": str(self.leverage[s]),
+                "marginType": self.margin_type[s].lower(),
+                "isolated": self.margin_type[s] == "ISOLATED",
+                "positionSide": "BOTH",
+                "updateTime": self.now,
+            } for s in symbols]
+
+    def account(self):
+        with self.lock:
+            balance = self.account_balance()[0]
+            return {
+                "totalWalletBalance": balance["balance"],
+                "totalUnrealizedProfit": balance["crossUnPnl"],
+                "availableBalance": balance["availableBalance"],
+                "assets": [{
+                    "asset": "USDT",
+                    "walletBalance": balance["balance"],
+                    "unrealizedProfit": balance["crossUnPnl"],
+                }],
+                "positions": [{
+                    "symbol": p["symbol"],
+                    "positionAmt": p["positionAmt"],
+                    "entryPrice": p["entryPrice"],
+                    "unrealizedProfit": p["unRealizedProfit"],
+                    "leverage": p["leverage"],
+                    "isolated": p["isolated"],
+                    "positionSide": "BOTH",
+                } for p in self.position_information()]
+            }
+
+    def create_order(self, symbol, side, type, quantity, **params):
+        with self.lock:
+            self._path(symbol)
+            if side not in ("BUY", "SELL"):
+                raise ExchangeError(400, -1117, "Invalid side.")
+            qty = float(quantity)
+            if qty <= 0:
+                raise ExchangeError(400, -4003,
+                                    "Quantity less than or equal to zero.")
+            order = {
+                "orderId": next(self._ids),
+                "symbol": symbol,
+                "side": side,
+                "type": type,
+                "quantity": qty,
+            }
+            price = self.price(symbol)
+            if type == "MARKET":
+                self._fill(symbol, side, qty, price, order["orderId"])
+                status = "FILLED"
+            elif type == "TRAILING_STOP_MARKET":
+                rate = float(params.get("callbackRate", 1))
+                if not 0.1 <= rate <= 10:
+                    raise ExchangeError(400, -2007, "Invalid callBack rate.")
+                order["callbackRate"] = rate
+                order["peak"] = float(params.get("activationPrice", price))
+                self.orders[order["orderId"]] = order
+                status = "NEW"
+            else:
+                raise ExchangeError(400, -1116, "Invalid orderType.")
+            return {
+                "orderId": order["orderId"],
+                "algoId": order["orderId"],
+                "symbol": symbol,
+                "status": status,
+                "clientOrderId": params.get("newClientOrderId", ""),
+                "side": side,
+                "type": type,
+                "origQty": _num(qty),
+                "executedQty": _num(qty) if status == "FILLED" else "0",
+                "avgPrice": _num(price) if status == "FILLED" else "0",
+                "positionSide": "BOTH",
+                "updateTime": self.now,
+            }
+
+    def open_orders(self, symbol=None):
+        with self.lock:
+            return [{
+                "orderId": o["orderId"],
+                "symbol": o["symbol"],
+                "side": o["side"],
+                "type": o["type"],
+                "origQty": _num(o["quantity"]),
+                "priceRate": _num(o["callbackRate"]),
+                "status": "NEW",
+            } for o in self.orders.values()
+                    if symbol is None or o["symbol"] == symbol]
+
+    def cancel_order(self, symbol, orderId=None, algoId=None, **params):
+        with self.lock:
+            order_id = int(orderId if orderId is not None else algoId)
+            order = self.orders.get(order_id)
+            if order is None or order["symbol"] != symbol:
+                raise ExchangeError(400, -2011, "Unknown order sent.")
+            del self.orders[order_id]
+            return {"orderId": order_id, "symbol": symbol, "status": "CANCELED"}
+
+    def cancel_all_orders(self, symbol, **params):
+        with self.lock:
+            self._path(symbol)
+            for order_id in [
+                    i for i, o in self.orders.items() if o["symbol"] == symbol
+            ]:
+                del self.orders[order_id]
+            return {
+                "code": 200,
+                "msg": "The operation of cancel all open order is done."
+            }
+
+    def change_leverage(self, symbol, leverage, **params):
+        with self.lock:
+            self._path(symbol)
+            leverage = int(leverage)
+            if not 1 <= leverage <= 125:
+                raise ExchangeError(400, -4028, "Leverage is not valid")
+            self.leverage[symbol] = leverage
+            return {
+                "symbol": symbol,
+                "leverage": leverage,
+                "maxNotionalValue": "1000000"
+            }
+
+    def change_margin_type(self, symbol, marginType, **params):
+        with self.lock:
+            self._path(symbol)
+            if self.margin_type[symbol] == marginType:
+                raise ExchangeError(400, -4046, "No need to change margin type.")
+            self.margin_type[symbol] = marginType
+            return {"code": 200, "msg": "success"}
+
+    def batch_orders(self, batchOrders, **params):
+        results = []
+        for order in json.loads(batchOrders):
+            try:
+                if (not self.conditional_in_batch
+                        and order.get("type") != "MARKET"):
+                    raise ExchangeError(400, -4120,
+                                        "Order type not supported for this endpoint.")
+                results.append(self.create_order(**order))
+            except ExchangeError as e:
+                results.append({"code": e.code, "msg": e.msg})
+        return results
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    # one handler per connection, kept open between requests
+    def setup(self):
+        super().setup()
+        with self.server.fake._lock:
+            self.server.fake.connections += 1
+
+    def do_GET(self):
+        self.server.fake.handle(self, "GET")
+
+    def do_POST(self):
+        self.server.fake.handle(self, "POST")
+
+    def do_PUT(self):
+        self.server.fake.handle(self, "PUT")
+
+    def do_DELETE(self):
+        self.server.fake.handle(self, "DELETE")
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeExchangeServer():
+    """
+    HTTP server of a FakeExchange, see helper.init_client(base_url=...).
+
+    latency: seconds added to every answer, or a function returning them.
+    weight_limit: request weight allowed per minute, more answers 429 like Binance does.
+    """
+    def __init__(self,
+                 exchange,
+                 host="127.0.0.1",
+                 port=0,
+                 latency=0.0,
+                 weight_limit=None,
+                 clock=time.monotonic):
+        self.exchange = exchange
+        self.latency = latency
+        self.weight_limit = weight_limit
+        self.clock = clock
+        self.requests = []
+        self.connections = 0
+        self.used_weight = 0
+        self._window = None
+        self._errors = []
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.fake = self
+        self.thread = None
+        e = exchange
+        self.routes = {
+            ("GET", "ping"): lambda **p: {},
+            ("GET", "time"): lambda **p: {"serverTime": e.server_time()},
+            ("GET", "exchangeInfo"): lambda **p: e.exchange_info(),
+            ("GET", "klines"): e.get_klines,
+            ("GET", "continuousKlines"):
+            lambda pair, contractType=None, **p: e.get_klines(pair, **p),
+            ("GET", "ticker/24hr"): e.ticker,
+            ("GET", "premiumIndex"): e.mark_price,
+            ("GET", "balance"): lambda **p: e.account_balance(),
+            ("GET", "positionRisk"): e.position_information,
+            ("GET", "account"): lambda **p: e.account(),
+            ("GET", "openOrders"): e.open_orders,
+            ("GET", "openAlgoOrders"): e.open_orders,
+            ("POST", "order"): e.create_order,
+            ("POST", "algoOrder"): e.create_order,
+            ("POST", "batchOrders"): e.batch_orders,
+            ("DELETE", "order"): e.cancel_order,
+            ("DELETE", "algoOrder"): e.cancel_order,
+            ("DELETE", "allOpenOrders"): e.cancel_all_orders,
+            ("DELETE", "algoOpenOrders"): e.cancel_all_orders,
+            ("POST", "listenKey"): lambda **p: {"listenKey": "fake"},
+            ("PUT", "listenKey"): lambda **p: {},
+            ("DELETE", "listenKey"): lambda **p: {},
+            ("POST", "leverage"): e.change_leverage,
+            ("POST", "marginType"): e.change_margin_type,
+        }
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return "http://%s:%d" % (host, port)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever,
+                                       daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    # answer the next `count` requests with an error
+    def fail_next(self, status=500, code=-1000, msg="Unknown error", count=1):
+        with self._lock:
+            self._errors.extend([(status, code, msg)] * count)
+
+    # the weight used in the current minute, the window starts with its first request
+    def _use_weight(self, weight):
+        with self._lock:
+            now = self.clock()
+            if self._window is None or now - self._window >= 60:
+                self._window = now
+                self.used_weight = 0
+            self.used_weight += weight
+            return self.used_weight
+
+    def handle(self, request, method):
+        url = urlparse(request.path)
+        params = dict(parse_qsl(url.query))
+        length = int(request.headers.get("Content-Length") or 0)
+        if length:
+            params.update(parse_qsl(request.rfile.read(length).decode()))
+        for key in ("signature", "timestamp", "recvWindow"):
+            params.pop(key, None)
+
+        # /fapi/v1/klines, /fapi/v2/balance, /api/v3/ping ...
+        parts = url.path.strip("/").split("/")
+        name = "/".join(parts[2:])
+        self.requests.append((method, name))
+
+        latency = self.latency() if callable(self.latency) else self.latency
+        if latency:
+            time.sleep(latency)
+
+        used = self._use_weight(WEIGHTS.get(name, 1))
+        status, body, retry_after = 200, None, None
+        with self._lock:
+            error = self._errors.pop(0) if self._errors else None
+        try:
+            if error is not None:
+                raise ExchangeError(*error)
+            if self.weight_limit is not None and used > self.weight_limit:
+                retry_after = max(
+                    int(math.ceil(self._window + 60 - self.clock())), 1)
+                raise ExchangeError(
+                    429, -1003,
+                    "Too many requests; current limit is %d requests per minute."
+                    % self.weight_limit)
+            route = self.routes.get((method, name))
+            if route is None:
+                raise ExchangeError(404, -5000, "Path %s, Method %s is invalid"
+                                    % (url.path, method))
+            body = route(**params)
+        except ExchangeError as e:
+            status, body = e.status, {"code": e.code, "msg": e.msg}
+        except TypeError as e:
+            status, body = 400, {"code": -1102, "msg": str(e)}
+
+        data = json.dumps(body).encode()
+        request.send_response(status)
+        request.send_header("Content-Type", "application/json")
+        request.send_header("Content-Length", str(len(data)))
+        request.send_header("X-MBX-USED-WEIGHT-1M", str(used))
+        if retry_after is not None:
+            request.send_header("Retry-After", str(retry_after))
+        request.end_headers()
+        request.wfile.write(data)
+
+
+def main(argv=None):
+    import backtest as bt
+
+    parser = argparse.ArgumentParser(
+        description="Serve a fake Binance futures API.")
+    parser.add_argument("symbols", nargs="+")
+    parser.add_argument("--data", help="stored klines, synthetic when not given")
+    parser.add_argument("--candles", type=int, default=10000)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--weight-limit", type=int)
+    parser.add_argument("--balance", type=float, default=10000.0)
+    parser.add_argument("--speed",
+                        type=float,
+                        default=1.0,
+                        help="simulated minutes per real minute")
+    args = parser.parse_args(argv)
+
+    if args.data:
+        klines = dict((s, bt.load_klines(args.data, s, "1m"))
+                      for s in args.symbols)
+    else:
+        klines = dict((s, synthetic_klines(args.candles, seed=i))
+                      for i, s in enumerate(args.symbols))
+    exchange = FakeExchange(klines, balance=args.balance)
+    # the bot needs 500 candles of history
+    exchange.advance(500 * 15)
+    server = FakeExchangeServer(exchange, args.host, args.port, args.latency,
+                                args.weight_limit)
+    print("Serving %s on %s" % (", ".join(args.symbols), server.url))
+    server.start()
+    try:
+        while True:
+            time.sleep(60 / args.speed)
+            exchange.advance()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,72 @@
 from binance.client import Client
-import pandas as pd
+import contextvars
+import importlib
 import sys, os
 import config as cfg
 import math
 from datetime import datetime, timedelta
 import time
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
-import talib
-from binance.helpers import round_step_size
-from binance_f import RequestClient
+from binance.helpers import round_step_size, interval_to_milliseconds
+
+import engine
+import metrics
+import orders
+import scheduler
+from archive import KlineArchive
+from cache import KlineCache
+from candles import Candles, can_resample, stack
+from exchange import ExchangeMetadata
+from journal import TradeJournal
+from transport import Transport
+from wilder import WilderState, wilder_batch
+
+
+# map func over items on a pool of max_workers threads, results keep the order of items.
+# func runs in a copy of the caller's context, so the request priority of the caller holds.
+def concurrent_map(func, items, max_workers=4):
+    items = list(items)
+    if max_workers <= 1 or len(items) <= 1:
+        return [func(item) for item in items]
+    contexts = [contextvars.copy_context() for item in items]
+    with ThreadPoolExecutor(max_workers=min(max_workers,
+                                            len(items))) as executor:
+        return list(
+            executor.map(lambda context, item: context.run(func, item),
+                         contexts, items))
+
+
+# modules the helpers import on first use, they are not needed to start the bot. See preflight.
+LAZY_MODULES = ["talib"]
+
+# klines shared by the signal and trend helpers, see get_klines
+kline_cache = KlineCache()
+
+# klines kept on disk, None downloads them every time, see init_kline_archive
+kline_archive = None
+
+# interval the klines of longer intervals are built from, None downloads every interval. See init_resampling
+resample_base = None
+
+# base klines get_resampled_candles asks for, the most a request of weight 1 returns
+RESAMPLE_BASE_LIMIT = 99
+
+# ADX and ATR of the trend and volatility filters, a wilder.WilderState per (market, interval, contract
+# type), see advance_wilder_state
+wilder_states = {}
+
+# symbol filters of the exchange, see get_exchange_metadata
+exchange_metadata = ExchangeMetadata()
+
+# trades are queued here and written by a background thread, see init_trade_journal
+trade_journal = TradeJournal("trade_log.csv")
+
+# every request of the clients of init_client waits for it, see init_request_scheduler
+request_scheduler = scheduler.RequestScheduler()
+
+# connection pool and timeouts of the clients, see init_transport
+transport = Transport()
 
 
 def blockPrint():
@@ -19,13 +77,34 @@ def enablePrint():
     sys.stdout = sys.__stdout__
 
 
+# client class talking to base_url instead of binance, for both the spot (ping) and the futures endpoints
+def with_base_url(client_class, base_url):
+    base_url = base_url.rstrip("/")
+    return type(client_class.__name__, (client_class, ), {
+        "API_URL": base_url + "/api",
+        "FUTURES_URL": base_url + "/fapi",
+        "FUTURES_DATA_URL": base_url + "/futures/data",
+    })
+
+
 # create a binance request client
-def init_client():
-    client = Client(api_key=cfg.getPublicKey(), api_secret=cfg.getPrivateKey())
-    return client
+# base_url points the client to another server, e.g. a fake_exchange.FakeExchangeServer
+# the requests of the client wait for request_scheduler and are timed, see metrics.InstrumentedClient.
+# Every client shares the connection pool of transport.
+def init_client(base_url=None):
+    client_class = Client
+    if base_url is not None:
+        client_class = with_base_url(Client, base_url)
+    client = transport.client_class(client_class)(
+        api_key=cfg.getPublicKey(),
+        api_secret=cfg.getPrivateKey(),
+        requests_params=transport.requests_params())
+    return scheduler.ScheduledClient(metrics.InstrumentedClient(client),
+                                     request_scheduler)
 
 
 # get the current market price
+@metrics.timed
 def get_market_price(client, _market):
     price = client.futures_mark_price(symbol=_market)
     price = float(price['markPrice'])
@@ -33,6 +112,7 @@ def get_market_price(client, _market):
 
 
 # Get futures balances. We are interested in USDT by default as this is what we use as margin.
+@metrics.timed
 def get_futures_balance(client, _asset="USDT"):
     balances = client.futures_account_balance()
     asset_balance = 0
@@ -45,6 +125,7 @@ def get_futures_balance(client, _asset="USDT"):
 
 # Init the market we want to trade. First we change leverage type
 # then we change margin type
+@metrics.timed
 def initialise_futures(client, _market, _leverage=1, _margin_type="ISOLATED"):
     try:
         client.futures_change_leverage(symbol=_market, leverage=_leverage)
@@ -58,12 +139,14 @@ def initialise_futures(client, _market, _leverage=1, _margin_type="ISOLATED"):
 
 
 # get all of our open orders in a market
+@metrics.timed
 def get_orders(client, _market):
     orders = client.futures_get_open_orders(symbol=_market)
     return orders, len(orders)
 
 
 # Execute an order, this can open and close a trade
+@metrics.timed
 def execute_order(
     client,
     _market,
@@ -82,6 +165,7 @@ def execute_order(
 
 
 # close all opened position
+@metrics.timed
 def close_all_positions(client):
     positions = get_all_positons(client)
     for position in positions:
@@ -101,6 +185,7 @@ def close_all_positions(client):
 
 
 # close opened positions
+@metrics.timed
 def close_position_by_market(client, _market):
     position = get_positon_by_market(client, _market)
     _qty = float(position['positionAmt'])
@@ -117,27 +202,32 @@ def close_position_by_market(client, _market):
         execute_order(client, _market=_market, _qty=_qty, _side=_side)
 
 
+@metrics.timed
 def cancel_all_open_orders(client):
     client.futures_cancel_all_open_orders()
 
 
+@metrics.timed
 def cancel_open_orders_by_market(client, _market):
     client.futures_cancel_all_open_orders(symbol=_market)
 
 
 # get the liquidation price of the position we are in. - We don't use this - be careful!
+@metrics.timed
 def get_liquidation(client, _market):
     position = get_positon_by_market(client, _market)
     return position['liquidationPrice']
 
 
 # Get the entry price of the position the bot is in
+@metrics.timed
 def get_entry(client, _market):
     position = get_positon_by_market(client, _market)
     return position['entryPrice']
 
 
 # calculate how big a position we can open with the margin we have and the leverage we are using
+@metrics.timed
 def calculate_position_size(client, _market, usdt_balance=1.0, _leverage=1):
     price = get_market_price(client, _market)
     usdt_balance = float(usdt_balance)
@@ -147,6 +237,7 @@ def calculate_position_size(client, _market, usdt_balance=1.0, _leverage=1):
 
 
 # Create a trailing stop to close our order if something goes bad, lock in profits or if the trade goes against us!
+@metrics.timed
 def submit_trailing_order(
     client,
     _market,
@@ -166,27 +257,33 @@ def submit_trailing_order(
     )
 
 
+# the exchange metadata store, loaded on first use and then refreshed in the background.
+# Without a client one is created, the store is only downloaded once either way.
+def get_exchange_metadata(client=None):
+    if not exchange_metadata.loaded:
+        if client is None:
+            client = init_client()
+        exchange_metadata.fetch = client.futures_exchange_info
+        exchange_metadata.load()
+        exchange_metadata.start()
+    return exchange_metadata
+
+
 # get the precision of the market, this is needed to avoid errors when creating orders
 def get_market_precision(client, _market):
-    market_data = client.get_symbol_info(_market)
+    market_data = get_exchange_metadata(client).get(_market)
     step_size = 0.01
-    for filter in market_data['filters']:
-        if filter['filterType'] == 'LOT_SIZE':
-            step_size = float(filter['stepSize'])
+    if market_data is not None and market_data.step_size > 0:
+        step_size = market_data.step_size
     precision = int(round(-math.log(step_size / 0.01, 10), 0))
     return precision
 
 
-def get_market_precision_v2(_market):
-    client = RequestClient(api_key=cfg.getPublicKey(),
-                           secret_key=cfg.getPrivateKey(),
-                           url=cfg.getBotSettings().api_url)
-    market_data = client.get_exchange_information()
+def get_market_precision_v2(_market, client=None):
+    market_data = get_exchange_metadata(client).get(_market)
     precision = 3
-    for market in market_data.symbols:
-        if market.symbol == _market:
-            precision = market.quantityPrecision
-            break
+    if market_data is not None:
+        precision = market_data.quantity_precision
     return precision
 
 
@@ -195,6 +292,102 @@ def round_to_precision(_qty, _precision):
     return float(round(_qty, _precision))
 
 
+# download klines of a market, params are the limit and the start or end time of the request
+def download_klines(client, _market, _interval, _contract_type=None, **params):
+    if _contract_type is None:
+        return client.futures_klines(symbol=_market,
+                                     interval=_interval,
+                                     **params)
+    return client.futures_continous_klines(symbol=_market,
+                                           contractType=_contract_type,
+                                           interval=_interval,
+                                           **params)
+
+
+# bring the kline_archive file of a market up to date, only the candles after the last one stored are
+# downloaded. _start (ms) backfills a new file from that time.
+def sync_archive(client, _market, _interval, _contract_type=None, _start=None):
+    return kline_archive.sync(
+        lambda **params: download_klines(client, _market, _interval,
+                                         _contract_type, **params), _market,
+        _interval, _contract_type, _start)
+
+
+# get klines of a market through the shared cache.
+# _contract_type None uses the symbol klines, otherwise the continuous klines of that contract type.
+# With a kline_archive the klines are a float64 view of its file, one row per candle.
+@metrics.timed
+def get_klines(client, _market, _interval, _contract_type=None, _limit=500):
+    candles = kline_cache.get(_market, _interval, _contract_type, _limit)
+    if candles is None:
+        if kline_archive is not None:
+            candles = sync_archive(client, _market, _interval,
+                                   _contract_type).klines(_limit)
+        else:
+            candles = download_klines(client,
+                                      _market,
+                                      _interval,
+                                      _contract_type,
+                                      limit=_limit)
+        kline_cache.put(_market, _interval, candles, _contract_type, _limit)
+    return candles
+
+
+# the klines of get_klines as a candles.Candles of float64 column views, see KlineCache.columns.
+# Intervals built from resample_base come from get_resampled_candles.
+@metrics.timed
+def get_candles(client, _market, _interval, _contract_type=None, _limit=500):
+    if resampled(_interval, _contract_type):
+        return get_resampled_candles(client, _market, _interval, _limit)
+    candles = get_klines(client, _market, _interval, _contract_type, _limit)
+    if isinstance(candles, np.ndarray):
+        # klines of the archive are columns already
+        return Candles(*candles.T)
+    return kline_cache.columns(_market, _interval, candles, _contract_type)
+
+
+# the klines of the interval are built from resample_base
+def resampled(_interval, _contract_type=None):
+    return (resample_base is not None and _contract_type is None
+            and can_resample(resample_base, _interval))
+
+
+# klines of _interval built from the resample_base klines of get_candles, see candles.Resampler.
+# Only the first call, or one after the base klines lost track, downloads _interval klines.
+@metrics.timed
+def get_resampled_candles(client, _market, _interval, _limit=500):
+    base = get_candles(client,
+                       _market,
+                       resample_base,
+                       _limit=RESAMPLE_BASE_LIMIT)
+    resampler = kline_cache.store.resampler(_market, _interval, resample_base)
+    if not resampler.update(base):
+        resampler.seed(get_klines(client, _market, _interval))
+        resampler.update(base)
+    return resampler.columns(_limit)
+
+
+# klines of get_klines, as float64 rows of get_resampled_candles when the interval is built from
+# resample_base
+def get_kline_rows(client, _market, _interval, _limit=500):
+    if resampled(_interval):
+        return np.column_stack(
+            get_resampled_candles(client, _market, _interval, _limit))
+    return get_klines(client, _market, _interval, _limit=_limit)
+
+
+# download the resample_base klines once for the periods built from them, before they run concurrently.
+# _limit is the number of klines the base interval needs when it is one of the periods itself.
+def prefetch_base(client, _market, _periods, _limit=RESAMPLE_BASE_LIMIT):
+    if any(resampled(period) for period in _periods):
+        if resample_base not in _periods:
+            _limit = RESAMPLE_BASE_LIMIT
+        get_klines(client,
+                   _market,
+                   resample_base,
+                   _limit=max(_limit, RESAMPLE_BASE_LIMIT))
+
+
 # convert from client candle data into a set of lists
 def convert_candles(candles):
     o = []
@@ -240,16 +433,19 @@ def construct_heikin_ashi(o, h, l, c):
     return h_o, h_h, h_l, h_c
 
 
+@metrics.timed
 def get_all_positons(client):
     positions = client.futures_position_information()
     return positions
 
 
+@metrics.timed
 def get_positon_by_market(client, market):
     position = client.futures_position_information(symbol=market)
     return position[0]  # We have only one position
 
 
+@metrics.timed
 def check_in_position(client, market):
     position = get_positon_by_market(client, market)
 
@@ -261,6 +457,56 @@ def check_in_position(client, market):
     return in_position
 
 
+# an orders.OrderPlan of a market: the margin (the USDT balance when None), the mark price and the
+# precision are fetched now, so a signal only has to send the orders
+@metrics.timed
+def prepare_order(client, _market, _leverage=1, _callbackRate=2.0, _margin=None):
+    if _margin is None:
+        _margin = get_futures_balance(client, _asset="USDT")
+    price = get_market_price(client, _market)
+    precision = get_market_precision_v2(_market=_market, client=client)
+    return orders.OrderPlan(_market, _margin, price, precision, _leverage,
+                            _callbackRate)
+
+
+# open the position of a plan: the entry and its trailing stop in one batch request, see orders.py.
+# If the stop can not be placed the entry is closed again before the error is raised.
+@metrics.timed
+def place_position(client, plan, order_side="BUY"):
+    start = time.perf_counter()
+    entry = plan.entry_order(order_side)
+    stop = None
+    batched = hasattr(client, "futures_place_batch_order")
+    if batched:
+        entry, stop = client.futures_place_batch_order(
+            batchOrders=[entry, plan.stop_order(order_side)])
+        if orders.is_error(entry):
+            if "orderId" in stop:
+                # the stop alone would be left on the book
+                client.futures_cancel_order(symbol=plan.market,
+                                           orderId=stop["orderId"])
+            raise orders.rejected(entry)
+    else:
+        entry = client.futures_create_order(**entry)
+    entry_at = time.perf_counter()
+
+    if stop is None or orders.is_error(stop):
+        batched = False
+        try:
+            stop = client.futures_create_order(**plan.stop_order(order_side))
+        except Exception:
+            execute_order(client,
+                          _market=plan.market,
+                          _side=orders.STOP_SIDES[order_side],
+                          _qty=plan.qty)
+            raise
+    return orders.result(plan, order_side, entry, stop, batched, start,
+                         entry_at, time.perf_counter())
+
+
+# open a position with a trailing stop, the plan is made on the spot when none of the market is given or
+# the one given is stale, see orders.OrderPlan.stale
+@metrics.timed
 def open_position(
     client,
     market="BTCUSDT",
@@ -268,51 +514,47 @@ def open_position(
     order_side="BUY",
     stop_side="SELL",
     _callbackRate=2.0,
+    plan=None,
 ):
-    initialise_futures(client, _market=market, _leverage=leverage)
-    blockPrint()
-    qty = calculate_position(client, market, _leverage=leverage)
-    enablePrint()
-    execute_order(client, _market=market, _side=order_side, _qty=qty)
-    market_price = get_market_price(client, _market=market)
+    if plan is None or plan.market != market:
+        initialise_futures(client, _market=market, _leverage=leverage)
+        plan = prepare_order(client, market, leverage, _callbackRate)
+    elif plan.stale():
+        # the price or the balance may have moved too far for its quantity
+        plan = prepare_order(client, market, leverage, _callbackRate)
+    placed = place_position(client, plan, order_side)
     if order_side == "BUY":
         side = 1
     elif order_side == "SELL":
         side = -1
-    msg = f"{order_side}: {qty} ${market_price} using x{leverage} leverage"
-    # close any open trailing stops we have
-    client.futures_cancel_all_open_orders(symbol=market)
-    time.sleep(3)
+    msg = (f"{order_side}: {placed.qty} ${placed.price} using x{leverage} leverage, "
+           f"stop placed after {placed.timings['stop'] * 1000:.0f} ms")
     log_trade(
-        _qty=qty,
+        _qty=placed.qty,
         _market=market,
         _leverage=leverage,
         _side=side,
         _cause="Signal Change",
         _trigger_price=0,
-        _market_price=market_price,
+        _market_price=placed.price,
         _type=order_side,
     )
-    # Let the order execute and then create a trailing stop market order.
-    time.sleep(3)
-    submit_trailing_order(client,
-                          _market=market,
-                          _qty=qty,
-                          _side=stop_side,
-                          _callbackRate=_callbackRate)
 
-    return qty, side, msg
+    return placed.qty, side, msg
 
 
+@metrics.timed
 def handle_siganl(client,
                   entry,
                   market="BTCUSDT",
                   leverage=3,
-                  _callbackRate=2.0):
+                  _callbackRate=2.0,
+                  plan=None):
     '''
     Handle a given singal.
 
     entry:array: signals across multiple time scales. signal of -1 is SHORT, 1 is LONG and 0 is Not confirmed.
+    plan:OrderPlan: the position prepared before the signal, see prepare_order.
     '''
 
     # SELL signals are confirmed across given time scales
@@ -324,6 +566,7 @@ def handle_siganl(client,
             order_side="SELL",
             stop_side="BUY",
             _callbackRate=_callbackRate,
+            plan=plan,
         )
 
     # BUY signals are confirmed across given time scales
@@ -335,11 +578,14 @@ def handle_siganl(client,
             order_side="BUY",
             stop_side="SELL",
             _callbackRate=_callbackRate,
+            plan=plan,
         )
 
 
 # create a dataframe for our candles
 def to_dataframe(o, h, l, c, v):
+    import pandas as pd
+
     df = pd.DataFrame()
 
     df["open"] = o
@@ -457,24 +703,42 @@ def trading_signal(h_o, h_h, h_l, h_c, use_last=False):
 
 # get the data from the market, create heikin ashi candles and then generate signals
 # return the signals to the bot
-def get_signal(client, _market, _period="15m", use_last=False):
-    candles = client.futures_klines(symbol=_market, interval=_period)
+# backend "numpy" uses the array engine, "python" the list based functions above. Both give the same signals.
+@metrics.timed
+def get_signal(client, _market, _period="15m", use_last=False, backend="numpy"):
+    if backend == "numpy":
+        candles = get_candles(client, _market, _period)
+        h_o, h_h, h_l, h_c = engine.construct_heikin_ashi(
+            candles.open, candles.high, candles.low, candles.close)
+        return engine.trading_signal(h_o, h_h, h_l, h_c, use_last)
+    if backend != "python":
+        raise ValueError("Unknown signal backend: " + str(backend))
+    candles = get_klines(client, _market, _period)
     o, h, l, c, v = convert_candles(candles)
     h_o, h_h, h_l, h_c = construct_heikin_ashi(o, h, l, c)
-    ohlcv = to_dataframe(h_o, h_h, h_l, h_c, v)
     entry = trading_signal(h_o, h_h, h_l, h_c, use_last)
     return entry
 
 
 # get signal that is confirmed across multiple time scales
-def get_multi_scale_signal(client, _market, _periods=["1m"]):
+# the periods are fetched and computed concurrently on _max_workers threads
+@metrics.timed
+def get_multi_scale_signal(client,
+                           _market,
+                           _periods=["1m"],
+                           backend="numpy",
+                           _max_workers=4):
 
     signals = np.zeros(499)
     use_last = True
 
-    for i, v in enumerate(_periods):
+    prefetch_base(client, _market, _periods, 500)
+    _signals = concurrent_map(
+        lambda v: get_signal(
+            client, _market, _period=v, use_last=use_last, backend=backend),
+        _periods, _max_workers)
 
-        _signal = get_signal(client, _market, _period=v, use_last=use_last)
+    for _signal in _signals:
         signals = signals + np.array(_signal)
 
     signals = signals / len(_periods)
@@ -492,7 +756,89 @@ def get_multi_scale_signal(client, _market, _periods=["1m"]):
     return trade_signal
 
 
+# combine signals of several time scales, a signal is only kept when every time scale agrees on it
+def combine_signals(signals):
+    if len(signals) > 0 and all(s == 1 for s in signals):
+        return 1
+    if len(signals) > 0 and all(s == -1 for s in signals):
+        return -1
+    return 0
+
+
+# advance the SignalState of one period, returns the signal of the last closed candle and of the open one
+def advance_signal_state(client, _market, states, _period, _limit=5):
+    state = states.get((_market, _period))
+    candles = None
+    if state is not None and state.open_time is not None:
+        candles = get_kline_rows(client, _market, _period, _limit=_limit)
+        next_open_time = state.open_time + interval_to_milliseconds(_period)
+        if len(candles) == 0 or int(candles[0][0]) > next_open_time:
+            candles = None
+
+    if candles is None:
+        state = engine.SignalState(_market, _period)
+        states[(_market, _period)] = state
+        candles = get_kline_rows(client, _market, _period)
+        state.seed(candles)
+    else:
+        for candle in candles[:-1]:
+            state.update(candle)
+
+    return state.entry, state.peek(candles[-1])
+
+
+@metrics.timed
+def get_streaming_signal(client,
+                         _market,
+                         states,
+                         _periods=["1m"],
+                         _limit=5,
+                         _max_workers=4):
+    """
+    Same signal as get_multi_scale_signal but computed incrementally.
+
+    states:dict: SignalState per (market, period), filled on the first call by downloading the full history.
+    Later calls only download the newest `_limit` candles and advance the states with the ones that closed.
+    If more candles closed than were downloaded the state is seeded again. Periods run concurrently.
+
+    Returns [signal of the last closed candle, signal of the candle still open] so entry[-2] reads the same way.
+    """
+    prefetch_base(client, _market, _periods)
+    results = concurrent_map(
+        lambda period: advance_signal_state(client, _market, states, period,
+                                            _limit), _periods, _max_workers)
+    closed = [r[0] for r in results]
+    current = [r[1] for r in results]
+
+    return [combine_signals(closed), combine_signals(current)]
+
+
+# advance the SignalStates with the candles buffered by a stream.KlineFeed, no request is made
+def get_feed_signal(_market, states, feed):
+    closed = []
+    current = []
+    for period in feed.intervals:
+        candles = feed.closed_candles(period)
+        state = states.get((_market, period))
+        if state is None:
+            state = engine.SignalState(_market, period)
+            states[(_market, period)] = state
+        elif (state.open_time is not None and len(candles) > 0 and
+              candles[0][0] > state.open_time + interval_to_milliseconds(period)):
+            # the feed lost more candles than it could backfill
+            state.reset()
+        for candle in candles:
+            state.update(candle)
+
+        closed.append(state.entry)
+        candle = feed.open_candle(period)
+        current.append(state.entry if candle is None else state.peek(candle))
+
+    return [combine_signals(closed), combine_signals(current)]
+
+
 # calculate a rounded position size for the bot, based on current USDT holding, leverage and market
+@metrics.timed
 def calculate_position(client, _market, _leverage=1):
     usdt = get_futures_balance(client, _asset="USDT")
     quantity = 0.0
@@ -500,7 +846,7 @@ def calculate_position(client, _market, _leverage=1):
                                   usdt_balance=usdt,
                                   _market=_market,
                                   _leverage=_leverage)
-    precision_v2 = get_market_precision_v2(_market=_market)
+    precision_v2 = get_market_precision_v2(_market=_market, client=client)
     quantity = round_to_precision(qty, precision_v2)
     return quantity
 
@@ -516,40 +862,147 @@ def log_trade(
     _market_price=0,
     _type="exit",
 ):
-    df = pd.read_csv("trade_log.csv")
-    df2 = pd.DataFrame()
-    df2["date"] = [str(datetime.now())]
-    df2["market"] = [_market]
-    df2["qty"] = [_qty]
-    df2["leverage"] = [_leverage]
-    df2["cause"] = [_cause]
-    df2["side"] = [_side]
-    df2["trigger_price"] = [_trigger_price]
-    df2["market_price"] = [_market_price]
-    df2["type"] = [_type]
-
-    df = df.append(df2, ignore_index=True)
-    df.to_csv("trade_log.csv", index=False)
-
-
-def get_valid_market(client, adx_threshold=25, volume_threshold=200000000.00):
+    trade_journal.append(date=datetime.now(),
+                         market=_market,
+                         qty=_qty,
+                         leverage=_leverage,
+                         cause=_cause,
+                         side=_side,
+                         trigger_price=_trigger_price,
+                         market_price=_market_price,
+                         type=_type)
+
+
+# import the LAZY_MODULES, talib takes a good part of a second
+def import_lazy_modules():
+    for name in LAZY_MODULES:
+        importlib.import_module(name)
+
+
+# warm up before the first cycle: import the LAZY_MODULES while a connection of the pool is opened, the
+# exchange information and the balance are loaded. Returns the seconds it took.
+@metrics.timed
+def preflight(client):
+    start = time.monotonic()
+    concurrent_map(lambda task: task(), [
+        import_lazy_modules,
+        client.futures_ping,
+        lambda: get_exchange_metadata(client),
+        lambda: get_futures_balance(client),
+    ], 4)
+    return time.monotonic() - start
+
+
+# build the klines of longer intervals from the klines of base, e.g. "1m", so a market needs one kline
+# request per cycle. None downloads every interval.
+def init_resampling(base="1m"):
+    global resample_base
+    resample_base = base
+    kline_cache.clear()
+
+
+# keep the klines in memory-mapped files below path, see archive.py. None turns the archive off.
+# history is the number of klines a new file starts with, at least the _limit of get_klines.
+def init_kline_archive(path="data/archive", history=500):
+    global kline_archive
+    if kline_archive is not None:
+        kline_archive.close()
+    kline_archive = None
+    if path is not None:
+        kline_archive = KlineArchive(path, history)
+    kline_cache.clear()
+    return kline_archive
+
+
+# replace the transport of the clients created from now on, the ones already created keep theirs
+def init_transport(pool_size=16, timeout=10.0, keep_alive_seconds=30.0):
+    global transport
+    transport = Transport(pool_size, timeout, keep_alive_seconds)
+    return transport
+
+
+# set the rate limits of the request scheduler, the clients already created use them too.
+# reserve is the fraction of the weight limit the market scan leaves to the orders.
+def init_request_scheduler(weight_per_minute=2400,
+                           orders_per_minute=1200,
+                           orders_per_10s=300,
+                           reserve=0.2):
+    request_scheduler.set_limits(weight_per_minute, orders_per_minute,
+                                 orders_per_10s, reserve)
+    return request_scheduler
+
+
+# replace the trade journal, queued trades of the previous one are written first.
+# max_mb and rotate_daily rotate the journal file, fmt is "csv" or "columnar".
+def init_trade_journal(path="trade_log.csv",
+                       fmt="csv",
+                       max_mb=None,
+                       rotate_daily=False):
+    global trade_journal
+    trade_journal.close()
+    max_bytes = None
+    if max_mb:
+        max_bytes = int(float(max_mb) * 1024 * 1024)
+    trade_journal = TradeJournal(path,
+                                 fmt,
+                                 max_bytes=max_bytes,
+                                 rotate_daily=rotate_daily)
+    return trade_journal
+
+
+@metrics.timed
+@scheduler.with_priority(scheduler.SCAN)
+def scan_markets(client,
+                 adx_threshold=25,
+                 volume_threshold=200000000.00,
+                 max_workers=8):
     """
-    Get a valid market; trending with a high volume.
+    Scan every USDT perpetual market for trending markets with a high volume.
+
+    The volume filter uses a single all-symbols ticker download, the ADX is then only computed for the
+    markets left, concurrently on max_workers threads.
+
+    Returns a list of (symbol, adx_5min, adx_15min, volume), strongest trend first.
+    """
+    perpetuals = set()
+    for item in get_exchange_metadata(client).symbols():
+        if item.contract_type == 'PERPETUAL' and item.margin_asset == 'USDT':
+            perpetuals.add(item.symbol)
+
+    volumes = {}
+    for ticker in client.futures_ticker():
+        if ticker['symbol'] in perpetuals:
+            volume = float(ticker['quoteVolume'])
+            if volume >= volume_threshold:
+                volumes[ticker['symbol']] = volume
+
+    symbols = list(volumes)
+    trends = concurrent_map(lambda s: is_trend(client, s, adx_threshold),
+                            symbols, max_workers)
+
+    markets = []
+    for symbol, (is_trend_, adx_5min_, adx_15min_) in zip(symbols, trends):
+        if is_trend_:
+            markets.append((symbol, adx_5min_, adx_15min_, volumes[symbol]))
+    markets.sort(key=lambda m: min(m[1], m[2]), reverse=True)
+    return markets
+
+
+@metrics.timed
+def get_valid_market(client,
+                     adx_threshold=25,
+                     volume_threshold=200000000.00,
+                     max_workers=8):
     """
-    import random
-    info = client.futures_exchange_info()
-    item = random.choice(info['symbols'])
-    symbol, contractType, marginAsset = item['symbol'], item[
-        'contractType'], item['marginAsset']
-    if (contractType == 'PERPETUAL' and marginAsset == 'USDT'):
-        is_trend_, adx_15min, adx_5min = is_trend(client, symbol,
-                                                  adx_threshold)
-        is_high_volume_, volume = is_high_volume(client, symbol,
-                                                 volume_threshold)
-        if is_trend_ and is_high_volume_:
-            return symbol
+    Get a valid market; trending with a high volume. The strongest trend of a full scan is returned.
+    """
+    markets = scan_markets(client, adx_threshold, volume_threshold,
+                           max_workers)
+    if len(markets) > 0:
+        return markets[0][0]
 
 
+@metrics.timed
 def is_high_volume(client, market, volume_threshold):
     if market != None:
         ticker = client.futures_ticker(symbol=market)
@@ -560,106 +1013,178 @@ def is_high_volume(client, market, volume_threshold):
             return False, volume
 
 
+# advance the WilderState of a market and interval with the candles closed since the last call and return it.
+# The first call, or one after more than _limit candles closed, seeds it from the full history.
+def advance_wilder_state(client,
+                         _market,
+                         _interval,
+                         _contract_type=None,
+                         _limit=5):
+    key = (_market, _interval, _contract_type)
+    state = wilder_states.get(key)
+    if state is not None and state.resume(get_candles(
+            client, _market, _interval, _contract_type, _limit)):
+        return state
+
+    state = WilderState(_market, _interval)
+    candles = get_candles(client, _market, _interval, _contract_type)
+    state.seed(np.column_stack(candles).tolist())
+    wilder_states[key] = state
+    return state
+
+
+@metrics.timed
 def is_trend(client, market, adx_threshold):
     """
-    Check if a given market 
+    Check if a given market trends: the ADX14 of the last closed 5min and 15min candles, computed
+    incrementally, is at or above adx_threshold.
     """
-    adx_15min_ = adx_15min(client, market)
-    adx_5min_ = adx_5min(client, market)
+    adx_15min_ = advance_wilder_state(client, market,
+                                      Client.KLINE_INTERVAL_15MINUTE).adx
+    adx_5min_ = advance_wilder_state(client, market,
+                                     Client.KLINE_INTERVAL_5MINUTE).adx
     if adx_15min_ >= adx_threshold and adx_5min_ >= adx_threshold:
         return True, adx_5min_, adx_15min_
     else:
         return False, adx_5min_, adx_15min_
 
 
+@metrics.timed
 def is_volatile(client, market, atr_threshold):
     """
-    Check if a given market is volatile
+    Check if a given market is volatile: the ATR14 of the last closed 5min and 15min candles, computed
+    incrementally, is at or above atr_threshold.
     """
-    if (atr_15min(client, market) >= atr_threshold
-            and atr_5min(client, market) >= atr_threshold):
+    atr_15min_ = advance_wilder_state(client, market,
+                                      Client.KLINE_INTERVAL_15MINUTE,
+                                      _contract_type='PERPETUAL').atr
+    atr_5min_ = advance_wilder_state(client, market,
+                                     Client.KLINE_INTERVAL_5MINUTE,
+                                     _contract_type='PERPETUAL').atr
+    if atr_15min_ >= atr_threshold and atr_5min_ >= atr_threshold:
         return True
     else:
         return False
 
 
-def adx_5min(client, market, timeperiod=14):
+# candles.Candles of (markets, candles) matrices of the last _limit klines of every market, see candles.stack.
+# A market with a shorter history is right aligned after nan. The klines are downloaded concurrently.
+def get_candle_matrix(client, _markets, _interval, _limit=500, _max_workers=8):
+    candles = concurrent_map(
+        lambda market: get_candles(client, market, _interval, _limit=_limit),
+        _markets, _max_workers)
+    return stack(candles, _limit)
+
+
+# ADX, ATR and trading signal of every market of a candle matrix (see get_candle_matrix) in one vectorized
+# pass. Returns arrays of the values of the last closed candle of every market, like adx_from_candles,
+# atr_from_candles and get_signal(..., use_last)[-2]. nan (0 for the signal) without enough candles.
+def batch_indicators(candles, timeperiod=14, use_last=True):
+    adx, atr = wilder_batch(candles.high, candles.low, candles.close,
+                            timeperiod)
+    h_o, h_h, h_l, h_c = engine.construct_heikin_ashi_batch(
+        candles.open, candles.high, candles.low, candles.close)
+    entry = engine.trading_signal_batch(h_o, h_h, h_l, h_c, use_last)
+    return adx[:, -2], atr[:, -2], entry[:, -2]
+
+
+@metrics.timed
+def batch_is_trend(client, markets, adx_threshold, max_workers=8):
     """
-    Calculate current ADX14 of a given market in 5min based kline.
+    is_trend of every market, with the ADX14 of all of them computed in one pass per interval.
+
+    Returns a list of (is trend, adx_5min, adx_15min), in the order of markets.
     """
-    candles_5min = client.futures_klines(
-        symbol=market, interval=Client.KLINE_INTERVAL_5MINUTE)
+    adx = []
+    for interval in (Client.KLINE_INTERVAL_5MINUTE,
+                     Client.KLINE_INTERVAL_15MINUTE):
+        candles = get_candle_matrix(client, markets, interval,
+                                    _max_workers=max_workers)
+        adx.append(
+            wilder_batch(candles.high, candles.low, candles.close)[0][:, -2])
+    adx_5min_, adx_15min_ = adx
+    return [(bool(a >= adx_threshold and b >= adx_threshold), a, b)
+            for a, b in zip(adx_5min_.tolist(), adx_15min_.tolist())]
+
 
-    candles_5min_arr = np.array(candles_5min).astype("float64")
+# high, low and close arrays of a candles.Candles (no copy) or of raw client candles
+def _high_low_close(candles):
+    if isinstance(candles, Candles):
+        return candles.high, candles.low, candles.close
+    candles_arr = np.array(candles).astype("float64")
+    return candles_arr[:, 2], candles_arr[:, 3], candles_arr[:, 4]
 
-    high = candles_5min_arr[:, 2]
-    low = candles_5min_arr[:, 3]
-    close = candles_5min_arr[:, 4]
+
+# ADX of candles, see _high_low_close, the value of the last closed candle is returned
+def adx_from_candles(candles, timeperiod=14):
+    import talib
+
+    high, low, close = _high_low_close(candles)
 
     adx = talib.ADX(high, low, close, timeperiod=timeperiod)
 
     return adx[-2]
 
 
-def adx_15min(client, market, timeperiod=14):
+# ATR of candles, see _high_low_close, the value of the last closed candle is returned
+def atr_from_candles(candles, timeperiod=14):
+    import talib
+
+    high, low, close = _high_low_close(candles)
+
+    atr = talib.ATR(high, low, close, timeperiod=timeperiod)
+
+    return atr[-2]
+
+
+@metrics.timed
+def adx_5min(client, market, timeperiod=14):
     """
-    Calculate current ADX14 of a given market in 15min based kline.
+    Calculate current ADX14 of a given market in 5min based kline.
     """
+    candles_5min = get_candles(client, market, Client.KLINE_INTERVAL_5MINUTE)
 
-    candles_15min = client.futures_klines(
-        symbol=market, interval=Client.KLINE_INTERVAL_15MINUTE)
+    return adx_from_candles(candles_5min, timeperiod=timeperiod)
 
-    candles_15min_arr = np.array(candles_15min).astype("float64")
 
-    high = candles_15min_arr[:, 2]
-    low = candles_15min_arr[:, 3]
-    close = candles_15min_arr[:, 4]
+@metrics.timed
+def adx_15min(client, market, timeperiod=14):
+    """
+    Calculate current ADX14 of a given market in 15min based kline.
+    """
 
-    adx = talib.ADX(high, low, close, timeperiod=timeperiod)
+    candles_15min = get_candles(client, market,
+                                Client.KLINE_INTERVAL_15MINUTE)
 
-    return adx[-2]
+    return adx_from_candles(candles_15min, timeperiod=timeperiod)
 
 
+@metrics.timed
 def atr_15min(client, market, timeperiod=14):
     """
     Calculate current ATR14 of a given market in 15min based kline.
     """
 
-    candles_15min = client.futures_continous_klines(
-        symbol=market,
-        contractType='PERPETUAL',
-        interval=Client.KLINE_INTERVAL_15MINUTE)
+    candles_15min = get_candles(client,
+                                market,
+                                Client.KLINE_INTERVAL_15MINUTE,
+                                _contract_type='PERPETUAL')
 
-    candles_15min_arr = np.array(candles_15min).astype("float64")
-
-    high = candles_15min_arr[:, 2]
-    low = candles_15min_arr[:, 3]
-    close = candles_15min_arr[:, 4]
-
-    atr = talib.ATR(high, low, close, timeperiod=timeperiod)
-
-    return atr[-2]
+    return atr_from_candles(candles_15min, timeperiod=timeperiod)
 
 
+@metrics.timed
 def atr_5min(client, market, timeperiod=14):
     """
     Calculate current ATR14 of a given market in 5min based kline.
     """
 
-    candles_5min = client.futures_continous_klines(
-        symbol=market,
-        contractType='PERPETUAL',
-        interval=Client.KLINE_INTERVAL_5MINUTE)
-
-    candles_5min_arr = np.array(candles_5min).astype("float64")
+    candles_5min = get_candles(client,
+                               market,
+                               Client.KLINE_INTERVAL_5MINUTE,
+                               _contract_type='PERPETUAL')
 
-    high = candles_5min_arr[:, 2]
-    low = candles_5min_arr[:, 3]
-    close = candles_5min_arr[:, 4]
-
-    atr = talib.ATR(high, low, close, timeperiod=timeperiod)
-
-    return atr[-2]
+    return atr_from_candles(candles_5min, timeperiod=timeperiod)
 
 
 if __name__ == '__main__':
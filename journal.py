@@ -0,0 +1,291 @@
+"""
+Append-only trade journal.
+
+TradeJournal.append only queues the record; a background thread writes the
+queued records in batches with one fsync per batch. Two formats are
+supported:
+
+- "csv": one line per trade, same columns as the original trade_log.csv.
+- "columnar": a directory holding one raw little-endian file per column
+  (see SCHEMA), readable with numpy.fromfile. The file `rows` holds the
+  number of rows committed as one int64, it is replaced once every column
+  of a batch is written. Only that many rows of a column are read, and a
+  column longer than that (a crash during a batch) is cut back to it
+  before the next batch is appended.
+
+The current file (or directory) is rotated once it grows past `max_bytes`
+or, with `rotate_daily`, when the day changes. Rotated files keep the
+current name with a timestamp inserted before the extension so they sort
+chronologically. load_journal reads the rotated files and the current one
+back in order.
+"""
+import csv
+import glob
+import io
+import os
+import threading
+from datetime import datetime
+
+import numpy as np
+
+FIELDS = [
+    "market", "leverage", "qty", "cause", "side", "trigger_price", "type",
+    "market_price", "date"
+]
+
+# columns loaded as float64 from the csv format
+NUMERIC_FIELDS = ["leverage", "qty", "trigger_price", "market_price"]
+
+# column dtypes of the columnar format, strings longer than the width are truncated
+SCHEMA = [
+    ("date", "datetime64[us]"),
+    ("market", "S24"),
+    ("leverage", "<i4"),
+    ("qty", "<f8"),
+    ("cause", "S24"),
+    ("side", "S8"),
+    ("trigger_price", "<f8"),
+    ("type", "S16"),
+    ("market_price", "<f8"),
+]
+
+# file of the columnar format holding the number of rows committed
+ROWS_FILE = "rows"
+
+
+# rotated files first, oldest to newest, then the current one
+def journal_files(path):
+    root, ext = os.path.splitext(path)
+    rotated = sorted(
+        p for p in glob.glob(glob.escape(root) + ".*" + glob.escape(ext))
+        if p != path)
+    if os.path.exists(path):
+        rotated.append(path)
+    return rotated
+
+
+class TradeJournal():
+    def __init__(self,
+                 path="trade_log.csv",
+                 fmt="csv",
+                 max_bytes=None,
+                 rotate_daily=False,
+                 flush_interval=1.0,
+                 clock=datetime.now):
+        if fmt not in ("csv", "columnar"):
+            raise ValueError("Unknown journal format: " + str(fmt))
+        self.path = path
+        self.fmt = fmt
+        self.max_bytes = max_bytes
+        self.rotate_daily = rotate_daily
+        self.flush_interval = flush_interval
+        self.clock = clock
+
+        self._pending = []
+        self._lock = threading.Lock()
+        # only one writer at a time, the background thread or an explicit flush
+        self._write_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = threading.Event()
+        self._thread = None
+        self._day = None
+
+    # queue a trade, it is written by the background thread
+    def append(self, **record):
+        if "date" not in record:
+            record["date"] = self.clock()
+        with self._lock:
+            self._pending.append(record)
+        if self._thread is None:
+            self.start()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._closed.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    # write every queued record now, returns the number written
+    def flush(self):
+        with self._write_lock:
+            with self._lock:
+                records, self._pending = self._pending, []
+            if len(records) == 0:
+                return 0
+            self._rotate(records[0]["date"])
+            if self.fmt == "csv":
+                self._write_csv(records)
+            else:
+                self._write_columnar(records)
+            return len(records)
+
+    def close(self):
+        self._closed.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def size(self):
+        if not os.path.exists(self.path):
+            return 0
+        if os.path.isdir(self.path):
+            return sum(
+                os.path.getsize(os.path.join(self.path, name))
+                for name in os.listdir(self.path))
+        return os.path.getsize(self.path)
+
+    def _rotate(self, now):
+        day = now.date() if isinstance(now, datetime) else None
+        if self._day is None and os.path.exists(self.path):
+            modified = datetime.fromtimestamp(os.path.getmtime(self.path))
+            self._day = modified.date()
+        rotate = False
+        if self.rotate_daily and day is not None and self._day is not None:
+            rotate = day != self._day
+        if self.max_bytes is not None and self.size() >= self.max_bytes:
+            rotate = True
+        if rotate and os.path.exists(self.path):
+            root, ext = os.path.splitext(self.path)
+            stamp = self.clock().strftime("%Y%m%d-%H%M%S-%f")
+            os.rename(self.path, root + "." + stamp + ext)
+        if day is not None:
+            self._day = day
+
+    def _write_csv(self, records):
+        new = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer,
+                                fieldnames=FIELDS,
+                                extrasaction="ignore",
+                                lineterminator="\n")
+        if new:
+            writer.writeheader()
+        for record in records:
+            writer.writerow(dict(record, date=str(record["date"])))
+        with open(self.path, "a") as f:
+            f.write(buffer.getvalue())
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _write_columnar(self, records):
+        os.makedirs(self.path, exist_ok=True)
+        rows = committed_rows(self.path)
+        for name, dtype in SCHEMA:
+            values = [record.get(name, 0) for record in records]
+            if dtype.startswith("S"):
+                values = [str(v).encode() for v in values]
+            column = np.array(values, dtype=dtype)
+            file = os.path.join(self.path, name + ".col")
+            with open(file, "r+b" if os.path.exists(file) else "wb") as f:
+                # rows of a batch that was not committed are dropped
+                f.truncate(rows * column.itemsize)
+                f.seek(0, os.SEEK_END)
+                column.tofile(f)
+                f.flush()
+                os.fsync(f.fileno())
+        # the batch counts once the number of rows is replaced
+        tmp = os.path.join(self.path, ROWS_FILE + ".tmp")
+        with open(tmp, "wb") as f:
+            np.array([rows + len(records)], dtype="<i8").tofile(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, os.path.join(self.path, ROWS_FILE))
+
+
+# number of rows committed to a columnar journal. A directory written before the rows file existed counts
+# the rows of its shortest column.
+def committed_rows(path):
+    file = os.path.join(path, ROWS_FILE)
+    if os.path.exists(file):
+        return int(np.fromfile(file, dtype="<i8", count=1)[0])
+    lengths = [
+        os.path.getsize(os.path.join(path, name + ".col")) //
+        np.dtype(dtype).itemsize for name, dtype in SCHEMA
+        if os.path.exists(os.path.join(path, name + ".col"))
+    ]
+    return min(lengths) if len(lengths) == len(SCHEMA) else 0
+
+
+def _load_columnar(path):
+    rows = committed_rows(path)
+    columns = {}
+    for name, dtype in SCHEMA:
+        if rows > 0:
+            columns[name] = np.fromfile(os.path.join(path, name + ".col"),
+                                        dtype=dtype,
+                                        count=rows)
+        else:
+            columns[name] = np.empty(0, dtype=dtype)
+    return columns
+
+
+def _load_csv(path):
+    columns = dict((name, []) for name in FIELDS)
+    with open(path, newline="") as f:
+        for row in csv.DictReader(f):
+            if not any(row.values()):
+                continue
+            for name in FIELDS:
+                columns[name].append(row.get(name))
+    return columns
+
+
+def _to_float(values):
+    out = np.full(len(values), np.nan)
+    for i, v in enumerate(values):
+        try:
+            out[i] = float(v)
+        except (TypeError, ValueError):
+            pass
+    return out
+
+
+def load_journal(path="trade_log.csv", fmt="csv", as_frame=True):
+    """
+    Load the whole trade history, rotated files included.
+
+    Returns a pandas DataFrame, or a dict of numpy arrays with as_frame=False.
+    """
+    if fmt == "csv" and as_frame:
+        import pandas as pd
+        frames = [pd.read_csv(file) for file in journal_files(path)]
+        if len(frames) == 0:
+            return pd.DataFrame(columns=FIELDS)
+        return pd.concat(frames, ignore_index=True)
+
+    parts = []
+    for file in journal_files(path):
+        if fmt == "columnar":
+            parts.append(_load_columnar(file))
+        else:
+            parts.append(_load_csv(file))
+
+    names = [name for name, dtype in SCHEMA] if fmt == "columnar" else FIELDS
+    columns = {}
+    for name in names:
+        values = [part[name] for part in parts]
+        if fmt == "columnar":
+            dtype = dict(SCHEMA)[name]
+            columns[name] = np.concatenate(
+                values) if values else np.empty(0, dtype=dtype)
+        elif name in NUMERIC_FIELDS:
+            columns[name] = _to_float(sum(values, []))
+        else:
+            columns[name] = np.array(sum(values, []), dtype=object)
+
+    if fmt == "columnar":
+        for name, dtype in SCHEMA:
+            if dtype.startswith("S"):
+                columns[name] = columns[name].astype("U")
+
+    if not as_frame:
+        return columns
+    import pandas as pd
+    return pd.DataFrame(columns, columns=names)
@@ -1,3 +1,5 @@
+import argparse
+import asyncio
 import json
 import logging
 import os
@@ -6,13 +8,16 @@ import sys
 import time
 import traceback
 from datetime import datetime
-from threading import Thread
+from threading import Event, Thread
 
 from binance.exceptions import BinanceAPIException
 from requests.exceptions import RequestException
 
 import config as cfg
 import helper as h
+import metrics
+from stream import AccountFeed, KlineFeed
+from transport import KeepAlive
 
 logging.basicConfig(
     stream=sys.stdout,
@@ -28,29 +33,66 @@ class Megalodon():
 
         signal.signal(signal.SIGTERM, self.signal_term_handler)
 
-        # Connect to the binance api and produce a client
-        self.client = h.init_client()
-
         # Load settings from settings.json
         settings = cfg.getBotSettings()
+
+        # Connect to the binance api and produce a client, its connections are kept open
+        h.init_transport(settings.http.pool_size, settings.http.timeout,
+                         settings.http.keep_alive_seconds)
+        self.client = h.init_client()
+        self.keep_alive = None
+
         self.leverage = int(settings.leverage)
         self.margin_type = settings.margin_type
         self.confirmation_periods = settings.trading_periods.split(",")
+        self.signal_workers = int(settings.signal_workers)
         self.trailing_percentage = float(settings.trailing_percentage)
+        self.stream_url = settings.stream_url
         self.adx_threshold = float(settings.market.adx_threshold)
         self.volume_threshold = float(settings.market.volume_threshold)
         self.market_time_out_minutes = float(
             settings.market.market_time_out_minutes)
+        self.scan_workers = int(settings.market.scan_workers)
+        self.metrics_settings = settings.metrics
+        h.init_request_scheduler(settings.rate_limit.weight_per_minute,
+                                 settings.rate_limit.orders_per_minute,
+                                 settings.rate_limit.orders_per_10s,
+                                 settings.rate_limit.reserve)
+        h.init_trade_journal(settings.trade_log.path,
+                             settings.trade_log.format,
+                             settings.trade_log.max_mb,
+                             settings.trade_log.rotate_daily)
+        h.init_kline_archive(settings.kline_archive.path,
+                             settings.kline_archive.history)
+        h.init_resampling(settings.resample_base)
 
         # global values used by bot to keep track of state
         self.market = None
         self.side = 0
         self.qty = 0.0
         self.last_trend_check = None
+        self.signal_states = {}
+        # the next position, sized while there is no signal, see helper.prepare_order
+        self.order_plan = None
+        # kline stream of the current market, wakes the main loop when a candle closes
+        self.feed = None
+        # user data stream of the account, wakes the main loop when the position closes
+        self.account = None
+        # clock time the position was opened at, see AccountFeed.position_closed
+        self.opened_at = None
+        self.wake = Event()
 
-    def start(self):
+    # preflight warms the connections and caches up before the first cycle
+    def start(self, preflight=False):
+        metrics.start(self.metrics_settings)
+        self.keep_alive = KeepAlive(self.client,
+                                    h.transport.keep_alive_seconds).start()
+        self.start_account_feed()
+        if preflight:
+            self.preflight()
         logger.info("Bot started.")
         while True:
+            cycle_start = time.monotonic()
             try:
                 while self.market == None:
                     self.look_for_market()
@@ -65,20 +107,18 @@ class Megalodon():
                         logger.info('%s: %s min ended, market reset.',
                                     self.market,
                                     str(self.market_time_out_minutes))
-                        self.market = None
-                        self.side = 0
+                        self.release_market()
                         continue
+                    self.prepare_order()
 
                 # Market detected and (BUY/SELL) postion oppend.
                 else:
                     # if trailing stop tiggered and therefor the postion closed
-                    position_active = h.check_in_position(
-                        self.client, self.market)
+                    position_active = self.position_active()
                     if position_active == False:
                         # close any open trailing stops we have one
                         h.cancel_open_orders_by_market(self.client,
                                                        _market=self.market)
-                        time.sleep(3)
                         logger.info('%s : Trailing Stop Triggered.',
                                     self.market)
                         h.log_trade(_qty=self.qty,
@@ -86,13 +126,13 @@ class Megalodon():
                                     _leverage=self.leverage,
                                     _side=self.side,
                                     _cause="Signal Change",
-                                    _market_price=h.get_market_price(
-                                        self.client, self.market),
+                                    _market_price=self.exit_price(),
                                     _type="Trailing Stop")
-                        self.market = None
-                        self.self = 0
+                        self.release_market()
 
-                time.sleep(60)
+                metrics.cycle_seconds.observe(time.monotonic() - cycle_start,
+                                              loop="main")
+                self.wait_for_candle(60)
 
             except (RequestException, BinanceAPIException) as e:
                 logger.error(e, exc_info=True)
@@ -109,34 +149,147 @@ class Megalodon():
 
         self.stop()
 
+    # see helper.preflight, a failed request is left to the first cycle
+    def preflight(self):
+        try:
+            logger.info("Preflight done in %.2f s.", h.preflight(self.client))
+        except (RequestException, BinanceAPIException) as e:
+            logger.warning("Preflight failed: %s", e)
+
     def look_for_market(self):
         if self.market == None:
             self.market = h.get_valid_market(self.client, self.adx_threshold,
-                                             self.volume_threshold)
+                                             self.volume_threshold,
+                                             self.scan_workers)
             self.last_trend_check = datetime.now()
-            if self.market != None:
+            if self.market == None:
+                # the whole exchange was scanned, give the trends time to change
+                logger.info('No trend market detected.')
+                metrics.sleep(60)
+            else:
                 logger.info('Trend market detected: %s', self.market)
+                self.signal_states.clear()
+                self.start_feed()
                 # Initialise the market leverage and margin type.
                 h.initialise_futures(self.client,
                                      _market=self.market,
                                      _leverage=self.leverage,
                                      _margin_type=self.margin_type)
 
+    def release_market(self):
+        self.stop_feed()
+        self.market = None
+        self.side = 0
+        self.order_plan = None
+
+    # fetch what the next position needs before its signal, the plan is kept for orders.PLAN_SECONDS
+    def prepare_order(self):
+        if (self.order_plan == None or self.order_plan.market != self.market
+                or self.order_plan.stale()):
+            self.order_plan = h.prepare_order(self.client, self.market,
+                                              self.leverage,
+                                              self.trailing_percentage)
+
+    def start_feed(self):
+        self.stop_feed()
+        self.wake.clear()
+        self.feed = KlineFeed(
+            self.market,
+            self.confirmation_periods,
+            fetch_klines=self.fetch_klines,
+            on_close=lambda close_time: self.wake.set(),
+            url=self.stream_url)
+        self.feed.start_thread()
+
+    def stop_feed(self):
+        if self.feed != None:
+            self.feed.stop()
+            self.feed = None
+
+    # backfill for the feed, it runs on its own event loop so the blocking client call goes to a thread.
+    # The history comes from the kline archive when there is one.
+    async def fetch_klines(self, **params):
+        if h.kline_archive != None and "startTime" not in params:
+            return await asyncio.to_thread(h.get_klines,
+                                           self.client,
+                                           params["symbol"],
+                                           params["interval"],
+                                           _limit=params["limit"])
+        return await self.threaded(self.client.futures_klines)(**params)
+
+    # coroutine function calling a client method on a thread, for the feeds running on their own event loop
+    def threaded(self, method):
+        async def call(**params):
+            return await asyncio.to_thread(method, **params)
+
+        return call
+
+    def start_account_feed(self):
+        self.account = AccountFeed(
+            self.threaded(self.client.futures_stream_get_listen_key),
+            self.threaded(self.client.futures_stream_keepalive),
+            fetch_positions=self.threaded(
+                self.client.futures_position_information),
+            fetch_orders=self.threaded(self.client.futures_get_open_orders),
+            on_fill=self.on_fill,
+            on_position=self.on_position,
+            url=self.stream_url)
+        self.account.start_thread()
+
+    def on_fill(self, fill):
+        logger.info('%s: %s %s %s filled at %s', fill.symbol, fill.type,
+                    fill.side, fill.qty, fill.price)
+
+    def on_position(self, symbol, amount, entry):
+        if symbol == self.market and amount == 0.0:
+            self.wake.set()
+
+    # the position is still open, the account stream knows without a request while it is connected
+    def position_active(self):
+        if self.account != None and self.account.ready:
+            return not self.account.position_closed(self.market,
+                                                    self.opened_at)
+        return h.check_in_position(self.client, self.market)
+
+    # the price the position was closed at: its fill from the account stream, or else the mark price
+    def exit_price(self):
+        if self.account != None:
+            fill = self.account.last_fill(self.market,
+                                          "SELL" if self.side == 1 else "BUY",
+                                          self.opened_at)
+            if fill != None:
+                return fill.price
+        return h.get_market_price(self.client, self.market)
+
+    # sleep until a candle of the market or the position closes, at most `timeout` seconds
+    def wait_for_candle(self, timeout):
+        self.wake.wait(timeout)
+        self.wake.clear()
+
     def check_signal(self):
         if self.market != None:
-            # generate signal data for the last 500 candles
-            entry = h.get_multi_scale_signal(
-                self.client,
-                _market=self.market,
-                _periods=self.confirmation_periods)
+            if self.feed != None and self.feed.ready:
+                # the stream already holds the closed candles
+                entry = h.get_feed_signal(self.market, self.signal_states,
+                                          self.feed)
+            else:
+                # advance the signal of every period with the candles closed since the last check
+                entry = h.get_streaming_signal(
+                    self.client,
+                    _market=self.market,
+                    states=self.signal_states,
+                    _periods=self.confirmation_periods,
+                    _max_workers=self.signal_workers)
 
             # Signal changed
             if entry[-2] != self.side:
                 # No position oppened yet
                 if self.side == 0:
+                    self.opened_at = time.monotonic()
                     self.qty, self.side, msg = h.handle_siganl(
                         self.client, entry, self.market, self.leverage,
-                        self.trailing_percentage)
+                        self.trailing_percentage, self.order_plan)
+                    self.order_plan = None
                     logger.info('%s: Position opend: %s', self.market, msg)
 
                 # We are an opposit position
@@ -145,7 +298,6 @@ class Megalodon():
                                                _market=self.market)
                     h.cancel_open_orders_by_market(self.client,
                                                    _market=self.market)
-                    time.sleep(3)
                     logger.info(
                         '%s : Signal changed from %s to %s, current postion closed.',
                         self.market, str(self.side), str(entry[-2]))
@@ -160,14 +312,18 @@ class Megalodon():
                     self.side = 0
 
     def stop(self):
+        self.stop_feed()
+        if self.account != None:
+            self.account.stop()
         if (self.side != 0):
             # close any open positions
             h.close_position_by_market(self.client, _market=self.market)
             # close any open trailing stops
             h.cancel_open_orders_by_market(self.client, _market=self.market)
-            time.sleep(3)
             logger.warning(
                 'All open positions closed and all open orders canceled.')
+        # write the trades still queued, os._exit skips the exit handlers
+        h.trade_journal.close()
         logger.warning('Bot stopped.')
         os._exit(0)
 
@@ -176,5 +332,16 @@ class Megalodon():
         self.stop()
 
 
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Trade the trending futures markets.")
+    parser.add_argument(
+        "--preflight",
+        action="store_true",
+        help="warm the connections and caches up before the first cycle")
+    args = parser.parse_args(argv)
+    Megalodon().start(preflight=args.preflight)
+
+
 if __name__ == '__main__':
-    Megalodon().start()
+    main()
@@ -0,0 +1,456 @@
+"""
+Timing and API weight metrics of the bot.
+
+The clients of helper.init_client and async_helper.init_client are wrapped
+in an InstrumentedClient: every request is timed per endpoint (the client
+method) and symbol, and the used weight and order count headers of the
+answers are kept. The helpers that talk to the exchange are wrapped with
+`timed`, the sleeps of the bot go through `sleep` and the bots time every
+loop cycle.
+
+MetricsServer serves the metrics in the Prometheus text format on
+http://host:port/metrics and MetricsReporter logs a summary every few
+minutes. Both are set up from the "metrics" section of settings.json.
+"""
+import asyncio
+import functools
+import inspect
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger('bot')
+
+# seconds, the last bucket is +Inf
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace(
+        '"', '\\"'))
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if len(pairs) == 0:
+        return ""
+    return "{" + ",".join('%s="%s"' % (name, _escape(value))
+                          for name, value in pairs) + "}"
+
+
+def _number(value):
+    return repr(float(value))
+
+
+class Metric():
+    """
+    One metric and its values per label values.
+    """
+    type = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labels):
+            raise ValueError("%s takes the labels %s" %
+                             (self.name, ", ".join(self.labels)))
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def clear(self):
+        with self.lock:
+            self.values.clear()
+
+    def samples(self):
+        with self.lock:
+            return [(key, value) for key, value in self.values.items()]
+
+    def render(self):
+        lines = [
+            "# HELP %s %s" % (self.name, self.help),
+            "# TYPE %s %s" % (self.name, self.type)
+        ]
+        for key, value in sorted(self.samples()):
+            lines.append(self.name + _labels(self.labels, key) + " " +
+                         _number(value))
+        return lines
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self.values.get(self._key(labels), 0)
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def get(self, **labels):
+        return self.values.get(self._key(labels))
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    # the values are [count per bucket..., count, sum]
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                counts = self.values[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            counts[-2] += 1
+            counts[-1] += value
+
+    # (count, sum) of some label values
+    def get(self, **labels):
+        counts = self.values.get(self._key(labels))
+        if counts is None:
+            return 0, 0.0
+        return counts[-2], counts[-1]
+
+    def samples(self):
+        with self.lock:
+            return [(key, list(counts))
+                    for key, counts in self.values.items()]
+
+    def render(self):
+        lines = [
+            "# HELP %s %s" % (self.name, self.help),
+            "# TYPE %s %s" % (self.name, self.type)
+        ]
+        for key, counts in sorted(self.samples()):
+            total = 0
+            for bound, count in zip(self.buckets, counts):
+                total += count
+                lines.append(self.name + "_bucket" + _labels(
+                    self.labels, key, [("le", _number(bound))]) + " " +
+                             str(total))
+            lines.append(self.name + "_bucket" +
+                         _labels(self.labels, key, [("le", "+Inf")]) + " " +
+                         str(counts[-2]))
+            lines.append(self.name + "_sum" + _labels(self.labels, key) +
+                         " " + _number(counts[-1]))
+            lines.append(self.name + "_count" + _labels(self.labels, key) +
+                         " " + str(counts[-2]))
+        return lines
+
+
+class Registry():
+    def __init__(self):
+        self.metrics = []
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def clear(self):
+        for metric in self.metrics:
+            metric.clear()
+
+    # every metric in the Prometheus text format
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+request_seconds = REGISTRY.add(
+    Histogram("binance_request_seconds",
+              "Duration of the client requests.", ["endpoint", "symbol"]))
+request_errors = REGISTRY.add(
+    Counter("binance_request_errors_total", "Client requests that failed.",
+            ["endpoint", "symbol", "code"]))
+used_weight = REGISTRY.add(
+    Gauge("binance_used_weight",
+          "Request weight used in the interval, from the last answer.",
+          ["interval"]))
+order_count = REGISTRY.add(
+    Gauge("binance_order_count",
+          "Orders placed in the interval, from the last order answer.",
+          ["interval"]))
+helper_seconds = REGISTRY.add(
+    Histogram("bot_helper_seconds",
+              "Duration of the helpers that talk to the exchange.",
+              ["helper", "symbol"]))
+sleep_seconds = REGISTRY.add(
+    Counter("bot_sleep_seconds_total", "Seconds the bot slept on purpose."))
+cycle_seconds = REGISTRY.add(
+    Histogram("bot_cycle_seconds",
+              "Duration of a loop cycle, waiting for the next one excluded.",
+              ["loop"]))
+
+HEADERS = (("x-mbx-used-weight-", used_weight), ("x-mbx-order-count-",
+                                                  order_count))
+
+
+# keep the used weight and order count headers of an answer
+def record_headers(headers):
+    for name, value in headers.items():
+        name = name.lower()
+        for prefix, gauge in HEADERS:
+            if name.startswith(prefix):
+                try:
+                    gauge.set(float(value), interval=name[len(prefix):])
+                except ValueError:
+                    pass
+
+
+def _error_code(e):
+    return getattr(e, "code", None) or type(e).__name__
+
+
+class InstrumentedClient():
+    """
+    Wraps a Client or AsyncClient, every request is timed and its weight headers are kept.
+
+    The headers are read from `client.response` after the call, with several threads on one
+    client they may come from a concurrent request; they describe the account either way.
+    """
+    def __init__(self, client):
+        self.client = client
+
+    def __getattr__(self, name):
+        attr = getattr(self.client, name)
+        if not callable(attr) or name.startswith("_") or name in (
+                "close_connection", "response"):
+            return attr
+
+        if asyncio.iscoroutinefunction(attr):
+
+            async def call(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await attr(*args, **kwargs)
+                except Exception as e:
+                    self._failed(name, kwargs, e)
+                    raise
+                finally:
+                    self._done(name, kwargs, start)
+
+            return call
+
+        def call(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return attr(*args, **kwargs)
+            except Exception as e:
+                self._failed(name, kwargs, e)
+                raise
+            finally:
+                self._done(name, kwargs, start)
+
+        return call
+
+    def _done(self, name, kwargs, start):
+        request_seconds.observe(time.perf_counter() - start,
+                                endpoint=name,
+                                symbol=kwargs.get("symbol", ""))
+        response = getattr(self.client, "response", None)
+        if response is not None:
+            record_headers(response.headers)
+
+    def _failed(self, name, kwargs, e):
+        request_errors.inc(endpoint=name,
+                           symbol=kwargs.get("symbol", ""),
+                           code=_error_code(e))
+
+
+def timed(func):
+    """
+    Time a helper in bot_helper_seconds, labelled with its market argument.
+    """
+    parameters = list(inspect.signature(func).parameters)
+    market = None
+    for name in ("_market", "market"):
+        if name in parameters:
+            market = name
+            break
+
+    def labels(args, kwargs):
+        symbol = kwargs.get(market, "")
+        if market is not None and market not in kwargs:
+            index = parameters.index(market)
+            if index < len(args):
+                symbol = args[index]
+        return {"helper": func.__name__, "symbol": symbol or ""}
+
+    if asyncio.iscoroutinefunction(func):
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                helper_seconds.observe(time.perf_counter() - start,
+                                       **labels(args, kwargs))
+
+        return wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            helper_seconds.observe(time.perf_counter() - start,
+                                   **labels(args, kwargs))
+
+    return wrapper
+
+
+# time.sleep, counted in bot_sleep_seconds_total
+def sleep(seconds):
+    sleep_seconds.inc(seconds)
+    time.sleep(seconds)
+
+
+async def async_sleep(seconds):
+    sleep_seconds.inc(seconds)
+    await asyncio.sleep(seconds)
+
+
+# a few lines on where the time went, slowest endpoints and helpers first
+def summary(top=5):
+    lines = []
+    for title, histogram, label in (("requests", request_seconds,
+                                     "endpoint"), ("helpers", helper_seconds,
+                                                   "helper")):
+        totals = {}
+        index = histogram.labels.index(label)
+        for key, counts in histogram.samples():
+            count, total = totals.get(key[index], (0, 0.0))
+            totals[key[index]] = (count + counts[-2], total + counts[-1])
+        items = sorted(totals.items(), key=lambda i: i[1][1], reverse=True)
+        if len(items) > 0:
+            lines.append(title + ": " + ", ".join(
+                "%s %d x %.1f ms" % (name, count, total / count * 1000)
+                for name, (count, total) in items[:top]))
+
+    cycles = [(key[0], counts[-2], counts[-1])
+              for key, counts in cycle_seconds.samples()]
+    if len(cycles) > 0:
+        lines.append("cycles: " + ", ".join(
+            "%s %d x %.1f ms" % (loop, count, total / count * 1000)
+            for loop, count, total in sorted(cycles)))
+
+    usage = ["weight %s %d" % (key[0], value)
+             for key, value in sorted(used_weight.samples())]
+    usage += ["orders %s %d" % (key[0], value)
+              for key, value in sorted(order_count.samples())]
+    errors = sum(value for key, value in request_errors.samples())
+    lines.append("used: " + ", ".join(usage + [
+        "errors %d" % errors,
+        "slept %.0f s" % sleep_seconds.get()
+    ]))
+    return lines
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        data = self.server.registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MetricsServer():
+    """
+    Serves the registry on http://host:port/metrics, port 0 picks a free one.
+    """
+    def __init__(self, host="127.0.0.1", port=9108, registry=REGISTRY):
+        self.httpd = ThreadingHTTPServer((host, port), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.registry = registry
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return "http://%s:%d/metrics" % (host, port)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever,
+                                       daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+
+class MetricsReporter():
+    """
+    Logs the summary every `interval` seconds on a background thread.
+    """
+    def __init__(self, interval=900):
+        self.interval = interval
+        self._stop = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            for line in summary():
+                logger.info("Metrics %s", line)
+
+    def stop(self):
+        self._stop.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+
+# start the endpoint and the summary log of the "metrics" settings, a null port or interval disables them
+def start(settings):
+    server = reporter = None
+    if getattr(settings, "port", None) is not None:
+        server = MetricsServer(settings.host, int(settings.port)).start()
+        logger.info("Metrics served on %s", server.url)
+    if getattr(settings, "summary_minutes", None):
+        reporter = MetricsReporter(float(settings.summary_minutes) * 60).start()
+    return server, reporter
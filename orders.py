@@ -0,0 +1,128 @@
+"""
+Order pipeline of a position: the entry and its trailing stop.
+
+An OrderPlan is made while the bot waits for a signal: the margin, the mark
+price and the precision of the market are fetched then and the quantity is
+rounded, so a signal only has to send the orders. helper.place_position and
+async_helper.place_position send the MARKET entry and its
+TRAILING_STOP_MARKET in one batch order request, the position is protected
+by the round trip that opens it. When the exchange rejects the stop of the
+batch, or the client has no batch order endpoint, the stop is sent on its
+own as soon as the entry answer confirms the fill. Nothing waits a fixed
+time.
+
+The OrderResult of a position holds the fill price and the seconds every
+stage took, they are kept in the binance_order_seconds metric too.
+"""
+import json
+import time
+from collections import namedtuple
+
+from binance.exceptions import BinanceAPIException
+
+import metrics
+
+# seconds an OrderPlan is used for, its price and balance are older after that
+PLAN_SECONDS = 60
+
+# the stop side of an entry side
+STOP_SIDES = {"BUY": "SELL", "SELL": "BUY"}
+
+order_seconds = metrics.REGISTRY.add(
+    metrics.Histogram(
+        "binance_order_seconds",
+        "Time from sending an entry until its stage was confirmed.",
+        ["stage"]))
+
+# fill: average fill price of the entry, timings: seconds from sending the entry until the entry
+# ("entry") and the stop ("stop") were confirmed
+OrderResult = namedtuple('OrderResult', [
+    'market', 'side', 'qty', 'price', 'entry', 'stop', 'batched', 'timings'
+])
+
+
+class OrderPlan():
+    """
+    The entry of a position in `market`, sized before the signal fires.
+    """
+    def __init__(self,
+                 market,
+                 margin,
+                 price,
+                 precision,
+                 leverage=1,
+                 callback_rate=2.0,
+                 clock=time.monotonic):
+        self.market = market
+        self.margin = float(margin)
+        self.price = float(price)
+        self.precision = int(precision)
+        self.leverage = leverage
+        self.callback_rate = callback_rate
+        self.clock = clock
+        self.created = clock()
+        # the same size as helper.calculate_position, 1% is left for the price to move
+        self.qty = float(
+            round(self.margin / self.price * leverage * 0.99, self.precision))
+
+    def __repr__(self):
+        return "OrderPlan(%s, %s @ %s)" % (self.market, self.qty, self.price)
+
+    def stale(self, max_age=PLAN_SECONDS):
+        return self.clock() - self.created >= max_age
+
+    # the MARKET entry, its answer carries the fill
+    def entry_order(self, side):
+        return {
+            "symbol": self.market,
+            "side": side,
+            "type": "MARKET",
+            "quantity": str(self.qty),
+            "newOrderRespType": "RESULT",
+        }
+
+    # the trailing stop of an entry on `side`
+    def stop_order(self, side):
+        return {
+            "symbol": self.market,
+            "side": STOP_SIDES[side],
+            "type": "TRAILING_STOP_MARKET",
+            "quantity": str(self.qty),
+            "callbackRate": str(self.callback_rate),
+            "workingType": "CONTRACT_PRICE",
+            # it only ever closes the entry, never opens a reverse position
+            "reduceOnly": "true",
+        }
+
+
+# an answer of the batch order endpoint is an error instead of an order
+def is_error(answer):
+    return "code" in answer and "orderId" not in answer
+
+
+# the error of a rejected order of a batch, raised like the client raises one of a single order
+def rejected(answer):
+    return BinanceAPIException(None, 400, json.dumps(answer))
+
+
+# average fill price of an entry answer, the price of the plan when the answer has none
+def fill_price(answer, plan):
+    try:
+        price = float(answer.get("avgPrice") or 0)
+    except (TypeError, ValueError):
+        price = 0.0
+    return price if price > 0 else plan.price
+
+
+def result(plan, side, entry, stop, batched, start, entry_at, stop_at):
+    timings = {"entry": entry_at - start, "stop": stop_at - start}
+    for stage, seconds in timings.items():
+        order_seconds.observe(seconds, stage=stage)
+    return OrderResult(market=plan.market,
+                       side=side,
+                       qty=plan.qty,
+                       price=fill_price(entry, plan),
+                       entry=entry,
+                       stop=stop,
+                       batched=batched,
+                       timings=timings)
@@ -0,0 +1,34 @@
+"""
+Portfolio mode: trade several markets at once from one process.
+
+The bot keeps `portfolio.slots` market slots. Each slot is an
+async_megalodon.MarketSlot for its own market: its own kline stream, signal
+states, side and quantity. The slots share one client session, the kline
+cache, exchange metadata and request scheduler of helper.py, and the
+scanner hands every free slot the strongest trending market no other slot
+holds. A position gets `portfolio.margin_fraction` of the USDT balance as
+margin instead of the whole balance.
+"""
+import async_helper as ah
+import config as cfg
+from async_megalodon import AsyncMegalodon, main
+
+
+class Portfolio(AsyncMegalodon):
+    """
+    AsyncMegalodon over `portfolio.slots` markets.
+    """
+    def __init__(self):
+        super().__init__()
+        settings = cfg.getBotSettings()
+        self.slot_count = int(settings.portfolio.slots)
+        self.margin_fraction = float(settings.portfolio.margin_fraction)
+
+    # the margin of a new position: a fraction of the USDT balance
+    async def slot_margin(self):
+        balance = await ah.get_futures_balance(self.client, _asset="USDT")
+        return float(balance) * self.margin_fraction
+
+
+if __name__ == '__main__':
+    main(Portfolio)
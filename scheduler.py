@@ -0,0 +1,379 @@
+"""
+Rate limit aware scheduling of the client requests.
+
+Every request of a client made by helper.init_client or
+async_helper.init_client waits for the RequestScheduler of helper.py first.
+The scheduler models the request weight and order limits of the account as
+token buckets, corrected by the used weight and order counts Binance reports
+with every answer, and lets the waiting requests through by priority:
+
+- ORDER: orders and cancels,
+- POSITION: positions, balances, mark prices, leverage and margin type,
+- SIGNAL: klines and anything else,
+- SCAN: tickers, exchange information and everything requested inside
+  `with priority(SCAN)`, like the klines of the market scan.
+
+A higher priority request is let through before every lower priority one
+waiting. SIGNAL requests leave half of `reserve` of the weight limit unused
+and SCAN requests all of it, so a scan slows down before the orders run out
+of weight. After a 429 or 418 answer no request is sent until its
+Retry-After has passed.
+"""
+import asyncio
+import contextlib
+import contextvars
+import functools
+import heapq
+import itertools
+import threading
+import time
+
+from binance.exceptions import BinanceAPIException
+
+import metrics
+
+ORDER, POSITION, SIGNAL, SCAN = range(4)
+
+PRIORITY_NAMES = ["order", "position", "signal", "scan"]
+
+# client methods by priority, the others are SIGNAL
+PRIORITIES = {
+    "futures_create_order": ORDER,
+    "futures_place_batch_order": ORDER,
+    "futures_cancel_order": ORDER,
+    "futures_cancel_orders": ORDER,
+    "futures_cancel_all_open_orders": ORDER,
+    "futures_position_information": POSITION,
+    "futures_account": POSITION,
+    "futures_account_balance": POSITION,
+    "futures_mark_price": POSITION,
+    "futures_get_open_orders": POSITION,
+    "futures_change_leverage": POSITION,
+    "futures_change_margin_type": POSITION,
+    "futures_stream_get_listen_key": POSITION,
+    "futures_stream_keepalive": POSITION,
+    "futures_ticker": SCAN,
+    "futures_exchange_info": SCAN,
+    "futures_ping": SCAN,
+}
+
+# request weights of the client methods, the others weigh 1
+WEIGHTS = {
+    "futures_account": 5,
+    "futures_account_balance": 5,
+    "futures_position_information": 5,
+    "futures_place_batch_order": 5,
+}
+
+# seconds to wait after a 429 or 418 answer without a Retry-After header
+BACK_OFF_SECONDS = 60
+
+wait_seconds = metrics.REGISTRY.add(
+    metrics.Histogram("binance_scheduler_wait_seconds",
+                      "Time requests waited for the rate limits.",
+                      ["priority"]))
+weight_tokens = metrics.REGISTRY.add(
+    metrics.Gauge("binance_scheduler_weight_tokens",
+                  "Request weight the scheduler may still spend.", []))
+
+_priority = contextvars.ContextVar("priority", default=None)
+
+
+# requests made inside the block have at most this priority, orders and position requests keep theirs
+@contextlib.contextmanager
+def priority(value):
+    token = _priority.set(value)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+# decorator, the requests of the function are made with at most this priority
+def with_priority(value):
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                with priority(value):
+                    return await func(*args, **kwargs)
+
+            return wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with priority(value):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def _klines_weight(limit):
+    limit = int(limit)
+    if limit < 100:
+        return 1
+    if limit < 500:
+        return 2
+    if limit <= 1000:
+        return 5
+    return 10
+
+
+# (weight, orders, priority) of a client request
+def request_cost(name, params):
+    weight = WEIGHTS.get(name, 1)
+    orders = 0
+    if name in ("futures_klines", "futures_continous_klines"):
+        weight = _klines_weight(params.get("limit", 500))
+    elif name in ("futures_ticker", "futures_get_open_orders"):
+        if params.get("symbol") is None:
+            weight = 40
+    elif name == "futures_create_order":
+        orders = 1
+    elif name == "futures_place_batch_order":
+        orders = len(params.get("batchOrders", []))
+
+    value = PRIORITIES.get(name, SIGNAL)
+    context = _priority.get()
+    if context is not None and value >= SIGNAL:
+        value = max(value, context)
+    return weight, orders, value
+
+
+class TokenBucket():
+    """
+    `capacity` tokens refilled evenly over `period` seconds.
+    """
+    def __init__(self, capacity, period, clock=time.monotonic):
+        self.capacity = float(capacity)
+        self.period = float(period)
+        self.clock = clock
+        self.tokens = self.capacity
+        self.updated = clock()
+
+    def refill(self):
+        now = self.clock()
+        self.tokens = min(
+            self.capacity, self.tokens +
+            (now - self.updated) * self.capacity / self.period)
+        self.updated = now
+
+    # seconds until `amount` tokens can be spent with `floor` tokens left
+    def wait(self, amount, floor=0.0):
+        self.refill()
+        missing = amount + floor - self.tokens
+        if missing <= 0:
+            return 0.0
+        return missing * self.period / self.capacity
+
+    def spend(self, amount):
+        self.tokens -= amount
+
+    # the exchange counted `used` tokens of the current period
+    def observe(self, used):
+        self.refill()
+        self.tokens = min(self.tokens, self.capacity - used)
+
+
+class RequestScheduler():
+    """
+    Token buckets of the request weight and order limits and the queue of the requests waiting for them.
+    """
+
+    # seconds between the checks of a request waiting behind another one
+    POLL_SECONDS = 0.02
+
+    def __init__(self,
+                 weight_per_minute=2400,
+                 orders_per_minute=1200,
+                 orders_per_10s=300,
+                 reserve=0.2,
+                 clock=time.monotonic):
+        self.clock = clock
+        self.set_limits(weight_per_minute, orders_per_minute, orders_per_10s,
+                        reserve)
+        self.banned_until = None
+        self._waiting = []
+        self._tickets = itertools.count()
+        self._condition = threading.Condition()
+
+    def set_limits(self,
+                   weight_per_minute=2400,
+                   orders_per_minute=1200,
+                   orders_per_10s=300,
+                   reserve=0.2):
+        self.weight = TokenBucket(weight_per_minute, 60, self.clock)
+        self.orders = {
+            "1m": TokenBucket(orders_per_minute, 60, self.clock),
+            "10s": TokenBucket(orders_per_10s, 10, self.clock),
+        }
+        self.reserve = float(reserve)
+
+    # weight a request of `priority` must leave unused
+    def floor(self, priority):
+        if priority == SCAN:
+            return self.reserve * self.weight.capacity
+        if priority == SIGNAL:
+            return self.reserve * self.weight.capacity / 2
+        return 0.0
+
+    def enter(self, priority):
+        with self._condition:
+            ticket = (priority, next(self._tickets))
+            heapq.heappush(self._waiting, ticket)
+            return ticket
+
+    def leave(self, ticket):
+        with self._condition:
+            if ticket in self._waiting:
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+            self._condition.notify_all()
+
+    def try_acquire(self, ticket, weight=1, orders=0):
+        """
+        Spend the tokens of a waiting request if it is next and they are there.
+
+        Returns 0 once they were spent, otherwise the seconds to wait before trying again.
+        """
+        with self._condition:
+            now = self.clock()
+            if self.banned_until is not None and now < self.banned_until:
+                return self.banned_until - now
+            if self._waiting[0] != ticket:
+                return self.POLL_SECONDS
+            # the reserve never keeps a request from running at all
+            floor = min(self.floor(ticket[0]),
+                        max(self.weight.capacity - weight, 0))
+            wait = self.weight.wait(weight, floor)
+            if orders > 0:
+                for bucket in self.orders.values():
+                    wait = max(wait, bucket.wait(orders))
+            if wait > 0:
+                return wait
+            self.weight.spend(weight)
+            if orders > 0:
+                for bucket in self.orders.values():
+                    bucket.spend(orders)
+            heapq.heappop(self._waiting)
+            weight_tokens.set(self.weight.tokens)
+            self._condition.notify_all()
+            return 0
+
+    # wait for the tokens of a request on this thread
+    def acquire(self, weight=1, orders=0, priority=SIGNAL):
+        start = time.monotonic()
+        ticket = self.enter(priority)
+        try:
+            while True:
+                wait = self.try_acquire(ticket, weight, orders)
+                if wait <= 0:
+                    break
+                with self._condition:
+                    self._condition.wait(wait)
+        finally:
+            self.leave(ticket)
+        wait_seconds.observe(time.monotonic() - start,
+                             priority=PRIORITY_NAMES[priority])
+
+    async def acquire_async(self, weight=1, orders=0, priority=SIGNAL):
+        start = time.monotonic()
+        ticket = self.enter(priority)
+        try:
+            while True:
+                wait = self.try_acquire(ticket, weight, orders)
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+        finally:
+            self.leave(ticket)
+        wait_seconds.observe(time.monotonic() - start,
+                             priority=PRIORITY_NAMES[priority])
+
+    # correct the buckets with the usage the exchange reported in the headers of an answer
+    def observe(self, headers):
+        with self._condition:
+            for name, value in headers.items():
+                name = name.lower()
+                try:
+                    if name == "x-mbx-used-weight-1m":
+                        self.weight.observe(float(value))
+                    elif name.startswith("x-mbx-order-count-"):
+                        bucket = self.orders.get(name[len("x-mbx-order-count-"):])
+                        if bucket is not None:
+                            bucket.observe(float(value))
+                except ValueError:
+                    pass
+            weight_tokens.set(self.weight.tokens)
+
+    # stop every request for `seconds`
+    def back_off(self, seconds):
+        with self._condition:
+            until = self.clock() + seconds
+            if self.banned_until is None or until > self.banned_until:
+                self.banned_until = until
+
+    # a 429 (too many requests) or 418 (banned) answer stops the requests for its Retry-After
+    def on_error(self, e):
+        if getattr(e, "status_code", None) not in (418, 429):
+            return False
+        retry_after = None
+        response = getattr(e, "response", None)
+        if response is not None:
+            retry_after = response.headers.get("Retry-After")
+        try:
+            seconds = float(retry_after)
+        except (TypeError, ValueError):
+            seconds = BACK_OFF_SECONDS
+        self.back_off(seconds)
+        return True
+
+
+class ScheduledClient():
+    """
+    Wraps a Client or AsyncClient, every request waits for the RequestScheduler first.
+    """
+    def __init__(self, client, scheduler):
+        self.client = client
+        self.scheduler = scheduler
+
+    def __getattr__(self, name):
+        attr = getattr(self.client, name)
+        if not callable(attr) or name.startswith("_") or name in (
+                "close_connection", "response"):
+            return attr
+
+        if asyncio.iscoroutinefunction(attr):
+
+            async def call(*args, **kwargs):
+                await self.scheduler.acquire_async(
+                    *request_cost(name, kwargs))
+                try:
+                    return await attr(*args, **kwargs)
+                except BinanceAPIException as e:
+                    self.scheduler.on_error(e)
+                    raise
+                finally:
+                    self._observe()
+
+            return call
+
+        def call(*args, **kwargs):
+            self.scheduler.acquire(*request_cost(name, kwargs))
+            try:
+                return attr(*args, **kwargs)
+            except BinanceAPIException as e:
+                self.scheduler.on_error(e)
+                raise
+            finally:
+                self._observe()
+
+        return call
+
+    def _observe(self):
+        response = getattr(self.client, "response", None)
+        if response is not None:
+            self.scheduler.observe(response.headers)
@@ -0,0 +1,458 @@
+"""
+WebSocket kline and account feeds.
+
+KlineFeed subscribes to the futures kline streams of one market, keeps a
+rolling buffer of candles per interval in the same list format the REST
+client returns, and calls `on_close(close_time)` as soon as the candles of
+every interval closing at that time have arrived. After a disconnect it
+reconnects and backfills the missed candles over REST.
+
+AccountFeed listens to the user data stream of the account and keeps its
+positions, open orders and fills in memory, so the bot learns about a fill
+or a closed position the moment the exchange reports it instead of polling.
+Its listen key is kept alive, after a disconnect it reconnects and syncs
+the positions and open orders over REST.
+"""
+import asyncio
+import inspect
+import json
+import logging
+import threading
+import time
+from collections import deque, namedtuple
+
+import websockets
+from binance.helpers import interval_to_milliseconds
+
+logger = logging.getLogger('stream')
+
+STREAM_URL = "wss://fstream.binance.com"
+
+
+# convert the kline of a stream event into the list format of the REST klines
+def kline_to_candle(k):
+    return [
+        int(k['t']), k['o'], k['h'], k['l'], k['c'], k['v'],
+        int(k['T']), k['q'],
+        int(k['n']), k['V'], k['Q'], k['B']
+    ]
+
+
+class KlineFeed():
+    def __init__(self,
+                 market,
+                 intervals,
+                 fetch_klines,
+                 on_close,
+                 url=STREAM_URL,
+                 maxlen=500,
+                 close_grace=2.0,
+                 max_backoff=30.0,
+                 clock=time.time):
+        """
+        fetch_klines:coroutine function: called like AsyncClient.futures_klines(symbol=, interval=, limit=, startTime=) to backfill.
+        on_close:callable: called with the close time (ms) once candles closed, may return an awaitable.
+        close_grace:float: seconds to wait for the other intervals closing at the same time before on_close is called anyway.
+        """
+        self.market = market
+        self.intervals = list(intervals)
+        self.fetch_klines = fetch_klines
+        self.on_close = on_close
+        self.url = url
+        self.maxlen = maxlen
+        self.close_grace = close_grace
+        self.max_backoff = max_backoff
+        self.clock = clock
+
+        self.ready = False
+        self.reconnects = 0
+        self._buffers = dict((i, deque(maxlen=maxlen)) for i in self.intervals)
+        # open time of the last closed candle per interval
+        self._closed = dict((i, None) for i in self.intervals)
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._loop = None
+        self._task = None
+        self._thread = None
+
+    def stream_url(self):
+        streams = "/".join(self.market.lower() + "@kline_" + i
+                           for i in self.intervals)
+        return self.url.rstrip("/") + "/stream?streams=" + streams
+
+    # closed candles of an interval, oldest first
+    def closed_candles(self, interval):
+        with self._lock:
+            last = self._closed[interval]
+            if last is None:
+                return []
+            return [c for c in self._buffers[interval] if c[0] <= last]
+
+    # the candle still open of an interval, or None
+    def open_candle(self, interval):
+        with self._lock:
+            buffer = self._buffers[interval]
+            last = self._closed[interval]
+            if len(buffer) > 0 and (last is None or buffer[-1][0] > last):
+                return buffer[-1]
+            return None
+
+    def _merge(self, interval, candle, closed):
+        buffer = self._buffers[interval]
+        if len(buffer) > 0 and buffer[-1][0] == candle[0]:
+            buffer[-1] = candle
+        elif len(buffer) == 0 or buffer[-1][0] < candle[0]:
+            buffer.append(candle)
+        else:
+            return
+        if closed and (self._closed[interval] is None
+                       or candle[0] > self._closed[interval]):
+            self._closed[interval] = candle[0]
+
+    # intervals that have a candle closing at close_time
+    def _closing_at(self, close_time):
+        return set(i for i in self.intervals
+                   if (close_time + 1) % interval_to_milliseconds(i) == 0)
+
+    async def _notify(self, close_time):
+        try:
+            result = self.on_close(close_time)
+            if inspect.isawaitable(result):
+                await result
+        except Exception:
+            logger.exception('%s: on_close failed', self.market)
+
+    async def _flush_later(self, close_time):
+        await asyncio.sleep(self.close_grace)
+        if self._pending.pop(close_time, None) is not None:
+            await self._notify(close_time)
+
+    async def _handle(self, message):
+        data = json.loads(message)
+        data = data.get('data', data)
+        if data.get('e') != 'kline':
+            return
+        k = data['k']
+        interval = k['i']
+        if interval not in self._buffers:
+            return
+        with self._lock:
+            self._merge(interval, kline_to_candle(k), k['x'])
+        if not k['x']:
+            return
+
+        close_time = int(k['T'])
+        if close_time not in self._pending:
+            self._pending[close_time] = set()
+            asyncio.ensure_future(self._flush_later(close_time))
+        self._pending[close_time].add(interval)
+        if self._pending[close_time] >= self._closing_at(close_time):
+            del self._pending[close_time]
+            await self._notify(close_time)
+
+    # fetch the candles missed while disconnected, on_close is called if any closed in the meantime
+    async def backfill(self, now_ms=None):
+        if now_ms is None:
+            now_ms = int(self.clock() * 1000)
+        last_close = None
+        for interval in self.intervals:
+            interval_ms = interval_to_milliseconds(interval)
+            with self._lock:
+                buffer = self._buffers[interval]
+                start = buffer[-1][0] if len(buffer) > 0 else None
+                before = self._closed[interval]
+                # too many candles missed to fill the hole, start over from the latest history
+                if start is not None and now_ms - start >= (self.maxlen -
+                                                            1) * interval_ms:
+                    buffer.clear()
+                    self._closed[interval] = None
+                    start = None
+            if start is None:
+                candles = await self.fetch_klines(symbol=self.market,
+                                                  interval=interval,
+                                                  limit=self.maxlen)
+            else:
+                candles = await self.fetch_klines(symbol=self.market,
+                                                  interval=interval,
+                                                  limit=self.maxlen,
+                                                  startTime=start)
+            with self._lock:
+                # every candle but the last one returned is closed
+                for i, candle in enumerate(candles):
+                    self._merge(interval, candle, i < len(candles) - 1)
+                after = self._closed[interval]
+            if after is not None and after != before:
+                close_time = after + interval_ms - 1
+                last_close = max(last_close or close_time, close_time)
+        if last_close is not None:
+            await self._notify(last_close)
+
+    async def run(self):
+        self._loop = asyncio.get_running_loop()
+        self._task = asyncio.current_task()
+        backoff = min(1.0, self.max_backoff)
+        try:
+            while True:
+                try:
+                    async with websockets.connect(self.stream_url()) as ws:
+                        await self.backfill()
+                        self.ready = True
+                        backoff = min(1.0, self.max_backoff)
+                        async for message in ws:
+                            await self._handle(message)
+                except Exception as e:
+                    # connection errors as well as failed backfills, both are retried
+                    logger.warning('%s: kline stream disconnected: %s',
+                                   self.market, e)
+                self.ready = False
+                self.reconnects += 1
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self.ready = False
+
+    # run the feed on its own event loop in a daemon thread, for the sync bot
+    def start_thread(self):
+        self._thread = threading.Thread(target=asyncio.run,
+                                        args=(self.run(), ),
+                                        daemon=True)
+        self._thread.start()
+        return self._thread
+
+    # stop the feed, safe to call from any thread
+    def stop(self):
+        if self._loop is not None and self._task is not None:
+            self._loop.call_soon_threadsafe(self._task.cancel)
+
+
+# one trade of an order of the account, price is the average fill price of the order once it is filled.
+# time is the trade time of the exchange (ms), received the clock time the feed got it.
+Fill = namedtuple('Fill', [
+    'symbol', 'order_id', 'side', 'type', 'price', 'qty', 'time', 'received'
+])
+
+
+class AccountFeed():
+    def __init__(self,
+                 listen_key,
+                 keepalive,
+                 fetch_positions,
+                 fetch_orders=None,
+                 on_fill=None,
+                 on_position=None,
+                 url=STREAM_URL,
+                 keepalive_seconds=1800,
+                 max_backoff=30.0,
+                 maxfills=100,
+                 clock=time.monotonic):
+        """
+        listen_key:coroutine function: returns a listen key, like AsyncClient.futures_stream_get_listen_key.
+        keepalive:coroutine function: called like AsyncClient.futures_stream_keepalive(listenKey=) every keepalive_seconds.
+        fetch_positions, fetch_orders:coroutine functions: AsyncClient.futures_position_information and
+        futures_get_open_orders, called to sync after every connect.
+        on_fill:callable: called with a Fill for every trade of the account, may return an awaitable.
+        on_position:callable: called with symbol, amount and entry price when a position changes, may return an awaitable.
+        """
+        self.listen_key = listen_key
+        self.keepalive = keepalive
+        self.fetch_positions = fetch_positions
+        self.fetch_orders = fetch_orders
+        self.on_fill = on_fill
+        self.on_position = on_position
+        self.url = url
+        self.keepalive_seconds = keepalive_seconds
+        self.max_backoff = max_backoff
+        self.clock = clock
+
+        self.ready = False
+        self.reconnects = 0
+        self.synced_at = None
+        # symbol: [amount, entry price]
+        self.positions = {}
+        # orderId: order of the last update
+        self.orders = {}
+        self.fills = deque(maxlen=maxfills)
+        # symbol: clock time the position was seen going flat
+        self._closed_at = {}
+        self._lock = threading.Lock()
+        self._loop = None
+        self._task = None
+        self._thread = None
+
+    def position(self, symbol):
+        with self._lock:
+            return self.positions.get(symbol, [0.0, 0.0])[0]
+
+    def in_position(self, symbol):
+        return self.position(symbol) != 0.0
+
+    def position_closed(self, symbol, since):
+        """
+        True if the position of symbol is flat and the feed saw it close, or synced, after `since` (a clock time).
+
+        A position opened at `since` but not reported by the stream yet counts as open.
+        """
+        with self._lock:
+            if self.positions.get(symbol, [0.0, 0.0])[0] != 0.0:
+                return False
+            if since is None:
+                return True
+            closed_at = self._closed_at.get(symbol)
+            return ((closed_at is not None and closed_at > since)
+                    or (self.synced_at is not None and self.synced_at > since))
+
+    def open_orders(self, symbol=None):
+        with self._lock:
+            return [
+                o for o in self.orders.values()
+                if symbol is None or o['symbol'] == symbol
+            ]
+
+    # the last fill of a symbol received after `since` (a clock time) on `side`, or None
+    def last_fill(self, symbol, side=None, since=None):
+        with self._lock:
+            for fill in reversed(self.fills):
+                if since is not None and fill.received <= since:
+                    break
+                if fill.symbol == symbol and (side is None
+                                              or fill.side == side):
+                    return fill
+        return None
+
+    # last_fill, waiting up to `timeout` seconds for it: the fill of an order may arrive after the position update
+    async def wait_fill(self, symbol, side=None, since=None, timeout=2.0,
+                        poll=0.05):
+        deadline = time.monotonic() + timeout
+        while True:
+            fill = self.last_fill(symbol, side, since)
+            if fill is not None or time.monotonic() >= deadline:
+                return fill
+            await asyncio.sleep(poll)
+
+    async def _notify(self, callback, *args):
+        if callback is None:
+            return
+        try:
+            result = callback(*args)
+            if inspect.isawaitable(result):
+                await result
+        except Exception:
+            logger.exception('account feed callback failed')
+
+    # set a position, returns True if it changed
+    def _set_position(self, symbol, amount, entry):
+        old = self.positions.get(symbol, [0.0, 0.0])[0]
+        self.positions[symbol] = [amount, entry]
+        if old != 0.0 and amount == 0.0:
+            self._closed_at[symbol] = self.clock()
+        return old != amount
+
+    async def _handle(self, message):
+        data = json.loads(message)
+        data = data.get('data', data)
+        event = data.get('e')
+        if event == 'ACCOUNT_UPDATE':
+            changed = []
+            with self._lock:
+                for p in data['a'].get('P', []):
+                    amount, entry = float(p['pa']), float(p['ep'])
+                    if self._set_position(p['s'], amount, entry):
+                        changed.append((p['s'], amount, entry))
+            for symbol, amount, entry in changed:
+                await self._notify(self.on_position, symbol, amount, entry)
+        elif event == 'ORDER_TRADE_UPDATE':
+            o = data['o']
+            order_id = int(o['i'])
+            fill = None
+            with self._lock:
+                if o['X'] in ('NEW', 'PARTIALLY_FILLED'):
+                    self.orders[order_id] = o
+                else:
+                    self.orders.pop(order_id, None)
+                if o['x'] == 'TRADE':
+                    price = float(o['ap'] if o['X'] == 'FILLED' else o['L'])
+                    fill = Fill(symbol=o['s'],
+                                order_id=order_id,
+                                side=o['S'],
+                                type=o.get('ot', o['o']),
+                                price=price,
+                                qty=float(o['l']),
+                                time=int(o['T']),
+                                received=self.clock())
+                    self.fills.append(fill)
+            if fill is not None:
+                await self._notify(self.on_fill, fill)
+        elif event == 'listenKeyExpired':
+            raise ConnectionError('listen key expired')
+
+    # load the positions and open orders over REST, on_position is called for the ones that changed
+    async def sync(self):
+        positions = await self.fetch_positions()
+        orders = await self.fetch_orders() if self.fetch_orders else None
+        changed = []
+        with self._lock:
+            for p in positions:
+                amount = float(p['positionAmt'])
+                entry = float(p['entryPrice'])
+                if self._set_position(p['symbol'], amount, entry):
+                    changed.append((p['symbol'], amount, entry))
+            if orders is not None:
+                self.orders = dict((int(o['orderId']), o) for o in orders)
+            self.synced_at = self.clock()
+        for symbol, amount, entry in changed:
+            await self._notify(self.on_position, symbol, amount, entry)
+
+    async def _keep_alive(self, key):
+        while True:
+            await asyncio.sleep(self.keepalive_seconds)
+            try:
+                await self.keepalive(listenKey=key)
+            except Exception as e:
+                logger.warning('listen key keepalive failed: %s', e)
+
+    async def run(self):
+        self._loop = asyncio.get_running_loop()
+        self._task = asyncio.current_task()
+        backoff = min(1.0, self.max_backoff)
+        try:
+            while True:
+                keep_alive = None
+                try:
+                    key = await self.listen_key()
+                    keep_alive = asyncio.ensure_future(self._keep_alive(key))
+                    async with websockets.connect(
+                            self.url.rstrip("/") + "/ws/" + key) as ws:
+                        await self.sync()
+                        self.ready = True
+                        backoff = min(1.0, self.max_backoff)
+                        async for message in ws:
+                            await self._handle(message)
+                except Exception as e:
+                    # connection errors, expired keys and failed syncs, all are retried
+                    logger.warning('account stream disconnected: %s', e)
+                finally:
+                    if keep_alive is not None:
+                        keep_alive.cancel()
+                self.ready = False
+                self.reconnects += 1
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self.ready = False
+
+    # run the feed on its own event loop in a daemon thread, for the sync bot
+    def start_thread(self):
+        self._thread = threading.Thread(target=asyncio.run,
+                                        args=(self.run(), ),
+                                        daemon=True)
+        self._thread.start()
+        return self._thread
+
+    # stop the feed, safe to call from any thread
+    def stop(self):
+        if self._loop is not None and self._task is not None:
+            self._loop.call_soon_threadsafe(self._task.cancel)
@@ -0,0 +1,328 @@
+"""
+Parameter sweep over the offline backtest.
+
+The klines of every symbol and the parameter free indicators (the signal of
+every period, the 5m and 15m ADX) are computed once in the parent and put in
+shared memory blocks. The workers of a process pool attach to the blocks by
+name and read them in place, so a run only costs the gates and the
+simulation of backtest.backtest.
+
+Every finished (symbol, parameters) run is appended to a checkpoint file of
+json lines with the base options and the data directory it ran with. Runs
+already in the checkpoint with the same base and data directory are
+skipped, an interrupted sweep is resumed by starting it again with the same
+checkpoint.
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import signal
+from multiprocessing import Pool, shared_memory
+
+import numpy as np
+
+import backtest as bt
+
+# the settings.json knobs a sweep can vary
+PARAMETERS = [
+    "adx_threshold", "volume_threshold", "trading_periods",
+    "trailing_percentage", "leverage", "market_time_out_minutes"
+]
+
+
+# every combination of the values in space, a dict of parameter: list of values
+def grid(space):
+    names = sorted(space)
+    return [
+        dict(zip(names, values))
+        for values in itertools.product(*(space[name] for name in names))
+    ]
+
+
+# n random configurations; a list is sampled uniformly, {"low": a, "high": b} from the range
+def random_samples(space, n, seed=None):
+    rng = random.Random(seed)
+    samples = []
+    for _ in range(n):
+        sample = {}
+        for name in sorted(space):
+            value = space[name]
+            if isinstance(value, dict):
+                sample[name] = rng.uniform(value["low"], value["high"])
+            else:
+                sample[name] = rng.choice(value)
+        samples.append(sample)
+    return samples
+
+
+class SharedArrays():
+    """
+    numpy arrays stored in named shared memory blocks.
+
+    The parent puts the arrays, the workers rebuild them from spec() with attach, no data is copied.
+    """
+    def __init__(self):
+        self.blocks = []
+        self._spec = {}
+
+    def put(self, key, array):
+        array = np.ascontiguousarray(array)
+        block = shared_memory.SharedMemory(create=True,
+                                           size=max(array.nbytes, 1))
+        np.ndarray(array.shape, array.dtype, buffer=block.buf)[...] = array
+        self.blocks.append(block)
+        self._spec[key] = (block.name, array.shape, array.dtype.str)
+
+    def spec(self):
+        return dict(self._spec)
+
+    # returns the arrays and the blocks, the blocks must stay open while the arrays are used
+    @staticmethod
+    def attach(spec):
+        arrays = {}
+        blocks = []
+        for key, (name, shape, dtype) in spec.items():
+            block = shared_memory.SharedMemory(name=name)
+            blocks.append(block)
+            arrays[key] = np.ndarray(shape, dtype, buffer=block.buf)
+        return arrays, blocks
+
+    def close(self):
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
+        self._spec = {}
+
+
+# key of a run in the checkpoint, a run with other base options or klines is another run
+def run_key(symbol, params, base=None, data_dir=None):
+    return " ".join([
+        symbol,
+        json.dumps(params, sort_keys=True),
+        json.dumps(base, sort_keys=True),
+        json.dumps(data_dir)
+    ])
+
+
+# finished runs of a checkpoint by run_key, a line cut short by a crash is ignored
+def load_checkpoint(path):
+    done = {}
+    if path is None or not os.path.exists(path):
+        return done
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            done[run_key(record["symbol"], record["params"],
+                         record.get("base"), record.get("data_dir"))] = record
+    return done
+
+
+# arrays of the workers, set by _init_worker
+_arrays = None
+_blocks = None
+
+
+def _init_worker(spec):
+    global _arrays, _blocks
+    # a forked worker inherits the SIGTERM handler of a bot, the pool stops its workers with SIGTERM
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    _arrays, _blocks = SharedArrays.attach(spec)
+
+
+# backtest kwargs of a configuration, params override the base settings
+def _backtest_kwargs(base, params):
+    settings = dict(base)
+    settings.update(params)
+    kwargs = dict(settings)
+    kwargs["periods"] = settings["trading_periods"].split(",")
+    del kwargs["trading_periods"]
+    kwargs["leverage"] = int(kwargs["leverage"])
+    return kwargs
+
+
+def _run(task):
+    symbol, params, base, data_dir, intervals = task
+    kwargs = _backtest_kwargs(base, params)
+    klines = dict((i, _arrays[symbol + "/" + i + "/klines"]) for i in intervals)
+    signals = dict((p, _arrays[symbol + "/" + p + "/signal"])
+                   for p in kwargs["periods"])
+    adx = dict((i, _arrays[symbol + "/" + i + "/adx"]) for i in ("5m", "15m"))
+    result = bt.backtest(klines,
+                         symbol=symbol,
+                         signals=signals,
+                         adx=adx,
+                         **kwargs)
+    return {
+        "symbol": symbol,
+        "params": params,
+        "base": base,
+        "data_dir": data_dir,
+        "stats": result.stats
+    }
+
+
+def run_sweep(data_dir,
+              symbols,
+              configs,
+              base,
+              checkpoint=None,
+              workers=None,
+              klines=None):
+    """
+    Backtest every configuration on every symbol in a process pool.
+
+    configs: list of parameter dicts, see grid and random_samples. base: the values of the parameters
+    not in a configuration plus the other backtest options (fee, balance, start, end).
+    klines: {symbol: {interval: array}} to use instead of loading data_dir.
+
+    Returns the records of all the runs, the ones read from the checkpoint with the same base and
+    data_dir included.
+    """
+    done = load_checkpoint(checkpoint)
+    runs = [(symbol, params) for params in configs for symbol in symbols]
+    keys = [run_key(symbol, params, base, data_dir) for symbol, params in runs]
+    tasks = [run for run, key in zip(runs, keys) if key not in done]
+    records = [done[key] for key in keys if key in done]
+    if len(tasks) == 0:
+        return records
+
+    periods = set()
+    for params in configs:
+        periods.update(
+            params.get("trading_periods", base["trading_periods"]).split(","))
+    intervals = sorted(periods | set(["5m", "15m"]))
+
+    shared = SharedArrays()
+    try:
+        for symbol in set(s for s, _ in tasks):
+            if klines is not None:
+                symbol_klines = klines[symbol]
+            else:
+                symbol_klines = dict(
+                    (i, bt.load_klines(data_dir, symbol, i)) for i in intervals)
+            signals, adx = bt.indicators(symbol_klines, sorted(periods))
+            for interval in intervals:
+                shared.put(symbol + "/" + interval + "/klines",
+                           symbol_klines[interval])
+            for period, signal in signals.items():
+                shared.put(symbol + "/" + period + "/signal", signal)
+            for interval, values in adx.items():
+                shared.put(symbol + "/" + interval + "/adx", values)
+
+        workers = workers or os.cpu_count() or 1
+        # small chunks keep every worker busy until the end of the sweep
+        chunksize = max(1, len(tasks) // (workers * 8))
+        out = None
+        if checkpoint is not None:
+            out = open(checkpoint, "a+")
+            out.seek(0, os.SEEK_END)
+            if out.tell() > 0:
+                out.seek(out.tell() - 1)
+                # end a line cut short by a crash, it is skipped by load_checkpoint
+                if out.read(1) != "\n":
+                    out.write("\n")
+        try:
+            with Pool(workers, _init_worker, (shared.spec(), )) as pool:
+                for record in pool.imap_unordered(
+                        _run,
+                        [(s, p, base, data_dir, intervals) for s, p in tasks],
+                        chunksize):
+                    records.append(record)
+                    if out is not None:
+                        out.write(json.dumps(record) + "\n")
+                        out.flush()
+        finally:
+            if out is not None:
+                out.close()
+    finally:
+        shared.close()
+    return records
+
+
+def rank(records, metric="total_return", top=10):
+    """
+    Best configurations, the metric is averaged over the symbols.
+
+    Returns a list of (params, mean metric, trades, worst max_drawdown), best first.
+    """
+    runs = {}
+    for record in records:
+        key = json.dumps(record["params"], sort_keys=True)
+        runs.setdefault(key, (record["params"], []))[1].append(record["stats"])
+
+    ranked = []
+    for params, stats in runs.values():
+        ranked.append((params, float(np.mean([s[metric] for s in stats])),
+                       sum(s["trades"] for s in stats),
+                       max(s["max_drawdown"] for s in stats)))
+    ranked.sort(key=lambda r: r[1], reverse=True)
+    return ranked[:top]
+
+
+# the sweep parameters of settings.json
+def base_settings(settings):
+    return {
+        "adx_threshold": float(settings.market.adx_threshold),
+        "volume_threshold": float(settings.market.volume_threshold),
+        "trading_periods": settings.trading_periods,
+        "trailing_percentage": float(settings.trailing_percentage),
+        "leverage": int(settings.leverage),
+        "market_time_out_minutes":
+        float(settings.market.market_time_out_minutes),
+    }
+
+
+def main(argv=None):
+    import config as cfg
+
+    parser = argparse.ArgumentParser(
+        description="Sweep the strategy parameters over stored klines.")
+    parser.add_argument("symbols", nargs="+")
+    parser.add_argument("--data", default="data")
+    parser.add_argument("--space",
+                        required=True,
+                        help="json file, parameter: list of values or {\"low\", \"high\"}")
+    parser.add_argument("--samples",
+                        type=int,
+                        help="random configurations instead of the full grid")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--checkpoint", default="sweep.jsonl")
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--metric", default="total_return")
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--start", help="YYYY-MM-DD")
+    parser.add_argument("--end", help="YYYY-MM-DD")
+    parser.add_argument("--fee", type=float, default=0.0004)
+    args = parser.parse_args(argv)
+
+    with open(args.space) as f:
+        space = json.load(f)
+    unknown = set(space) - set(PARAMETERS)
+    if unknown:
+        parser.error("unknown parameters: " + ", ".join(sorted(unknown)))
+    if args.samples:
+        configs = random_samples(space, args.samples, args.seed)
+    else:
+        configs = grid(space)
+
+    base = base_settings(cfg.getBotSettings())
+    base.update(fee=args.fee,
+                start=bt.parse_date(args.start),
+                end=bt.parse_date(args.end))
+    records = run_sweep(args.data, args.symbols, configs, base,
+                        args.checkpoint, args.workers)
+    for params, value, trades, drawdown in rank(records, args.metric,
+                                                args.top):
+        print("%s=%.4f trades=%d max_drawdown=%.2f%% %s" %
+              (args.metric, value, trades, drawdown * 100,
+               json.dumps(params, sort_keys=True)))
+
+
+if __name__ == '__main__':
+    main()
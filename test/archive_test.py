@@ -0,0 +1,216 @@
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+import async_helper as ah
+import backtest
+import helper
+from archive import ArchiveFile, KlineArchive, read_archive, read_klines
+from fake_exchange import FakeExchange, synthetic_klines
+
+
+class ExchangeClient():
+    def __init__(self, exchange):
+        self.exchange = exchange
+        self.calls = []
+
+    def futures_klines(self, symbol, interval, **params):
+        self.calls.append((interval, params))
+        return self.exchange.get_klines(symbol, interval, **params)
+
+
+class TestArchive(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.exchange = FakeExchange({'BTCUSDT': synthetic_klines(8000)})
+        self.exchange.advance(1000)
+        self.client = ExchangeClient(self.exchange)
+        self.clock = lambda: self.exchange.now / 1000
+
+    def archive(self, history=500):
+        return KlineArchive(self.tmp, history, clock=self.clock)
+
+    def sync(self, archive, interval='1m', start=None):
+        return archive.sync(
+            lambda **params: self.client.futures_klines(
+                'BTCUSDT', interval, **params), 'BTCUSDT', interval, None,
+            start)
+
+    def assert_klines(self, file, limit):
+        expected = np.array(self.exchange.get_klines('BTCUSDT', file.interval,
+                                                     limit=limit),
+                            dtype='float64')[:, :8]
+        np.testing.assert_array_equal(expected, file.klines(limit))
+
+    def test_incremental_sync(self):
+        file = self.sync(self.archive())
+        self.assertEqual([('1m', {'limit': 500})], self.client.calls)
+        # the last candle is open
+        self.assertEqual((499, 1), (file.count, file.open))
+        self.assert_klines(file, 500)
+
+        # nothing closed, nothing downloaded
+        self.sync(self.archive())
+        self.sync(self.archive())
+        self.assertEqual(1, len(self.client.calls))
+
+        self.exchange.advance(3)
+        self.sync(self.archive())
+        start = self.exchange.now - 3 * 60000
+        self.assertEqual(('1m', {'startTime': start, 'limit': 4}),
+                         self.client.calls[-1])
+        self.assertEqual(502, len(file))
+        self.assert_klines(file, 500)
+
+    def test_answer_after_close(self):
+        now = [0]
+        archive = KlineArchive(self.tmp, 10, clock=lambda: now[0] / 1000)
+
+        def kline(minute, close):
+            open_time = minute * 60000
+            return [open_time, 1.0, close, 1.0, close, 1.0, open_time + 59999,
+                    1.0]
+
+        # the request is sent 50 ms before the second candle closes, the answer arrives 50 ms after
+        def fetch_open(**params):
+            now[0] = 120000 + 50
+            return [kline(0, 1.0), kline(1, 1.0)]
+
+        now[0] = 120000 - 50
+        file = archive.sync(fetch_open, 'BTCUSDT', '1m')
+        self.assertEqual((1, 1), (file.count, file.open))
+
+        now[0] = 120000 + 100
+        file = archive.sync(
+            lambda **params: [kline(1, 9.0), kline(2, 2.0)], 'BTCUSDT', '1m')
+        self.assertEqual([1.0, 9.0], file.columns(3).close[:2].tolist())
+        self.assertEqual((2, 1), (file.count, file.open))
+
+    def test_restart(self):
+        archive = self.archive()
+        self.sync(archive)
+        archive.close()
+        self.exchange.advance(2)
+        file = self.sync(self.archive())
+        self.assertEqual({'startTime': self.exchange.now - 2 * 60000,
+                          'limit': 3}, self.client.calls[-1][1])
+        self.assert_klines(file, 500)
+
+    def test_pause_leaves_gap(self):
+        archive = self.archive(history=100)
+        self.sync(archive)
+        self.exchange.advance(300)
+        file = self.sync(archive)
+        self.assertEqual({'limit': 100}, self.client.calls[-1][1])
+        self.assertEqual(198, len(file))
+        open_time = file.columns().open_time
+        self.assertEqual(1, np.count_nonzero(np.diff(open_time) != 60000))
+
+    def test_backfill_grows_file(self):
+        archive = self.archive(history=10)
+        start = int(synthetic_klines(1)[0][0])
+        file = self.sync(archive, '5m', start=start)
+        # 201 5m candles closed, one page of 1500 at most
+        self.assertEqual(200, len(file))
+        self.exchange.advance(6000)
+        self.sync(archive, '5m', start=start)
+        self.assertEqual(1400, len(file))
+        self.assertEqual(2048, file.capacity)
+        self.assertEqual(2, len(self.client.calls))
+        self.assert_klines(file, 1401)
+
+        # readable without the exchange, the open candle is left out
+        path = archive.path('BTCUSDT', '5m')
+        np.testing.assert_array_equal(file.klines(1401)[:-1],
+                                      read_klines(path))
+        close = read_archive(path).close
+        self.assertEqual(1400, len(close))
+        self.assertTrue(close.flags['C_CONTIGUOUS'])
+        self.assertIsInstance(close.base, np.memmap)
+
+    def test_wrong_interval(self):
+        self.sync(self.archive())
+        with self.assertRaises(ValueError):
+            ArchiveFile(self.archive().path('BTCUSDT', '1m'), '5m')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+
+class TestHelperArchive(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.exchange = FakeExchange({'BTCUSDT': synthetic_klines(9000)})
+        self.exchange.advance(8000)
+        self.client = ExchangeClient(self.exchange)
+        helper.init_kline_archive(self.tmp).clock = self.clock
+
+    def clock(self):
+        return self.exchange.now / 1000
+
+    def test_signal_from_archive(self):
+        expected = helper.get_multi_scale_signal(self.client,
+                                                 'BTCUSDT',
+                                                 _periods=['1m', '5m'])
+        helper.init_kline_archive(None)
+        self.assertEqual(
+            expected,
+            helper.get_multi_scale_signal(self.client,
+                                          'BTCUSDT',
+                                          _periods=['1m', '5m']))
+
+    def test_candles_are_views(self):
+        candles = helper.get_candles(self.client, 'BTCUSDT', '15m')
+        self.assertEqual(500, len(candles.close))
+        self.assertIsInstance(candles.close.base, np.memmap)
+        self.assertEqual(candles.close.tolist(), [
+            float(k[4])
+            for k in self.exchange.get_klines('BTCUSDT', '15m', limit=500)
+        ])
+
+    def test_backtest(self):
+        helper.sync_archive(self.client, 'BTCUSDT', '1m')
+        helper.sync_archive(self.client, 'BTCUSDT', '5m')
+        helper.sync_archive(self.client, 'BTCUSDT', '15m')
+        result = backtest.backtest_symbol(self.tmp,
+                                          'BTCUSDT',
+                                          periods=['1m'],
+                                          archive=True,
+                                          adx_threshold=0)
+        self.assertEqual(499, len(result.close_time))
+
+    def tearDown(self):
+        helper.init_kline_archive(None)
+        shutil.rmtree(self.tmp)
+
+
+class AsyncExchangeClient(ExchangeClient):
+    async def futures_klines(self, symbol, interval, **params):
+        return super().futures_klines(symbol, interval, **params)
+
+
+class TestAsyncArchive(unittest.IsolatedAsyncioTestCase):
+    async def test_get_candles(self):
+        tmp = tempfile.mkdtemp()
+        exchange = FakeExchange({'BTCUSDT': synthetic_klines(1000)})
+        exchange.advance(700)
+        client = AsyncExchangeClient(exchange)
+        try:
+            helper.init_kline_archive(tmp).clock = lambda: exchange.now / 1000
+            candles = await ah.get_candles(client, 'BTCUSDT', '1m')
+            exchange.advance(2)
+            helper.kline_cache.clear()
+            candles = await ah.get_candles(client, 'BTCUSDT', '1m')
+            self.assertEqual({'startTime': exchange.now - 2 * 60000,
+                              'limit': 3}, client.calls[-1][1])
+            self.assertEqual(float(exchange.get_klines('BTCUSDT', '1m')[-1][4]),
+                             candles.close[-1])
+        finally:
+            helper.init_kline_archive(None)
+            shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    unittest.main()
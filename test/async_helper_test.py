@@ -0,0 +1,87 @@
+import unittest
+
+import async_helper as ah
+import helper
+from cache import KlineCache
+from exchange import ExchangeMetadata
+from engine_test import make_candles
+from fake_exchange import FakeExchange, synthetic_klines
+from market_test import FakeClient
+
+
+# exposes the methods of a sync fake client as coroutines, like AsyncClient does
+class FakeAsyncClient():
+    def __init__(self, client):
+        self.client = client
+
+    def __getattr__(self, name):
+        method = getattr(self.client, name)
+
+        async def call(*args, **kwargs):
+            return method(*args, **kwargs)
+
+        return call
+
+
+class SignalClient():
+    def __init__(self, candles):
+        self.candles = candles
+
+    def futures_klines(self, symbol, interval, limit=500):
+        return self.candles[-limit:]
+
+
+class TestAsyncHelper(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        helper.kline_cache = KlineCache()
+        helper.exchange_metadata = ExchangeMetadata()
+
+    async def test_scan_markets_matches_sync(self):
+        expected = helper.scan_markets(FakeClient(), 25, 100.0)
+        helper.kline_cache = KlineCache()
+        value = await ah.scan_markets(FakeAsyncClient(FakeClient()), 25, 100.0,
+                                      max_workers=2)
+        self.assertEqual(expected, value)
+
+    async def test_get_streaming_signal_matches_sync(self):
+        candles = make_candles(n=600, seed=5)
+        periods = ['1m', '5m', '15m']
+        sync_states = {}
+        async_states = {}
+        for i in range(500, len(candles), 7):
+            client = SignalClient(candles[:i])
+            expected = helper.get_streaming_signal(client, 'BTCUSDT',
+                                                   sync_states, periods)
+            value = await ah.get_streaming_signal(FakeAsyncClient(client),
+                                                  'BTCUSDT', async_states,
+                                                  periods)
+            self.assertEqual(expected, value)
+
+    async def test_resampled_candles_match_sync(self):
+        exchange = FakeExchange({'BTCUSDT': synthetic_klines(2000)})
+        exchange.advance(1000)
+        client = SignalClient(None)
+        client.futures_klines = lambda symbol, interval, limit=500: (
+            exchange.get_klines(symbol, interval, limit=limit))
+        clock = lambda: exchange.now / 1000
+        helper.init_resampling('1m')
+        caches = KlineCache(clock=clock), KlineCache(clock=clock)
+        try:
+            for _ in range(5):
+                helper.kline_cache = caches[0]
+                expected = helper.get_candles(client, 'BTCUSDT', '15m')
+                helper.kline_cache = caches[1]
+                value = await ah.get_candles(FakeAsyncClient(client),
+                                             'BTCUSDT', '15m')
+                self.assertEqual(expected.close.tolist(), value.close.tolist())
+                exchange.advance(7)
+        finally:
+            helper.init_resampling(None)
+
+    def tearDown(self):
+        helper.kline_cache = KlineCache()
+        helper.exchange_metadata = ExchangeMetadata()
+
+
+if __name__ == '__main__':
+    unittest.main()
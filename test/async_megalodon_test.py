@@ -0,0 +1,102 @@
+import unittest
+from unittest import mock
+
+import async_helper as ah
+import async_megalodon
+import config as cfg
+import helper
+import scheduler
+from cache import KlineCache
+from exchange import ExchangeMetadata
+from fake_exchange import FakeExchange, FakeExchangeServer, synthetic_klines
+from fake_exchange_test import fake_keys
+from portfolio_test import FakeFeed, test_settings
+
+
+class TestAsyncMegalodon(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        helper.exchange_metadata = ExchangeMetadata()
+        self.exchange = FakeExchange(
+            {
+                'BTCUSDT': synthetic_klines(12000, price=100.0, seed=1),
+                'ETHUSDT': synthetic_klines(12000, price=50.0, seed=2),
+            },
+            balance=1000.0)
+        self.exchange.advance(8000)
+        self.server = FakeExchangeServer(self.exchange).start()
+        # klines expire on the time of the fake exchange
+        helper.kline_cache = KlineCache(
+            clock=lambda: self.exchange.now / 1000)
+        with mock.patch.object(cfg, 'getBotSettings', test_settings):
+            self.bot = async_megalodon.AsyncMegalodon()
+        # every market passes the scan
+        self.bot.adx_threshold = 0
+        self.bot.volume_threshold = 0
+        self.bot.slots = [async_megalodon.MarketSlot(0, self.bot)]
+        self.bot.stopping = mock.Mock()
+        self.bot.market_released = mock.Mock()
+        with mock.patch.object(cfg, 'getAPIKeys', fake_keys):
+            self.bot.client = await ah.init_client(self.server.url)
+        self.patches = [
+            mock.patch.object(async_megalodon, 'KlineFeed', FakeFeed),
+            mock.patch.object(helper, 'log_trade'),
+        ]
+        for patch in self.patches:
+            patch.start()
+
+    async def test_entry_and_trailing_stop(self):
+        slot = self.bot.slots[0]
+        await self.bot.scan_step()
+        self.assertIn(slot.market, ('BTCUSDT', 'ETHUSDT'))
+        self.assertEqual(10, self.exchange.leverage[slot.market])
+        self.assertEqual('ISOLATED', self.exchange.margin_type[slot.market])
+
+        # the signal task opens a position on the first signal change
+        for _ in range(200):
+            await self.bot.signal_step()
+            if slot.side != 0:
+                break
+            self.exchange.advance()
+        market, side = slot.market, slot.side
+        self.assertNotEqual(0, side)
+        amount = self.exchange.positions[market][0]
+        self.assertAlmostEqual(slot.qty * side, amount)
+        stop, = self.exchange.orders.values()
+        self.assertEqual('TRAILING_STOP_MARKET', stop['type'])
+        self.assertEqual('SELL' if side == 1 else 'BUY', stop['side'])
+
+        # the position task sees the stop fire and frees the slot
+        for _ in range(2000):
+            await self.bot.position_step()
+            if slot.market is None:
+                break
+            self.exchange.advance()
+        self.assertIsNone(slot.market)
+        self.assertEqual(0, slot.side)
+        self.assertEqual(0.0, self.exchange.positions[market][0])
+        self.assertEqual({}, self.exchange.orders)
+        self.assertEqual(stop['orderId'], self.exchange.fills[-1][5])
+        entry, exit = helper.log_trade.call_args_list
+        self.assertEqual(('SELL' if side == -1 else 'BUY', market),
+                         (entry.kwargs['_type'], entry.kwargs['_market']))
+        self.assertEqual(('Trailing Stop', market, slot.qty),
+                         (exit.kwargs['_type'], exit.kwargs['_market'],
+                          exit.kwargs['_qty']))
+        self.bot.market_released.set.assert_called()
+
+        # the released market is replaced on the next scan
+        await self.bot.scan_step()
+        self.assertIsNotNone(slot.market)
+
+    async def asyncTearDown(self):
+        for patch in self.patches:
+            patch.stop()
+        await self.bot.client.close_connection()
+        self.server.stop()
+        helper.kline_cache = KlineCache()
+        helper.exchange_metadata = ExchangeMetadata()
+        helper.request_scheduler = scheduler.RequestScheduler()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,196 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+import backtest as bt
+import engine
+from engine_test import make_candles
+
+
+# klines of a random walk as a float array, `ms` apart
+def make_klines(n, ms=60000, seed=3):
+    rng = np.random.RandomState(seed)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.002, n)))
+    open_ = np.concatenate([[close[0]], close[:-1]])
+    high = np.maximum(open_, close) * (1 + rng.uniform(0, 0.001, n))
+    low = np.minimum(open_, close) * (1 - rng.uniform(0, 0.001, n))
+    open_time = 1600000000000 + np.arange(n) * ms
+    return np.column_stack([
+        open_time, open_, high, low, close,
+        rng.uniform(1, 10, n), open_time + ms - 1,
+        rng.uniform(1e5, 1e6, n)
+    ])
+
+
+# merge every `factor` klines into one
+def resample(klines, factor):
+    k = klines[:len(klines) // factor * factor].reshape(-1, factor,
+                                                        klines.shape[1])
+    return np.column_stack([
+        k[:, 0, 0], k[:, 0, 1], k[:, :, 2].max(1), k[:, :, 3].min(1),
+        k[:, -1, 4], k[:, :, 5].sum(1), k[:, -1, 6], k[:, :, 7].sum(1)
+    ])
+
+
+# klines from a list of closes, every candle opens at the previous close
+def path_klines(closes, spread=0.0):
+    closes = np.asarray(closes, dtype="float64")
+    open_ = np.concatenate([[closes[0]], closes[:-1]])
+    n = len(closes)
+    open_time = np.arange(n) * 60000
+    return np.column_stack([
+        open_time, open_,
+        np.maximum(open_, closes) + spread,
+        np.minimum(open_, closes) - spread, closes,
+        np.ones(n), open_time + 59999,
+        np.ones(n)
+    ])
+
+
+class TestLoadKlines(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def test_load_months(self):
+        klines = make_klines(100)
+        bt.save_klines(os.path.join(self.dir, 'BTCUSDT-1m-2020-10.csv'),
+                       klines[50:].tolist())
+        # newer dumps have a header row
+        path = os.path.join(self.dir, 'um', 'BTCUSDT-1m-2020-09.csv')
+        bt.save_klines(path, klines[:60].tolist())
+        with open(path) as f:
+            rows = f.read()
+        with open(path, 'w') as f:
+            f.write('open_time,open,high,low,close,volume,close_time,'
+                    'quote_volume\n' + rows)
+        bt.save_klines(os.path.join(self.dir, 'BTCUSDT-1mo-2020.csv'),
+                       klines[:1].tolist())
+
+        loaded = bt.load_klines(self.dir, 'BTCUSDT', '1m')
+        np.testing.assert_array_equal(klines, loaded)
+
+    def test_missing(self):
+        with self.assertRaises(FileNotFoundError):
+            bt.load_klines(self.dir, 'BTCUSDT', '1m')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+
+class TestSignals(unittest.TestCase):
+    def test_signal_series_matches_signal_state(self):
+        candles = make_candles(n=300, seed=11)
+        series = bt.signal_series(np.array(candles, dtype="float64"))
+        state = engine.SignalState('BTCUSDT', '1m')
+        for i, candle in enumerate(candles):
+            state.update(candle)
+            self.assertEqual(state.entry, series[i])
+
+    def test_align_and_combine(self):
+        close_time = np.array([299999, 599999])
+        values = np.array([1, -1])
+        aligned = bt.align(close_time, values,
+                           np.array([59999, 299999, 359999, 599999]))
+        self.assertEqual([0, 1, 1, -1], aligned.tolist())
+        combined = bt.combine_series([[1, 1, -1, 0], [1, -1, -1, 0]])
+        self.assertEqual([1, 0, -1, 0], combined.tolist())
+
+    def test_volume_gate(self):
+        klines = make_klines(2000)
+        gate = bt.volume_gate(klines, 1e8)
+        # 24h of one minute candles is 1440 candles of at most 1e6 quote volume
+        self.assertFalse(gate[:100].any())
+        self.assertEqual(bool(klines[-1440:, 7].sum() >= 1e8), gate[-1])
+
+
+class TestSimulate(unittest.TestCase):
+    def test_trailing_stop(self):
+        klines = path_klines([100, 100, 105, 110, 108, 100])
+        signal = [0, 1, 1, 1, 1, 1]
+        gate = [True, False, False, False, False, False]
+        trades, equity = bt.simulate(klines, signal, gate,
+                                     leverage=1,
+                                     callback_rate=1.0,
+                                     fee=0.0)
+        self.assertEqual(1, len(trades))
+        trade = trades[0]
+        self.assertEqual('Trailing Stop', trade.cause)
+        # peak 110, the next candle opens at 110 and trades down to 108
+        self.assertAlmostEqual(110 * 0.99, trade.exit_price)
+        self.assertEqual(4 * 60000 + 59999, trade.exit_time)
+        self.assertAlmostEqual(trade.qty * (108.9 - 100), trade.pnl)
+        self.assertAlmostEqual(trade.balance, equity[-1])
+
+    def test_signal_change_and_reentry(self):
+        klines = path_klines([100, 101, 102, 101, 100, 99])
+        signal = [0, 1, 1, -1, -1, -1]
+        trades, equity = bt.simulate(klines, signal, [True] * 6,
+                                     leverage=2,
+                                     callback_rate=50.0,
+                                     fee=0.001,
+                                     balance=100.0)
+        self.assertEqual(['Signal Change', 'End of data'],
+                         [t.cause for t in trades])
+        self.assertEqual([1, -1], [t.side for t in trades])
+        # the short opens one candle after the long closed
+        self.assertEqual(101, trades[0].exit_price)
+        self.assertEqual(100, trades[1].entry_price)
+        qty = 100 / 101 * 2 * 0.99
+        self.assertAlmostEqual(qty * (101 - 101) - 0.001 * qty * 202,
+                               trades[0].pnl)
+        self.assertAlmostEqual(trades[1].balance, equity[-1])
+
+    def test_market_time_out(self):
+        klines = path_klines(np.full(10, 100.0))
+        signal = [0, 0, 0, 0, 0, 1, 1, 1, 1, 1]
+        gate = [True, False, False, False, False, False, False, True, False,
+                False]
+        trades, equity = bt.simulate(klines, signal, gate, timeout_bars=3)
+        # released before the signal, selected again at candle 7
+        self.assertEqual(1, len(trades))
+        self.assertEqual(7 * 60000 + 59999, trades[0].entry_time)
+
+    def test_no_market(self):
+        klines = path_klines(np.full(10, 100.0))
+        trades, equity = bt.simulate(klines, [1] * 10, [False] * 10)
+        self.assertEqual([], trades)
+        self.assertTrue(np.all(equity == 1000.0))
+
+
+class TestBacktest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        base = make_klines(6000, seed=5)
+        for interval, factor in (('1m', 1), ('5m', 5), ('15m', 15)):
+            bt.save_klines(
+                os.path.join(self.dir, 'ETHUSDT-' + interval + '-2020.csv'),
+                resample(base, factor).tolist())
+
+    def test_backtest_symbol(self):
+        result = bt.backtest_symbol(self.dir,
+                                    'ETHUSDT',
+                                    adx_threshold=0,
+                                    start=1600000000000 + 1000 * 60000)
+        self.assertEqual('ETHUSDT', result.symbol)
+        self.assertEqual(5000, len(result.equity))
+        self.assertTrue(result.stats['trades'] > 0)
+        self.assertEqual(result.stats['trades'], len(result.trades))
+        self.assertAlmostEqual(result.trades[-1].balance,
+                               result.stats['final_balance'])
+        for a, b in zip(result.trades, result.trades[1:]):
+            self.assertTrue(a.exit_time < b.entry_time)
+
+    def test_no_trend(self):
+        result = bt.backtest_symbol(self.dir, 'ETHUSDT', adx_threshold=101)
+        self.assertEqual(0, result.stats['trades'])
+        self.assertEqual(0.0, result.stats['max_drawdown'])
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
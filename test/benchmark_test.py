@@ -0,0 +1,89 @@
+import os
+import shutil
+import signal
+import tempfile
+import unittest
+
+import benchmark
+import helper
+from cache import KlineCache
+
+
+class TestBenchmark(unittest.TestCase):
+    def test_run(self):
+        cache = helper.kline_cache
+        journal = helper.trade_journal
+        sigterm = signal.getsignal(signal.SIGTERM)
+        run = benchmark.run_benchmarks(
+            ['engine.trading_signal', 'adx_5min', 'log_trade',
+             'megalodon_cycle'],
+            repeat=2)
+        self.assertEqual('synthetic', run['fixtures'])
+        self.assertEqual(4, len(run['results']))
+        for result in run['results'].values():
+            self.assertEqual(2, result['calls'])
+            self.assertTrue(0 < result['min_ms'] <= result['median_ms'])
+            self.assertTrue(result['peak_kb'] > 0)
+        # a position is opened in one of the two cycles, without a fixed sleep
+        self.assertEqual(0, run['results']['megalodon_cycle']['sleep_ms'])
+        self.assertIs(cache, helper.kline_cache)
+        self.assertIs(journal, helper.trade_journal)
+        # the handler of the bot would stop the workers of a later process pool
+        self.assertIs(sigterm, signal.getsignal(signal.SIGTERM))
+
+    def test_unknown(self):
+        with self.assertRaises(ValueError):
+            benchmark.run_benchmarks(['get_signal'])
+
+    def test_compare(self):
+        baseline = {
+            'fixtures': 'synthetic',
+            'results': {
+                'a': {'min_ms': 1.0, 'peak_kb': 1000.0},
+                'b': {'min_ms': 0.001, 'peak_kb': 1.0},
+            }
+        }
+        run = {
+            'fixtures': 'synthetic',
+            'results': {
+                'a': {'min_ms': 2.5, 'peak_kb': 2100.0},
+                'b': {'min_ms': 0.004, 'peak_kb': 10.0},
+                'c': {'min_ms': 5.0, 'peak_kb': 10.0},
+            }
+        }
+        # b is slower and bigger but within the noise
+        self.assertEqual([('a', 'min_ms', 2.5, 1.0),
+                          ('a', 'peak_kb', 2100.0, 1000.0)],
+                         benchmark.compare(run, baseline, tolerance=1.0))
+        self.assertEqual([], benchmark.compare(run, baseline, tolerance=2.0))
+
+        run['fixtures'] = 'recorded'
+        with self.assertRaises(ValueError):
+            benchmark.compare(run, baseline)
+
+    def test_recorded_fixtures(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            klines = benchmark.synthetic_klines(100, seed=1)
+            # the times of client klines are integers
+            rows = [[int(k[0])] + list(k[1:6]) + [int(k[6]), k[7]]
+                    for k in klines]
+            benchmark.bt.save_klines(os.path.join(tmp, 'BTCUSDT-1m.csv'),
+                                     rows)
+            source, fixtures = benchmark.load_fixtures(tmp)
+            self.assertEqual('recorded', source)
+            self.assertEqual(['BTCUSDT'], list(fixtures))
+            self.assertEqual(klines.tolist(), fixtures['BTCUSDT'].tolist())
+
+            source, fixtures = benchmark.load_fixtures(
+                os.path.join(tmp, 'missing'))
+            self.assertEqual('synthetic', source)
+        finally:
+            shutil.rmtree(tmp)
+
+    def tearDown(self):
+        helper.kline_cache = KlineCache()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import unittest
+
+import helper
+from cache import KlineCache
+
+
+def make_candles(n, start_ms, interval_ms=60000):
+    return [[
+        start_ms + i * interval_ms, "1.0", "1.0", "1.0", "1.0", "1.0",
+        start_ms + (i + 1) * interval_ms - 1
+    ] for i in range(n)]
+
+
+class FakeClient():
+    def __init__(self, candles):
+        self.candles = candles
+        self.calls = []
+
+    def futures_klines(self, symbol, interval, limit=500):
+        self.calls.append(('futures_klines', symbol, interval))
+        return self.candles[-limit:]
+
+    def futures_continous_klines(self, symbol, contractType, interval,
+                                 limit=500):
+        self.calls.append(('futures_continous_klines', symbol, interval))
+        return self.candles[-limit:]
+
+
+class TestKlineCache(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        self.cache = KlineCache(max_symbols=2, clock=lambda: self.now)
+        # the last candle closes at 1059.999s
+        self.candles = make_candles(10, 1059999 - 10 * 60000 + 1)
+
+    def test_expires_at_candle_close(self):
+        self.cache.put('BTCUSDT', '1m', self.candles)
+        self.assertEqual(self.candles, self.cache.get('BTCUSDT', '1m'))
+        self.now = 1059.999
+        self.assertIsNotNone(self.cache.get('BTCUSDT', '1m'))
+        self.now = 1060.0
+        self.assertIsNone(self.cache.get('BTCUSDT', '1m'))
+        self.assertEqual(2, self.cache.hits)
+        self.assertEqual(1, self.cache.misses)
+
+    def test_keys(self):
+        self.cache.put('BTCUSDT', '1m', self.candles)
+        self.assertIsNone(self.cache.get('BTCUSDT', '5m'))
+        self.assertIsNone(self.cache.get('BTCUSDT', '1m', 'PERPETUAL'))
+        self.assertIsNone(self.cache.get('ETHUSDT', '1m'))
+
+    def test_limit(self):
+        self.cache.put('BTCUSDT', '1m', self.candles, limit=10)
+        self.assertEqual(self.candles[-3:],
+                         self.cache.get('BTCUSDT', '1m', limit=3))
+        self.assertIsNone(self.cache.get('BTCUSDT', '1m', limit=11))
+
+    def test_lru(self):
+        self.cache.put('BTCUSDT', '1m', self.candles)
+        self.cache.put('ETHUSDT', '1m', self.candles)
+        self.cache.get('BTCUSDT', '1m')
+        self.cache.put('XRPUSDT', '1m', self.candles)
+        self.assertEqual(2, len(self.cache))
+        self.assertIsNone(self.cache.get('ETHUSDT', '1m'))
+        self.assertIsNotNone(self.cache.get('BTCUSDT', '1m'))
+
+    def test_get_klines_reads_through_cache(self):
+        helper.kline_cache = self.cache
+        client = FakeClient(self.candles)
+        helper.get_klines(client, 'BTCUSDT', '1m')
+        helper.get_klines(client, 'BTCUSDT', '1m')
+        helper.get_klines(client, 'BTCUSDT', '1m', _contract_type='PERPETUAL')
+        helper.get_klines(client, 'BTCUSDT', '1m', _contract_type='PERPETUAL')
+        self.assertEqual([('futures_klines', 'BTCUSDT', '1m'),
+                          ('futures_continous_klines', 'BTCUSDT', '1m')],
+                         client.calls)
+
+    def tearDown(self):
+        helper.kline_cache = KlineCache()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,219 @@
+import unittest
+
+import numpy as np
+import talib
+
+import engine
+import helper
+from cache import KlineCache
+from candles import (CandleBuffer, CandleStore, Candles, Resampler,
+                     can_resample, resample, stack)
+from engine_test import FakeClient, make_candles
+from fake_exchange import FakeExchange, synthetic_klines
+
+
+class TestCandleBuffer(unittest.TestCase):
+    def setUp(self):
+        self.candles = make_candles(700)
+
+    def assert_holds(self, buffer, candles):
+        expected = np.array(candles, dtype='float64')
+        columns = buffer.columns(len(candles))
+        for i in range(expected.shape[1]):
+            np.testing.assert_array_equal(expected[:, i], columns[i])
+
+    def test_ring(self):
+        buffer = CandleBuffer(capacity=100, interval='1m')
+        self.assertEqual(100, buffer.update(self.candles[:100]))
+        self.assert_holds(buffer, self.candles[:100])
+        # one overlapping download at a time wraps the ring around twice
+        for end in range(101, 300, 7):
+            parsed = buffer.update(self.candles[end - 50:end])
+            self.assertEqual(min(7, end - 100) + 1, parsed)
+            self.assert_holds(buffer, self.candles[end - 100:end])
+        self.assertEqual(100, len(buffer))
+        self.assertEqual(self.candles[end - 1][0], buffer.last_open_time)
+        # older candles are ignored
+        self.assertEqual(0, buffer.update(self.candles[:10]))
+
+    def test_open_candle_replaced(self):
+        buffer = CandleBuffer(capacity=10, interval='1m')
+        buffer.update(self.candles[:5])
+        changed = list(self.candles[4])
+        changed[4] = '123.0'
+        self.assertEqual(2, buffer.update([changed, self.candles[5]]))
+        self.assertEqual([123.0, float(self.candles[5][4])],
+                         buffer.column('close', 2).tolist())
+
+    def test_gap_starts_over(self):
+        buffer = CandleBuffer(capacity=100, interval='1m')
+        buffer.update(self.candles[:50])
+        buffer.update(self.candles[60:70])
+        self.assertEqual(10, len(buffer))
+        self.assert_holds(buffer, self.candles[60:70])
+
+    def test_changed_history_starts_over(self):
+        buffer = CandleBuffer(capacity=100, interval='1m')
+        buffer.update(self.candles[:50])
+        other = make_candles(700, seed=3)
+        buffer.update(other[40:55])
+        self.assertEqual(15, len(buffer))
+        self.assert_holds(buffer, other[40:55])
+
+    def test_longer_download_replaces(self):
+        buffer = CandleBuffer(capacity=100, interval='1m')
+        buffer.update(self.candles[40:50])
+        self.assertEqual(40, buffer.update(self.candles[10:50]))
+        self.assert_holds(buffer, self.candles[10:50])
+
+    def test_views(self):
+        buffer = CandleBuffer(capacity=64, interval='1m')
+        for end in range(10, 200, 10):
+            buffer.update(self.candles[end - 10:end])
+            high = buffer.column('high')
+            self.assertIs(buffer.data, high.base)
+            self.assertTrue(high.flags['C_CONTIGUOUS'])
+
+
+class TestCandleStore(unittest.TestCase):
+    def test_signal_and_adx(self):
+        candles = make_candles(500)
+        client = FakeClient(candles)
+        helper.kline_cache = KlineCache()
+        try:
+            o, h, l, c, v = engine.convert_candles(candles)
+            h_o, h_h, h_l, h_c = engine.construct_heikin_ashi(o, h, l, c)
+            expected = engine.trading_signal(h_o, h_h, h_l, h_c, True)
+            for _ in range(2):
+                np.testing.assert_array_equal(
+                    expected,
+                    helper.get_signal(client, 'BTCUSDT', '1m', True))
+            # the second signal only parsed the open candle again
+            self.assertEqual(501, helper.kline_cache.store.get(
+                'BTCUSDT', '1m').parsed)
+
+            expected = talib.ADX(h, l, c, timeperiod=14)[-2]
+            self.assertEqual(expected, helper.adx_from_candles(candles))
+            self.assertEqual(
+                expected,
+                helper.adx_from_candles(
+                    helper.get_candles(client, 'BTCUSDT', '1m')))
+        finally:
+            helper.kline_cache = KlineCache()
+
+    def test_stack(self):
+        store = CandleStore()
+        candles = make_candles(50)
+        btc = store.update('BTCUSDT', '1m', candles)
+        eth = store.update('ETHUSDT', '1m', candles[:10])
+        matrix = stack([btc.columns(), eth.columns(), store.get('XRPUSDT', '1m')
+                        .columns()], 20)
+        self.assertEqual((3, 20), matrix.close.shape)
+        np.testing.assert_array_equal(btc.column('close', 20),
+                                      matrix.close[0])
+        self.assertTrue(np.isnan(matrix.close[1, :10]).all())
+        np.testing.assert_array_equal(eth.column('close'), matrix.close[1, 10:])
+        self.assertTrue(np.isnan(matrix.high[2]).all())
+        self.assertEqual((3, 50), stack([btc.columns()] * 3).open.shape)
+
+    def test_lru(self):
+        store = CandleStore(max_symbols=2)
+        btc = store.get('BTCUSDT', '1m')
+        self.assertIs(btc, store.get('BTCUSDT', '1m'))
+        store.get('ETHUSDT', '1m')
+        store.get('XRPUSDT', '1m')
+        self.assertEqual(2, len(store))
+        self.assertIsNot(btc, store.get('BTCUSDT', '1m'))
+
+
+class ExchangeClient():
+    def __init__(self, exchange):
+        self.exchange = exchange
+        self.calls = []
+
+    def futures_klines(self, symbol, interval, limit=500):
+        self.calls.append(interval)
+        return self.exchange.get_klines(symbol, interval, limit=limit)
+
+
+class TestResampler(unittest.TestCase):
+    def setUp(self):
+        self.exchange = FakeExchange({'BTCUSDT': synthetic_klines(12000)})
+        self.exchange.advance(8000)
+
+    # klines of the exchange as columns
+    def klines(self, interval, limit=500):
+        buffer = CandleBuffer(capacity=1500, interval=interval)
+        buffer.update(self.exchange.get_klines('BTCUSDT', interval, limit))
+        return buffer.columns()
+
+    def assert_same(self, expected, value):
+        for field in ('open_time', 'open', 'high', 'low', 'close',
+                      'close_time'):
+            np.testing.assert_array_equal(getattr(expected, field),
+                                          getattr(value, field))
+        np.testing.assert_allclose(expected.volume, value.volume)
+        np.testing.assert_allclose(expected.quote_volume, value.quote_volume)
+
+    def test_resample(self):
+        base = self.klines('1m', 1500)
+        for interval, ms in (('5m', 300000), ('15m', 900000)):
+            bars = resample(base, ms)
+            # the first bucket of the base candles is cut off
+            self.assert_same(self.klines(interval, len(bars.open_time) - 1),
+                             Candles(*(column[1:] for column in bars)))
+
+    def test_update(self):
+        resampler = Resampler('15m')
+        self.assertFalse(resampler.update(self.klines('1m', 99)))
+        resampler.seed(self.exchange.get_klines('BTCUSDT', '15m'))
+        for _ in range(40):
+            self.assertTrue(resampler.update(self.klines('1m', 99)))
+            self.assert_same(self.klines('15m'), resampler.columns(500))
+            self.exchange.advance()
+        # the base candles do not reach back to the open kline any more
+        self.exchange.advance(120)
+        self.assertFalse(resampler.update(self.klines('1m', 99)))
+
+    def test_can_resample(self):
+        self.assertTrue(can_resample('1m', '15m'))
+        self.assertTrue(can_resample('5m', '4h'))
+        self.assertFalse(can_resample('15m', '5m'))
+        self.assertFalse(can_resample('1m', '1w'))
+        self.assertFalse(can_resample('1m', '3d'))
+        with self.assertRaises(ValueError):
+            Resampler('1m', '5m')
+
+    def test_one_request_per_cycle(self):
+        periods = ['1m', '5m', '15m']
+        client = ExchangeClient(self.exchange)
+        clock = lambda: self.exchange.now / 1000
+        try:
+            helper.init_resampling('1m')
+            helper.kline_cache = KlineCache(clock=clock)
+            for cycle in range(20):
+                client.calls.clear()
+                for interval in ('5m', '15m'):
+                    self.assert_same(
+                        self.klines(interval),
+                        helper.get_candles(client, 'BTCUSDT', interval))
+                self.assertEqual(['1m', '5m', '15m'] if cycle == 0 else ['1m'],
+                                 client.calls)
+                self.exchange.advance()
+            signal = helper.get_multi_scale_signal(client, 'BTCUSDT',
+                                                   _periods=periods)
+            adx = helper.is_trend(client, 'BTCUSDT', 0)
+
+            helper.init_resampling(None)
+            helper.kline_cache = KlineCache(clock=clock)
+            self.assertEqual(
+                signal,
+                helper.get_multi_scale_signal(client, 'BTCUSDT',
+                                              _periods=periods))
+            self.assertEqual(adx, helper.is_trend(client, 'BTCUSDT', 0))
+        finally:
+            helper.init_resampling(None)
+            helper.kline_cache = KlineCache()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,213 @@
+import unittest
+
+import numpy as np
+
+import engine
+import helper
+
+
+# build a list of klines shaped like the binance client output
+def make_candles(n=500, seed=7):
+    rng = np.random.RandomState(seed)
+    close = 100 + np.cumsum(rng.normal(0, 0.5, n))
+    open_ = np.concatenate([[close[0]], close[:-1]])
+    high = np.maximum(open_, close) + rng.uniform(0, 0.4, n)
+    low = np.minimum(open_, close) - rng.uniform(0, 0.4, n)
+    volume = rng.uniform(10, 1000, n)
+    candles = []
+    for i in range(n):
+        candles.append([
+            1600000000000 + i * 60000,
+            "%.4f" % open_[i],
+            "%.4f" % high[i],
+            "%.4f" % low[i],
+            "%.4f" % close[i],
+            "%.3f" % volume[i],
+            1600000059999 + i * 60000,
+        ])
+    return candles
+
+
+class FakeClient():
+    def __init__(self, candles):
+        self.candles = candles
+        self.calls = []
+
+    def futures_klines(self, symbol, interval, limit=500):
+        self.calls.append((symbol, interval, limit))
+        return self.candles[-limit:]
+
+
+class TestEngine(unittest.TestCase):
+    def setUp(self):
+        self.candles = make_candles()
+        self.lists = helper.convert_candles(self.candles)
+        self.arrays = engine.convert_candles(self.candles)
+
+    def test_convert_candles(self):
+        for expected, value in zip(self.lists, self.arrays):
+            self.assertEqual(expected, value.tolist())
+
+    def test_construct_heikin_ashi(self):
+        expected = helper.construct_heikin_ashi(*self.lists[:4])
+        value = engine.construct_heikin_ashi(*self.arrays[:4])
+        for e, v in zip(expected, value):
+            self.assertEqual(e, v.tolist())
+
+    def test_avarage_true_range(self):
+        h_o, h_h, h_l, h_c = helper.construct_heikin_ashi(*self.lists[:4])
+        expected = helper.avarage_true_range(h_h, h_l, h_c)
+        value = engine.avarage_true_range(h_h, h_l, h_c)
+        self.assertEqual(expected.tolist(), value.tolist())
+
+    def test_trading_signal(self):
+        for seed in range(20):
+            o, h, l, c, v = helper.convert_candles(make_candles(seed=seed))
+            ha = helper.construct_heikin_ashi(o, h, l, c)
+            for use_last in (False, True):
+                expected = helper.trading_signal(*ha, use_last=use_last)
+                value = engine.trading_signal(*ha, use_last=use_last)
+                self.assertEqual(expected, value.tolist())
+
+    def test_trading_signal_short_history(self):
+        for n in range(1, 5):
+            o, h, l, c, v = helper.convert_candles(make_candles(n=n))
+            ha = helper.construct_heikin_ashi(o, h, l, c)
+            expected = helper.trading_signal(*ha)
+            value = engine.trading_signal(*ha)
+            self.assertEqual(expected, value.tolist())
+
+    def test_get_signal_backends(self):
+        client = FakeClient(self.candles)
+        for use_last in (False, True):
+            legacy = helper.get_signal(client,
+                                       'BTCUSDT',
+                                       use_last=use_last,
+                                       backend="python")
+            value = helper.get_signal(client,
+                                      'BTCUSDT',
+                                      use_last=use_last,
+                                      backend="numpy")
+            self.assertEqual(legacy, value.tolist())
+
+    def test_get_multi_scale_signal_concurrent(self):
+        client = FakeClient(self.candles)
+        periods = ['1m', '5m', '15m']
+        expected = helper.get_multi_scale_signal(client,
+                                                 'BTCUSDT',
+                                                 _periods=periods,
+                                                 _max_workers=1)
+        value = helper.get_multi_scale_signal(client,
+                                              'BTCUSDT',
+                                              _periods=periods,
+                                              _max_workers=3)
+        self.assertEqual(expected, value)
+
+    def test_get_signal_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            helper.get_signal(FakeClient(self.candles),
+                              'BTCUSDT',
+                              backend="numba")
+
+
+
+class TestSignalState(unittest.TestCase):
+    def setUp(self):
+        self.candles = make_candles(n=700, seed=3)
+
+    # after each closed candle the state matches a full recompute where the next candle is still open
+    def test_update_matches_recompute(self):
+        for use_last in (True, False):
+            state = engine.SignalState('BTCUSDT', '1m', use_last=use_last)
+            candles = self.candles[:300]
+            state.seed(candles[:3])
+            for i in range(3, len(candles)):
+                window = candles[:i + 1]
+                o, h, l, c, v = engine.convert_candles(window)
+                entry = engine.trading_signal(
+                    *engine.construct_heikin_ashi(o, h, l, c), use_last)
+                state.update(window[-2])
+                self.assertEqual(entry[-2], state.entry)
+                self.assertEqual(entry[-1], state.peek(window[-1]))
+
+    def test_update_ignores_seen_candles(self):
+        state = engine.SignalState('BTCUSDT', '1m')
+        entry = state.seed(self.candles)
+        count = state.count
+        for candle in self.candles[-5:-1]:
+            self.assertEqual(entry, state.update(candle))
+        self.assertEqual(count, state.count)
+
+    def test_get_streaming_signal(self):
+        periods = ['1m', '5m']
+        states = {}
+        for i in range(501, len(self.candles)):
+            client = FakeClient(self.candles[:i])
+            entry = helper.get_streaming_signal(client,
+                                                'BTCUSDT',
+                                                states,
+                                                _periods=periods)
+            expected = helper.get_multi_scale_signal(client,
+                                                     'BTCUSDT',
+                                                     _periods=periods)
+            self.assertEqual(expected[-2:], entry)
+
+        # only the first call downloads the whole history
+        client = FakeClient(self.candles)
+        helper.get_streaming_signal(client, 'BTCUSDT', states, _periods=periods)
+        self.assertEqual([5, 5], [call[2] for call in client.calls])
+
+    def test_get_streaming_signal_reseeds_after_gap(self):
+        states = {}
+        helper.get_streaming_signal(FakeClient(self.candles[:500]), 'BTCUSDT',
+                                    states)
+        client = FakeClient(self.candles[:600])
+        helper.get_streaming_signal(client, 'BTCUSDT', states)
+        self.assertEqual([5, 500], [call[2] for call in client.calls])
+        self.assertEqual(int(self.candles[598][0]),
+                         states[('BTCUSDT', '1m')].open_time)
+
+
+
+# (symbols, candles) matrices of the open, high, low and close of histories of different lengths
+def ragged_matrices(lengths, n=300):
+    data = np.full((4, len(lengths), n), np.nan)
+    histories = []
+    for row, length in enumerate(lengths):
+        o, h, l, c, v = engine.convert_candles(
+            make_candles(length, seed=row) if length > 0 else [])
+        histories.append((o, h, l, c))
+        if length > 0:
+            data[:, row, n - length:] = [o, h, l, c]
+    return data, histories
+
+
+class TestBatch(unittest.TestCase):
+    def test_matches_rows(self):
+        lengths = [300, 300, 120, 2, 1, 0, 299]
+        data, histories = ragged_matrices(lengths)
+        for use_last in (False, True):
+            h_o, h_h, h_l, h_c = engine.construct_heikin_ashi_batch(*data)
+            entry = engine.trading_signal_batch(h_o, h_h, h_l, h_c, use_last)
+            self.assertEqual((len(lengths), 299), entry.shape)
+            for row, (length, ohlc) in enumerate(zip(lengths, histories)):
+                ha = engine.construct_heikin_ashi(*ohlc)
+                np.testing.assert_array_equal(ha[0], h_o[row, 300 - length:])
+                np.testing.assert_array_equal(ha[1], h_h[row, 300 - length:])
+                if length < 2:
+                    self.assertFalse(entry[row].any())
+                    continue
+                expected = engine.trading_signal(*ha, use_last)
+                np.testing.assert_array_equal(expected,
+                                              entry[row, 300 - length:])
+                self.assertFalse(entry[row, :300 - length].any())
+
+    def test_one_candle(self):
+        data = np.ones((4, 3, 1))
+        h_o, h_h, h_l, h_c = engine.construct_heikin_ashi_batch(*data)
+        self.assertEqual((3, 1), engine.trading_signal_batch(
+            h_o, h_h, h_l, h_c).shape)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import unittest
+
+import helper
+from exchange import ExchangeMetadata
+
+INFO = {
+    'symbols': [{
+        'symbol': 'BTCUSDT',
+        'status': 'TRADING',
+        'contractType': 'PERPETUAL',
+        'marginAsset': 'USDT',
+        'pricePrecision': 2,
+        'quantityPrecision': 3,
+        'filters': [{
+            'filterType': 'PRICE_FILTER',
+            'tickSize': '0.10'
+        }, {
+            'filterType': 'LOT_SIZE',
+            'stepSize': '0.001',
+            'minQty': '0.001'
+        }, {
+            'filterType': 'MIN_NOTIONAL',
+            'notional': '5'
+        }]
+    }, {
+        'symbol': 'SUSHIUSDT',
+        'status': 'TRADING',
+        'contractType': 'PERPETUAL',
+        'marginAsset': 'USDT',
+        'pricePrecision': 4,
+        'quantityPrecision': 0,
+        'filters': [{
+            'filterType': 'LOT_SIZE',
+            'stepSize': '1',
+            'minQty': '1'
+        }]
+    }]
+}
+
+
+class FakeClient():
+    def __init__(self):
+        self.calls = 0
+
+    def futures_exchange_info(self):
+        self.calls += 1
+        return INFO
+
+
+class TestExchangeMetadata(unittest.TestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.client = FakeClient()
+        self.metadata = ExchangeMetadata(self.client.futures_exchange_info,
+                                         ttl=60,
+                                         clock=lambda: self.now)
+
+    def test_index(self):
+        self.metadata.load()
+        btc = self.metadata.get('BTCUSDT')
+        self.assertEqual(3, btc.quantity_precision)
+        self.assertEqual(0.001, btc.step_size)
+        self.assertEqual(0.1, btc.tick_size)
+        self.assertEqual(5.0, btc.min_notional)
+        self.assertEqual('PERPETUAL', btc.contract_type)
+        self.assertIsNone(self.metadata.get('UNKNOWN'))
+        self.assertEqual(2, len(self.metadata.symbols()))
+
+    def test_expired(self):
+        self.assertTrue(self.metadata.expired())
+        self.metadata.load()
+        self.now = 59.0
+        self.assertFalse(self.metadata.expired())
+        self.now = 60.0
+        self.assertTrue(self.metadata.expired())
+
+    def test_precision_helpers_download_once(self):
+        helper.exchange_metadata = self.metadata
+        self.assertEqual(3, helper.get_market_precision_v2('BTCUSDT',
+                                                           self.client))
+        self.assertEqual(0, helper.get_market_precision_v2('SUSHIUSDT'))
+        self.assertEqual(3, helper.get_market_precision_v2('UNKNOWN'))
+        self.assertEqual(1, helper.get_market_precision(self.client,
+                                                        'BTCUSDT'))
+        self.assertEqual(1, self.client.calls)
+
+    def tearDown(self):
+        self.metadata.stop()
+        helper.exchange_metadata = ExchangeMetadata()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,171 @@
+import time
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+import numpy as np
+from binance.exceptions import BinanceAPIException
+
+import async_helper as ah
+import config as cfg
+import helper
+import scheduler
+from backtest_test import resample
+from cache import KlineCache
+from exchange import ExchangeMetadata
+from fake_exchange import FakeExchange, FakeExchangeServer, synthetic_klines
+
+
+def fake_keys():
+    return SimpleNamespace(api_key='key', api_secret='secret')
+
+
+class TestFakeExchange(unittest.TestCase):
+    def setUp(self):
+        self.path = synthetic_klines(3000, seed=1)
+        self.exchange = FakeExchange({'BTCUSDT': self.path}, balance=1000.0)
+        self.exchange.advance(2000)
+
+    def test_klines(self):
+        # the open candle 2004 is the last one of its 5m candle
+        self.exchange.advance(4)
+        candles = self.exchange.get_klines('BTCUSDT', '5m', limit=100)
+        expected = resample(self.path[:2005], 5)[-100:]
+        self.assertEqual(100, len(candles))
+        np.testing.assert_allclose(expected,
+                                   np.array(candles, dtype='float64')[:, :8],
+                                   rtol=1e-12)
+
+        # the current 1m candle is the last one, still open
+        candles = self.exchange.get_klines('BTCUSDT', '1m', limit=5)
+        self.assertEqual(self.path[2004, 0], candles[-1][0])
+        self.assertEqual(self.exchange.price('BTCUSDT'), float(candles[-1][4]))
+
+        candles = self.exchange.get_klines('BTCUSDT', '15m', limit=3,
+                                           startTime=self.path[31, 0])
+        self.assertEqual([self.path[i, 0] for i in (30, 45, 60)],
+                         [c[0] for c in candles])
+
+    def test_trailing_stop(self):
+        self.exchange.create_order('BTCUSDT', 'BUY', 'MARKET', '2')
+        entry = self.exchange.price('BTCUSDT')
+        self.exchange.create_order('BTCUSDT', 'SELL', 'TRAILING_STOP_MARKET',
+                                   '2', callbackRate='0.5')
+        peak = entry
+        for i in range(2001, 3000):
+            candle = self.path[i]
+            self.exchange.advance()
+            if candle[3] <= peak * 0.995:
+                break
+            peak = max(peak, candle[2])
+        self.assertEqual({}, self.exchange.orders)
+        self.assertEqual([0.0, 0.0], self.exchange.positions['BTCUSDT'])
+        price = self.exchange.fills[-1][4]
+        self.assertEqual(min(candle[1], peak * 0.995), price)
+        self.assertAlmostEqual(1000.0 + 2 * (price - entry),
+                               self.exchange.balance)
+
+    def test_margin_type(self):
+        self.exchange.change_margin_type('BTCUSDT', 'ISOLATED')
+        with self.assertRaises(Exception) as e:
+            self.exchange.change_margin_type('BTCUSDT', 'ISOLATED')
+        self.assertEqual(-4046, e.exception.code)
+
+
+class TestFakeExchangeServer(unittest.TestCase):
+    def setUp(self):
+        helper.kline_cache = KlineCache()
+        helper.exchange_metadata = ExchangeMetadata()
+        helper.request_scheduler = scheduler.RequestScheduler()
+        self.exchange = FakeExchange(
+            {
+                'BTCUSDT': synthetic_klines(12000, price=100.0, seed=1),
+                'ETHUSDT': synthetic_klines(12000, price=50.0, seed=2),
+            },
+            balance=1000.0)
+        self.exchange.advance(11000)
+        self.server = FakeExchangeServer(self.exchange).start()
+        with mock.patch.object(cfg, 'getAPIKeys', fake_keys):
+            self.client = helper.init_client(self.server.url)
+
+    def test_helpers(self):
+        client = self.client
+        self.assertEqual(self.exchange.price('BTCUSDT'),
+                         helper.get_market_price(client, 'BTCUSDT'))
+        self.assertEqual('1000.0', helper.get_futures_balance(client))
+        helper.initialise_futures(client, 'BTCUSDT', 10, 'ISOLATED')
+        helper.initialise_futures(client, 'BTCUSDT', 10, 'ISOLATED')
+        self.assertEqual(10, self.exchange.leverage['BTCUSDT'])
+        self.assertEqual(3, helper.get_market_precision_v2('BTCUSDT', client))
+
+        helper.execute_order(client, 'BTCUSDT', _side='SELL', _qty=2.0)
+        helper.submit_trailing_order(client, 'BTCUSDT', _side='BUY', _qty=2.0,
+                                     _callbackRate=1.0)
+        self.assertTrue(helper.check_in_position(client, 'BTCUSDT'))
+        self.assertEqual(1, len(self.exchange.orders))
+
+        helper.close_position_by_market(client, 'BTCUSDT')
+        helper.cancel_open_orders_by_market(client, 'BTCUSDT')
+        self.assertFalse(helper.check_in_position(client, 'BTCUSDT'))
+        self.assertEqual({}, self.exchange.orders)
+
+    def test_signal_and_scan(self):
+        entry = helper.get_multi_scale_signal(self.client, 'BTCUSDT',
+                                              ['1m', '5m', '15m'])
+        self.assertEqual(499, len(entry))
+        markets = helper.scan_markets(self.client, 0, 0)
+        self.assertEqual(set(['BTCUSDT', 'ETHUSDT']),
+                         set(m[0] for m in markets))
+
+    def test_latency(self):
+        self.server.latency = 0.05
+        start = time.monotonic()
+        helper.get_market_price(self.client, 'BTCUSDT')
+        self.assertTrue(time.monotonic() - start >= 0.05)
+
+    def test_injected_errors(self):
+        self.server.fail_next(503, -1001, 'Internal error', count=1)
+        with self.assertRaises(BinanceAPIException) as e:
+            helper.get_market_price(self.client, 'BTCUSDT')
+        self.assertEqual(-1001, e.exception.code)
+        helper.get_market_price(self.client, 'BTCUSDT')
+
+        self.server.weight_limit = self.server.used_weight + 2
+        helper.get_market_price(self.client, 'BTCUSDT')
+        helper.get_market_price(self.client, 'BTCUSDT')
+        with self.assertRaises(BinanceAPIException) as e:
+            helper.get_market_price(self.client, 'BTCUSDT')
+        self.assertEqual(-1003, e.exception.code)
+        self.assertEqual(429, e.exception.status_code)
+        # the scheduler holds the requests until the window of the weight ends
+        self.assertTrue(
+            helper.request_scheduler.banned_until > time.monotonic() + 50)
+
+    def tearDown(self):
+        self.server.stop()
+        helper.kline_cache = KlineCache()
+        helper.exchange_metadata = ExchangeMetadata()
+        helper.request_scheduler = scheduler.RequestScheduler()
+
+
+class TestAsyncClient(unittest.IsolatedAsyncioTestCase):
+    async def test_async_helpers(self):
+        exchange = FakeExchange({'BTCUSDT': synthetic_klines(600, seed=3)})
+        exchange.advance(500)
+        server = FakeExchangeServer(exchange).start()
+        try:
+            with mock.patch.object(cfg, 'getAPIKeys', fake_keys):
+                client = await ah.init_client(server.url)
+            try:
+                self.assertEqual(exchange.price('BTCUSDT'), await
+                                 ah.get_market_price(client, 'BTCUSDT'))
+                self.assertFalse(await ah.check_in_position(client,
+                                                            'BTCUSDT'))
+            finally:
+                await client.close_connection()
+        finally:
+            server.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+import numpy as np
+
+import helper
+import journal
+from journal import TradeJournal
+
+
+def trade(i):
+    return dict(market='BTCUSDT',
+                qty=0.5 + i,
+                leverage=10,
+                cause='Signal Change',
+                side=1,
+                trigger_price=0,
+                market_price=100.0 + i,
+                type='BUY')
+
+
+class TestTradeJournal(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.now = datetime(2021, 5, 1, 12, 0, 0)
+
+    def clock(self):
+        return self.now
+
+    def test_csv_append_and_load(self):
+        path = os.path.join(self.dir, 'trade_log.csv')
+        writer = TradeJournal(path, clock=self.clock)
+        for i in range(3):
+            writer.append(**trade(i))
+        writer.close()
+        writer = TradeJournal(path, clock=self.clock)
+        writer.append(**trade(3))
+        writer.close()
+
+        with open(path) as f:
+            lines = f.read().splitlines()
+        self.assertEqual(','.join(journal.FIELDS), lines[0])
+        self.assertEqual(5, len(lines))
+
+        df = journal.load_journal(path)
+        self.assertEqual([0.5, 1.5, 2.5, 3.5], list(df['qty']))
+        arrays = journal.load_journal(path, as_frame=False)
+        self.assertEqual([100.0, 101.0, 102.0, 103.0],
+                         list(arrays['market_price']))
+        self.assertEqual(str(self.now), arrays['date'][0])
+
+    def test_rotate_by_size(self):
+        path = os.path.join(self.dir, 'trade_log.csv')
+        writer = TradeJournal(path, max_bytes=200, clock=self.clock)
+        for i in range(10):
+            writer.append(**trade(i))
+            writer.flush()
+            self.now += timedelta(seconds=1)
+        writer.close()
+        files = journal.journal_files(path)
+        self.assertTrue(len(files) > 1)
+        self.assertEqual(path, files[-1])
+        df = journal.load_journal(path)
+        self.assertEqual([0.5 + i for i in range(10)], list(df['qty']))
+
+    def test_rotate_daily(self):
+        path = os.path.join(self.dir, 'trade_log.csv')
+        writer = TradeJournal(path, rotate_daily=True, clock=self.clock)
+        writer.append(**trade(0))
+        writer.flush()
+        writer.append(**trade(1))
+        writer.flush()
+        self.now += timedelta(days=1)
+        writer.append(**trade(2))
+        writer.close()
+        self.assertEqual(2, len(journal.journal_files(path)))
+        self.assertEqual(3, len(journal.load_journal(path)))
+
+    def test_columnar(self):
+        path = os.path.join(self.dir, 'trade_log.cols')
+        writer = TradeJournal(path, fmt='columnar', clock=self.clock)
+        for i in range(4):
+            writer.append(**trade(i))
+        writer.close()
+        arrays = journal.load_journal(path, fmt='columnar', as_frame=False)
+        self.assertEqual([0.5, 1.5, 2.5, 3.5], arrays['qty'].tolist())
+        self.assertEqual(['BTCUSDT'] * 4, arrays['market'].tolist())
+        self.assertEqual(self.now, arrays['date'][0].astype(datetime))
+        df = journal.load_journal(path, fmt='columnar')
+        self.assertEqual(4, len(df))
+
+    def test_columnar_partial_write(self):
+        path = os.path.join(self.dir, 'trade_log.cols')
+        writer = TradeJournal(path, fmt='columnar', clock=self.clock)
+        writer.append(**trade(0))
+        writer.append(**trade(1))
+        writer.flush()
+        # a crash while the second batch was written: some columns got its row, the count did not
+        for name, dtype in journal.SCHEMA[:4]:
+            with open(os.path.join(path, name + '.col'), 'ab') as f:
+                f.write(b'\x01' * np.dtype(dtype).itemsize)
+        self.assertEqual(2, len(journal.load_journal(path, fmt='columnar')))
+
+        writer = TradeJournal(path, fmt='columnar', clock=self.clock)
+        writer.append(**trade(2))
+        writer.close()
+        arrays = journal.load_journal(path, fmt='columnar', as_frame=False)
+        self.assertEqual([0.5, 1.5, 2.5], arrays['qty'].tolist())
+        self.assertEqual([100.0, 101.0, 102.0],
+                         arrays['market_price'].tolist())
+        self.assertEqual([10] * 3, arrays['leverage'].tolist())
+        for name, dtype in journal.SCHEMA:
+            self.assertEqual(
+                3 * np.dtype(dtype).itemsize,
+                os.path.getsize(os.path.join(path, name + '.col')))
+
+    def test_log_trade(self):
+        path = os.path.join(self.dir, 'trade_log.csv')
+        helper.init_trade_journal(path)
+        helper.log_trade(_qty=1.0, _market='ETHUSDT', _type='EXIT')
+        helper.trade_journal.close()
+        df = journal.load_journal(path)
+        self.assertEqual(['ETHUSDT'], list(df['market']))
+        self.assertEqual(['EXIT'], list(df['type']))
+
+    def tearDown(self):
+        helper.init_trade_journal(os.path.join(self.dir, 'unused.csv'))
+        shutil.rmtree(self.dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import unittest
+
+import numpy as np
+
+import helper
+from cache import KlineCache
+from exchange import ExchangeMetadata
+
+
+# klines where the close moves by `step` every candle plus some noise
+def make_candles(step, n=500, seed=1):
+    rng = np.random.RandomState(seed)
+    close = 100 + np.arange(n) * step + rng.normal(0, 0.2, n)
+    candles = []
+    for i in range(n):
+        candles.append([
+            i * 60000,
+            str(close[i] - step),
+            str(close[i] + 0.3),
+            str(close[i] - step - 0.3),
+            str(close[i]), "10.0", (i + 1) * 60000 - 1
+        ])
+    return candles
+
+
+class FakeClient():
+    def __init__(self):
+        self.calls = []
+        self.symbols = {
+            # symbol: (contract type, margin asset, quote volume, step)
+            'BTCUSDT': ('PERPETUAL', 'USDT', 900.0, 0.5),
+            'ETHUSDT': ('PERPETUAL', 'USDT', 800.0, 0.2),
+            'XRPUSDT': ('PERPETUAL', 'USDT', 700.0, 0.0),
+            'LOWUSDT': ('PERPETUAL', 'USDT', 10.0, 0.5),
+            'BTCBUSD': ('PERPETUAL', 'BUSD', 900.0, 0.5),
+            'BTCUSDT_210625': ('CURRENT_QUARTER', 'USDT', 900.0, 0.5),
+        }
+
+    def futures_exchange_info(self):
+        self.calls.append(('futures_exchange_info', None))
+        return {
+            'symbols': [{
+                'symbol': symbol,
+                'contractType': value[0],
+                'marginAsset': value[1]
+            } for symbol, value in self.symbols.items()]
+        }
+
+    def futures_ticker(self):
+        self.calls.append(('futures_ticker', None))
+        return [{
+            'symbol': symbol,
+            'quoteVolume': str(value[2])
+        } for symbol, value in self.symbols.items()]
+
+    def futures_klines(self, symbol, interval, limit=500):
+        self.calls.append(('futures_klines', symbol))
+        return make_candles(self.symbols[symbol][3])
+
+
+class TestScanMarkets(unittest.TestCase):
+    def setUp(self):
+        helper.kline_cache = KlineCache()
+        helper.exchange_metadata = ExchangeMetadata()
+        self.client = FakeClient()
+
+    def test_scan_markets(self):
+        markets = helper.scan_markets(self.client,
+                                      adx_threshold=25,
+                                      volume_threshold=100.0,
+                                      max_workers=4)
+        self.assertEqual(['BTCUSDT', 'ETHUSDT'], [m[0] for m in markets])
+        self.assertEqual(900.0, markets[0][3])
+
+        # only the high volume USDT perpetuals are checked for a trend
+        fetched = set(c[1] for c in self.client.calls
+                      if c[0] == 'futures_klines')
+        self.assertEqual(set(['BTCUSDT', 'ETHUSDT', 'XRPUSDT']), fetched)
+
+    def test_exchange_info_downloaded_once(self):
+        for _ in range(3):
+            helper.get_valid_market(self.client, 25, 100.0)
+        calls = [c for c in self.client.calls if c[0] == 'futures_exchange_info']
+        self.assertEqual(1, len(calls))
+
+    def test_get_valid_market(self):
+        self.assertEqual('BTCUSDT',
+                         helper.get_valid_market(self.client, 25, 100.0))
+        self.assertIsNone(helper.get_valid_market(self.client, 101, 100.0))
+
+    def tearDown(self):
+        helper.kline_cache = KlineCache()
+        helper.exchange_metadata = ExchangeMetadata()
+
+
+if __name__ == '__main__':
+    unittest.main()
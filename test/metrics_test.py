@@ -0,0 +1,158 @@
+import unittest
+import urllib.request
+from types import SimpleNamespace
+from unittest import mock
+
+from binance.exceptions import BinanceAPIException
+
+import async_helper as ah
+import config as cfg
+import helper
+import metrics
+from cache import KlineCache
+from exchange import ExchangeMetadata
+from fake_exchange import FakeExchange, FakeExchangeServer, synthetic_klines
+from fake_exchange_test import fake_keys
+
+
+class TestRegistry(unittest.TestCase):
+    def test_render(self):
+        registry = metrics.Registry()
+        counter = registry.add(
+            metrics.Counter('calls_total', 'Calls.', ['endpoint']))
+        histogram = registry.add(
+            metrics.Histogram('call_seconds', 'Calls.', ['endpoint'],
+                              buckets=(0.1, 1.0)))
+        counter.inc(endpoint='klines')
+        counter.inc(2, endpoint='klines')
+        for value in (0.05, 0.5, 5.0):
+            histogram.observe(value, endpoint='say "hi"')
+        self.assertEqual(
+            '\n'.join([
+                '# HELP calls_total Calls.',
+                '# TYPE calls_total counter',
+                'calls_total{endpoint="klines"} 3.0',
+                '# HELP call_seconds Calls.',
+                '# TYPE call_seconds histogram',
+                'call_seconds_bucket{endpoint="say \\"hi\\"",le="0.1"} 1',
+                'call_seconds_bucket{endpoint="say \\"hi\\"",le="1.0"} 2',
+                'call_seconds_bucket{endpoint="say \\"hi\\"",le="+Inf"} 3',
+                'call_seconds_sum{endpoint="say \\"hi\\""} 5.55',
+                'call_seconds_count{endpoint="say \\"hi\\""} 3',
+            ]) + '\n', registry.render())
+        self.assertEqual((3, 5.55), histogram.get(endpoint='say "hi"'))
+        with self.assertRaises(ValueError):
+            counter.inc(symbol='BTCUSDT')
+
+    def test_timed(self):
+        @metrics.timed
+        def get_price(client, _market):
+            return 1.0
+
+        get_price(None, 'BTCUSDT')
+        get_price(None, _market='BTCUSDT')
+        self.assertEqual(
+            2,
+            metrics.helper_seconds.get(helper='get_price',
+                                       symbol='BTCUSDT')[0])
+
+    def test_sleep(self):
+        with mock.patch.object(metrics.time, 'sleep') as sleep:
+            metrics.sleep(3)
+        sleep.assert_called_once_with(3)
+        self.assertEqual(3, metrics.sleep_seconds.get())
+
+    def tearDown(self):
+        metrics.REGISTRY.clear()
+
+
+class TestInstrumentedClient(unittest.TestCase):
+    def setUp(self):
+        metrics.REGISTRY.clear()
+        helper.kline_cache = KlineCache()
+        helper.exchange_metadata = ExchangeMetadata()
+        self.exchange = FakeExchange(
+            {'BTCUSDT': synthetic_klines(1000, seed=1)})
+        self.exchange.advance(600)
+        self.server = FakeExchangeServer(self.exchange).start()
+        with mock.patch.object(cfg, 'getAPIKeys', fake_keys):
+            self.client = helper.init_client(self.server.url)
+
+    def test_requests(self):
+        helper.get_market_price(self.client, 'BTCUSDT')
+        helper.get_klines(self.client, 'BTCUSDT', '5m')
+        self.assertEqual(
+            1,
+            metrics.request_seconds.get(endpoint='futures_klines',
+                                        symbol='BTCUSDT')[0])
+        self.assertEqual(
+            1,
+            metrics.helper_seconds.get(helper='get_market_price',
+                                       symbol='BTCUSDT')[0])
+        self.assertEqual(self.server.used_weight,
+                         metrics.used_weight.get(interval='1m'))
+
+        self.server.fail_next(400, -1121, 'Invalid symbol.')
+        with self.assertRaises(BinanceAPIException):
+            helper.get_market_price(self.client, 'BTCUSDT')
+        self.assertEqual(
+            1,
+            metrics.request_errors.get(endpoint='futures_mark_price',
+                                       symbol='BTCUSDT',
+                                       code=-1121))
+        lines = metrics.summary()
+        self.assertTrue(lines[0].startswith('requests: '))
+        self.assertIn('errors 1', lines[-1])
+
+    def test_endpoint(self):
+        helper.get_market_price(self.client, 'BTCUSDT')
+        server, reporter = metrics.start(
+            SimpleNamespace(host='127.0.0.1', port=0, summary_minutes=None))
+        try:
+            self.assertIsNone(reporter)
+            with urllib.request.urlopen(server.url) as response:
+                text = response.read().decode()
+            self.assertIn(
+                'binance_request_seconds_count{endpoint="futures_mark_price",'
+                'symbol="BTCUSDT"} 1', text)
+            self.assertIn('binance_used_weight{interval="1m"}', text)
+        finally:
+            server.stop()
+
+    def tearDown(self):
+        self.server.stop()
+        metrics.REGISTRY.clear()
+        helper.kline_cache = KlineCache()
+        helper.exchange_metadata = ExchangeMetadata()
+
+
+class TestAsyncInstrumentedClient(unittest.IsolatedAsyncioTestCase):
+    async def test_requests(self):
+        metrics.REGISTRY.clear()
+        exchange = FakeExchange({'BTCUSDT': synthetic_klines(600, seed=3)})
+        exchange.advance(500)
+        server = FakeExchangeServer(exchange).start()
+        try:
+            with mock.patch.object(cfg, 'getAPIKeys', fake_keys):
+                client = await ah.init_client(server.url)
+            try:
+                await ah.get_market_price(client, 'BTCUSDT')
+            finally:
+                await client.close_connection()
+            self.assertEqual(
+                1,
+                metrics.request_seconds.get(endpoint='futures_mark_price',
+                                            symbol='BTCUSDT')[0])
+            self.assertEqual(
+                1,
+                metrics.helper_seconds.get(helper='get_market_price',
+                                           symbol='BTCUSDT')[0])
+            self.assertEqual(server.used_weight,
+                             metrics.used_weight.get(interval='1m'))
+        finally:
+            server.stop()
+            metrics.REGISTRY.clear()
+
+
+if __name__ == '__main__':
+    unittest.main()
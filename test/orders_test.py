@@ -0,0 +1,189 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from binance.exceptions import BinanceAPIException
+
+import async_helper as ah
+import config as cfg
+import helper
+import metrics
+import orders
+import scheduler
+from exchange import ExchangeMetadata
+from fake_exchange import FakeExchange, FakeExchangeServer, synthetic_klines
+from fake_exchange_test import fake_keys
+
+
+class TestOrderPlan(unittest.TestCase):
+    def test_orders(self):
+        now = [0.0]
+        plan = orders.OrderPlan('BTCUSDT', 1000, 100.0, 2, 3, 1.5,
+                                clock=lambda: now[0])
+        self.assertEqual(29.7, plan.qty)
+        self.assertEqual(
+            {
+                'symbol': 'BTCUSDT',
+                'side': 'SELL',
+                'type': 'MARKET',
+                'quantity': '29.7',
+                'newOrderRespType': 'RESULT'
+            }, plan.entry_order('SELL'))
+        stop = plan.stop_order('SELL')
+        self.assertEqual(('BUY', 'TRAILING_STOP_MARKET', '1.5', 'true'),
+                         (stop['side'], stop['type'], stop['callbackRate'],
+                          stop['reduceOnly']))
+        self.assertFalse(plan.stale())
+        now[0] = orders.PLAN_SECONDS
+        self.assertTrue(plan.stale())
+
+    def test_fill_price(self):
+        plan = orders.OrderPlan('BTCUSDT', 1000, 100.0, 3)
+        self.assertEqual(101.5, orders.fill_price({'avgPrice': '101.5'}, plan))
+        self.assertEqual(100.0, orders.fill_price({'avgPrice': '0'}, plan))
+        self.assertTrue(orders.is_error({'code': -2007, 'msg': 'rate'}))
+        self.assertFalse(orders.is_error({'orderId': 1}))
+
+
+class TestPlacePosition(unittest.TestCase):
+    def setUp(self):
+        metrics.REGISTRY.clear()
+        helper.exchange_metadata = ExchangeMetadata()
+        helper.request_scheduler = scheduler.RequestScheduler()
+        self.tmp = tempfile.mkdtemp()
+        self.journal = helper.trade_journal
+        helper.init_trade_journal(os.path.join(self.tmp, 'trade_log.csv'))
+        self.exchange = FakeExchange({'BTCUSDT': synthetic_klines(600)},
+                                     balance=1000.0)
+        self.exchange.advance(500)
+        self.server = FakeExchangeServer(self.exchange).start()
+        with mock.patch.object(cfg, 'getAPIKeys', fake_keys):
+            self.client = helper.init_client(self.server.url)
+
+    def test_batch(self):
+        plan = helper.prepare_order(self.client, 'BTCUSDT', 2, 1.0)
+        self.server.requests.clear()
+        qty, side, msg = helper.open_position(self.client,
+                                              'BTCUSDT',
+                                              2,
+                                              'SELL',
+                                              'BUY',
+                                              1.0,
+                                              plan=plan)
+        # one request opens and protects the position, nothing slept
+        self.assertEqual([('POST', 'batchOrders')], self.server.requests)
+        self.assertEqual((plan.qty, -1), (qty, side))
+        self.assertEqual(-qty, self.exchange.positions['BTCUSDT'][0])
+        stop, = self.exchange.orders.values()
+        self.assertEqual(('BUY', 'TRAILING_STOP_MARKET', 1.0),
+                         (stop['side'], stop['type'], stop['callbackRate']))
+        self.assertEqual(0, metrics.sleep_seconds.get())
+        self.assertEqual(1, orders.order_seconds.get(stage='stop')[0])
+
+    def test_stop_after_fill(self):
+        self.exchange.conditional_in_batch = False
+        plan = helper.prepare_order(self.client, 'BTCUSDT', 2, 1.0)
+        placed = helper.place_position(self.client, plan, 'BUY')
+        self.assertFalse(placed.batched)
+        self.assertEqual(self.exchange.price('BTCUSDT'), placed.price)
+        self.assertTrue(0 < placed.timings['entry'] <= placed.timings['stop'])
+        self.assertEqual(1, len(self.exchange.orders))
+
+    def test_unprotected_entry_is_closed(self):
+        self.exchange.conditional_in_batch = False
+        # the exchange takes callback rates of 0.1 to 10
+        plan = helper.prepare_order(self.client, 'BTCUSDT', 2, 20.0)
+        with self.assertRaises(BinanceAPIException) as e:
+            helper.place_position(self.client, plan, 'BUY')
+        self.assertEqual(-2007, e.exception.code)
+        self.assertEqual(0.0, self.exchange.positions['BTCUSDT'][0])
+        self.assertEqual({}, self.exchange.orders)
+
+    def test_rejected_entry(self):
+        plan = helper.prepare_order(self.client, 'BTCUSDT', 2, 1.0,
+                                    _margin=0.0001)
+        with self.assertRaises(BinanceAPIException) as e:
+            helper.place_position(self.client, plan, 'BUY')
+        self.assertEqual(-4003, e.exception.code)
+
+    def test_rejected_entry_accepted_stop(self):
+        plan = orders.OrderPlan('BTCUSDT', 1000, 100.0, 2, 3, 1.0)
+        client = mock.Mock()
+        client.futures_place_batch_order.return_value = [{
+            'code': -2019,
+            'msg': 'Margin is insufficient.'
+        }, {
+            'orderId': 7
+        }]
+        with self.assertRaises(BinanceAPIException) as e:
+            helper.place_position(client, plan, 'BUY')
+        self.assertEqual(-2019, e.exception.code)
+        client.futures_cancel_order.assert_called_once_with(symbol='BTCUSDT',
+                                                            orderId=7)
+
+    def test_stale_plan_is_made_again(self):
+        # too small to be placed, unless it is made again
+        plan = helper.prepare_order(self.client, 'BTCUSDT', 2, 1.0,
+                                    _margin=0.0001)
+        plan.created -= orders.PLAN_SECONDS
+        qty, side, msg = helper.open_position(self.client,
+                                              'BTCUSDT',
+                                              2,
+                                              'BUY',
+                                              'SELL',
+                                              1.0,
+                                              plan=plan)
+        self.assertLess(plan.qty, qty)
+        self.assertEqual(qty, self.exchange.positions['BTCUSDT'][0])
+
+    def tearDown(self):
+        self.server.stop()
+        helper.trade_journal.close()
+        helper.trade_journal = self.journal
+        shutil.rmtree(self.tmp)
+        helper.exchange_metadata = ExchangeMetadata()
+        helper.request_scheduler = scheduler.RequestScheduler()
+        metrics.REGISTRY.clear()
+
+
+class TestAsyncPlacePosition(unittest.IsolatedAsyncioTestCase):
+    async def test_rejected_entry_accepted_stop(self):
+        plan = orders.OrderPlan('BTCUSDT', 1000, 100.0, 2, 3, 1.0)
+        client = mock.AsyncMock()
+        client.futures_place_batch_order.return_value = [{
+            'code': -2019,
+            'msg': 'Margin is insufficient.'
+        }, {
+            'orderId': 7
+        }]
+        with self.assertRaises(BinanceAPIException):
+            await ah.place_position(client, plan, 'BUY')
+        client.futures_cancel_order.assert_awaited_once_with(symbol='BTCUSDT',
+                                                             orderId=7)
+
+    async def test_batch(self):
+        helper.exchange_metadata = ExchangeMetadata()
+        exchange = FakeExchange({'BTCUSDT': synthetic_klines(600)},
+                                balance=1000.0)
+        exchange.advance(500)
+        server = FakeExchangeServer(exchange).start()
+        try:
+            with mock.patch.object(cfg, 'getAPIKeys', fake_keys):
+                client = await ah.init_client(server.url)
+            try:
+                plan = await ah.prepare_order(client, 'BTCUSDT', 2, 1.0)
+                placed = await ah.place_position(client, plan, 'BUY')
+            finally:
+                await client.close_connection()
+            self.assertTrue(placed.batched)
+            self.assertEqual(plan.qty, exchange.positions['BTCUSDT'][0])
+            self.assertEqual(1, len(exchange.orders))
+        finally:
+            server.stop()
+            helper.exchange_metadata = ExchangeMetadata()
+
+
+if __name__ == '__main__':
+    unittest.main()
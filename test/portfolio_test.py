@@ -0,0 +1,191 @@
+import asyncio
+import json
+import os
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+import async_helper as ah
+import async_megalodon
+import config as cfg
+import helper
+import portfolio
+import scheduler
+from async_helper_test import FakeAsyncClient
+from exchange import ExchangeMetadata
+from fake_exchange_test import fake_keys
+from stream import AccountFeed
+from stream_test import account_update, order_update
+
+
+def test_settings():
+    path = os.path.join(os.path.dirname(__file__), 'settings_test.json')
+    with open(path) as f:
+        return json.load(f, object_hook=lambda d: SimpleNamespace(**d))
+
+
+class FakeFeed():
+    def __init__(self, market, intervals, **kwargs):
+        self.market = market
+        self.intervals = intervals
+        self.ready = False
+        self.stopped = False
+
+    async def run(self):
+        pass
+
+    def stop(self):
+        self.stopped = True
+
+
+class ExchangeClient():
+    def __init__(self):
+        self.calls = []
+
+    def futures_account_balance(self):
+        self.calls.append('futures_account_balance')
+        return [{'asset': 'USDT', 'balance': '1000.0'}]
+
+    def futures_mark_price(self, symbol):
+        self.calls.append('futures_mark_price')
+        return {'markPrice': '100.0'}
+
+    def futures_exchange_info(self):
+        self.calls.append('futures_exchange_info')
+        return {'symbols': []}
+
+    def futures_klines(self, symbol, interval, limit=500):
+        self.calls.append('futures_klines')
+        return []
+
+    def futures_change_leverage(self, symbol, leverage):
+        self.calls.append('futures_change_leverage')
+
+    def futures_change_margin_type(self, symbol, marginType):
+        self.calls.append('futures_change_margin_type')
+
+    def futures_cancel_all_open_orders(self, symbol):
+        self.calls.append('futures_cancel_all_open_orders')
+
+
+class TestPortfolio(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        helper.exchange_metadata = ExchangeMetadata()
+        with mock.patch.object(cfg, 'getBotSettings', test_settings):
+            self.bot = portfolio.Portfolio()
+        self.bot.slot_count = 2
+        self.bot.slots = [
+            async_megalodon.MarketSlot(i, self.bot) for i in range(2)
+        ]
+        self.exchange = ExchangeClient()
+        self.bot.client = FakeAsyncClient(self.exchange)
+        self.bot.stopping = mock.Mock()
+        self.bot.market_released = mock.Mock()
+        self.patches = [
+            mock.patch.object(async_megalodon, 'KlineFeed', FakeFeed),
+            mock.patch.object(ah, 'scan_markets',
+                              mock.AsyncMock(return_value=[
+                                  ('BTCUSDT', 50, 50, 1e9),
+                                  ('ETHUSDT', 40, 40, 1e9),
+                                  ('XRPUSDT', 35, 35, 1e9),
+                              ])),
+        ]
+        for patch in self.patches:
+            patch.start()
+
+    async def test_slots_get_different_markets(self):
+        await self.bot.scan_step()
+        self.assertEqual(['BTCUSDT', 'ETHUSDT'],
+                         [slot.market for slot in self.bot.slots])
+        self.assertEqual(['XRPUSDT'], [c[0] for c in self.bot.candidates])
+
+        # a released slot takes the strongest market no other slot holds
+        self.bot.slots[0].release()
+        ah.scan_markets.return_value = [('ETHUSDT', 40, 40, 1e9),
+                                        ('XRPUSDT', 35, 35, 1e9)]
+        await self.bot.scan_step()
+        self.assertEqual(['XRPUSDT', 'ETHUSDT'],
+                         [slot.market for slot in self.bot.slots])
+
+    async def test_position_uses_slot_margin(self):
+        await self.bot.scan_step()
+        handle = mock.AsyncMock(return_value=(8.0, 1, 'BUY'))
+        signal = mock.AsyncMock(return_value=[1, 1])
+        with mock.patch.object(ah, 'handle_siganl', handle), \
+                mock.patch.object(ah, 'get_streaming_signal', signal):
+            await self.bot.signal_step()
+        self.assertEqual(2, handle.await_count)
+        for call in handle.await_args_list:
+            self.assertAlmostEqual(1000.0 * self.bot.margin_fraction,
+                                   call.args[-1])
+        self.assertEqual([1, 1], [slot.side for slot in self.bot.slots])
+
+    async def test_account_stream_closes_position(self):
+        await self.bot.scan_step()
+        slot = self.bot.slots[0]
+        slot.side, slot.qty, slot.opened_at = 1, 0.5, 0.0
+        self.bot.account = AccountFeed(None, None, None, clock=lambda: 1.0)
+        self.bot.account.ready = True
+        for message in (account_update('BTCUSDT', 0.5, 100.0),
+                        order_update(7, 'SELL', 'FILLED', 99.5, 0.5,
+                                     'TRAILING_STOP_MARKET'),
+                        account_update('BTCUSDT', 0, 0)):
+            await self.bot.account._handle(message)
+        self.exchange.calls.clear()
+        with mock.patch.object(helper, 'log_trade') as log_trade:
+            await self.bot.position_step()
+        # the slot learnt the exit and its fill price from the stream
+        self.assertEqual([None, 'ETHUSDT'],
+                         [slot.market for slot in self.bot.slots])
+        self.assertEqual(99.5, log_trade.call_args.kwargs['_market_price'])
+        self.assertEqual(['futures_cancel_all_open_orders'],
+                         self.exchange.calls)
+
+    async def test_stop_fill_after_position_update(self):
+        await self.bot.scan_step()
+        slot = self.bot.slots[0]
+        slot.side, slot.qty, slot.opened_at = 1, 0.5, 0.0
+        self.bot.account = AccountFeed(None, None, None,
+                                       on_position=self.bot.on_position,
+                                       clock=lambda: 1.0)
+        self.bot.account.ready = True
+        with mock.patch.object(helper, 'log_trade') as log_trade:
+            # Binance does not order the position update and the fill of the stop
+            for message in (account_update('BTCUSDT', 0.5, 100.0),
+                            account_update('BTCUSDT', 0, 0),
+                            order_update(7, 'SELL', 'FILLED', 99.5, 0.5,
+                                         'TRAILING_STOP_MARKET')):
+                await self.bot.account._handle(message)
+            await asyncio.gather(*(asyncio.all_tasks() -
+                                   {asyncio.current_task()}))
+        self.assertEqual([None, 'ETHUSDT'],
+                         [slot.market for slot in self.bot.slots])
+        self.assertEqual(99.5, log_trade.call_args.kwargs['_market_price'])
+        self.assertNotIn('futures_mark_price', self.exchange.calls)
+
+    async def test_client_waits_for_request_scheduler(self):
+        create = mock.AsyncMock(return_value=FakeAsyncClient(self.exchange))
+        with mock.patch.object(ah.AsyncClient, 'create', create), \
+                mock.patch.object(cfg, 'getAPIKeys', fake_keys):
+            client = await self.bot.connect()
+        # the weights and priorities of the rate_limit section, no other budget in front
+        self.assertIsInstance(client, scheduler.ScheduledClient)
+        self.assertIs(helper.request_scheduler, client.scheduler)
+        await client.futures_mark_price(symbol='BTCUSDT')
+        self.assertEqual(['futures_mark_price'], self.exchange.calls)
+
+    async def test_calculate_position_with_margin(self):
+        client = FakeAsyncClient(self.exchange)
+        qty = await ah.calculate_position(client, 'BTCUSDT', 10, _margin=300)
+        self.assertEqual(29.7, qty)
+        self.assertNotIn('futures_account_balance', self.exchange.calls)
+
+    async def asyncTearDown(self):
+        for patch in self.patches:
+            patch.stop()
+        helper.exchange_metadata = ExchangeMetadata()
+        helper.request_scheduler = scheduler.RequestScheduler()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+import threading
+import time
+import unittest
+from types import SimpleNamespace
+
+from binance.exceptions import BinanceAPIException
+
+import helper
+import scheduler
+
+
+class Clock():
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestRequestCost(unittest.TestCase):
+    def test_cost(self):
+        self.assertEqual((5, 0, scheduler.SIGNAL),
+                         scheduler.request_cost('futures_klines', {}))
+        self.assertEqual((1, 0, scheduler.SIGNAL),
+                         scheduler.request_cost('futures_klines',
+                                                {'limit': 5}))
+        self.assertEqual((40, 0, scheduler.SCAN),
+                         scheduler.request_cost('futures_ticker', {}))
+        self.assertEqual((1, 1, scheduler.ORDER),
+                         scheduler.request_cost('futures_create_order',
+                                                {'symbol': 'BTCUSDT'}))
+
+        # the scan only lowers the priority of data requests
+        with scheduler.priority(scheduler.SCAN):
+            self.assertEqual(scheduler.SCAN,
+                             scheduler.request_cost('futures_klines', {})[2])
+            self.assertEqual(
+                scheduler.ORDER,
+                scheduler.request_cost('futures_create_order', {})[2])
+
+    def test_concurrent_map_keeps_priority(self):
+        def cost(item):
+            return scheduler.request_cost('futures_klines', {})[2]
+
+        with scheduler.priority(scheduler.SCAN):
+            self.assertEqual([scheduler.SCAN] * 4,
+                             helper.concurrent_map(cost, range(4), 4))
+
+
+class TestRequestScheduler(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self.scheduler = scheduler.RequestScheduler(weight_per_minute=100,
+                                                    orders_per_minute=10,
+                                                    orders_per_10s=2,
+                                                    reserve=0.2,
+                                                    clock=self.clock)
+
+    def test_scan_leaves_the_reserve(self):
+        scan = self.scheduler.enter(scheduler.SCAN)
+        self.assertEqual(0, self.scheduler.try_acquire(scan, 80))
+        scan = self.scheduler.enter(scheduler.SCAN)
+        # 20 tokens left, the scan waits for one more
+        self.assertAlmostEqual(0.6, self.scheduler.try_acquire(scan, 1))
+
+        # an order passes the waiting scan and may use the reserve
+        order = self.scheduler.enter(scheduler.ORDER)
+        self.assertEqual(0, self.scheduler.try_acquire(order, 20, 1))
+        self.assertAlmostEqual(12.6, self.scheduler.try_acquire(scan, 1))
+        self.clock.now = 12.6
+        self.assertEqual(0, self.scheduler.try_acquire(scan, 1))
+
+    def test_priority_order(self):
+        first = self.scheduler.enter(scheduler.SIGNAL)
+        second = self.scheduler.enter(scheduler.SIGNAL)
+        position = self.scheduler.enter(scheduler.POSITION)
+        self.assertEqual(scheduler.RequestScheduler.POLL_SECONDS,
+                         self.scheduler.try_acquire(first))
+        self.assertEqual(0, self.scheduler.try_acquire(position))
+        self.assertEqual(scheduler.RequestScheduler.POLL_SECONDS,
+                         self.scheduler.try_acquire(second))
+        self.assertEqual(0, self.scheduler.try_acquire(first))
+        self.assertEqual(0, self.scheduler.try_acquire(second))
+
+    def test_order_limits(self):
+        self.scheduler.acquire(1, 1, scheduler.ORDER)
+        self.scheduler.acquire(1, 1, scheduler.ORDER)
+        order = self.scheduler.enter(scheduler.ORDER)
+        self.assertAlmostEqual(5.0, self.scheduler.try_acquire(order, 1, 1))
+
+    def test_observe(self):
+        self.scheduler.observe({'X-MBX-USED-WEIGHT-1M': '90'})
+        self.assertEqual(10, self.scheduler.weight.tokens)
+        self.scheduler.observe({'X-MBX-ORDER-COUNT-10S': '2'})
+        self.assertEqual(0, self.scheduler.orders['10s'].tokens)
+
+    def test_back_off(self):
+        response = SimpleNamespace(headers={'Retry-After': '30'},
+                                   text='{"code": -1003, "msg": "Too many"}')
+        error = BinanceAPIException(response, 429, response.text)
+        self.assertTrue(self.scheduler.on_error(error))
+        order = self.scheduler.enter(scheduler.ORDER)
+        self.assertEqual(30, self.scheduler.try_acquire(order, 1, 1))
+        self.clock.now = 30
+        self.assertEqual(0, self.scheduler.try_acquire(order, 1, 1))
+
+    def test_order_jumps_the_queue(self):
+        # real time: the scans wait for the weight to come back
+        self.scheduler = scheduler.RequestScheduler(weight_per_minute=600,
+                                                    reserve=0)
+        self.scheduler.weight.tokens = 0
+        done = []
+
+        def request(priority):
+            self.scheduler.acquire(5, 0, priority)
+            done.append(priority)
+
+        threads = [
+            threading.Thread(target=request, args=(scheduler.SCAN, ))
+            for _ in range(3)
+        ]
+        for thread in threads:
+            thread.start()
+        while len(self.scheduler._waiting) < 3:
+            time.sleep(0.01)
+        threads.append(
+            threading.Thread(target=request, args=(scheduler.ORDER, )))
+        threads[-1].start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(scheduler.ORDER, done[0])
+
+
+class TestScheduledClient(unittest.IsolatedAsyncioTestCase):
+    async def test_async(self):
+        class Client():
+            response = SimpleNamespace(headers={'x-mbx-used-weight-1m': '7'})
+
+            async def futures_klines(self, symbol, interval, limit=500):
+                return [symbol, interval, limit]
+
+        clock = Clock()
+        requests = scheduler.RequestScheduler(clock=clock)
+        client = scheduler.ScheduledClient(Client(), requests)
+        self.assertEqual(['BTCUSDT', '1m', 5], await client.futures_klines(
+            symbol='BTCUSDT', interval='1m', limit=5))
+        self.assertEqual(2400 - 7, requests.weight.tokens)
+
+
+if __name__ == '__main__':
+    unittest.main()
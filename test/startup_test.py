@@ -0,0 +1,79 @@
+import os
+import unittest
+from unittest import mock
+
+import async_helper as ah
+import benchmark
+import config as cfg
+import helper
+from exchange import ExchangeMetadata
+from fake_exchange import FakeExchange, FakeExchangeServer, synthetic_klines
+from fake_exchange_test import fake_keys
+
+# seconds the modules of the repository may take to import, without the libraries they load
+OWN_MODULES_BUDGET = 0.25
+
+# seconds a bot may take to import, libraries included
+STARTUP_BUDGET = 2.0
+
+
+class TestImportTime(unittest.TestCase):
+    def test_bots_start_without_heavy_modules(self):
+        own = set(name[:-3] for name in os.listdir(benchmark.BASE_DIR)
+                  if name.endswith('.py'))
+        for bot in ('megalodon', 'async_megalodon', 'portfolio'):
+            times = benchmark.import_times(bot)
+            self.assertEqual([], [
+                name for name in benchmark.HEAVY_MODULES if name in times
+            ], bot)
+            self.assertLess(
+                sum(times[name][0] for name in own if name in times),
+                OWN_MODULES_BUDGET, bot)
+            self.assertLess(times[bot][1], STARTUP_BUDGET, bot)
+
+
+class TestPreflight(unittest.TestCase):
+    def setUp(self):
+        helper.exchange_metadata = ExchangeMetadata()
+        self.exchange = FakeExchange({'BTCUSDT': synthetic_klines(600)},
+                                     balance=1000.0)
+        self.server = FakeExchangeServer(self.exchange).start()
+
+    def test_preflight(self):
+        with mock.patch.object(cfg, 'getAPIKeys', fake_keys):
+            client = helper.init_client(self.server.url)
+        self.server.requests.clear()
+        self.assertLess(0, helper.preflight(client))
+        self.assertEqual(
+            ['GET balance', 'GET exchangeInfo', 'GET ping'],
+            sorted(' '.join(request) for request in self.server.requests))
+        self.assertTrue(helper.exchange_metadata.loaded)
+
+    def tearDown(self):
+        self.server.stop()
+        helper.exchange_metadata = ExchangeMetadata()
+
+
+class TestAsyncPreflight(unittest.IsolatedAsyncioTestCase):
+    async def test_preflight(self):
+        helper.exchange_metadata = ExchangeMetadata()
+        exchange = FakeExchange({'BTCUSDT': synthetic_klines(600)},
+                                balance=1000.0)
+        server = FakeExchangeServer(exchange).start()
+        try:
+            with mock.patch.object(cfg, 'getAPIKeys', fake_keys):
+                client = await ah.init_client(server.url)
+            server.requests.clear()
+            try:
+                self.assertLess(0, await ah.preflight(client))
+            finally:
+                await client.close_connection()
+            self.assertEqual(3, len(server.requests))
+            self.assertTrue(helper.exchange_metadata.loaded)
+        finally:
+            server.stop()
+            helper.exchange_metadata = ExchangeMetadata()
+
+
+if __name__ == '__main__':
+    unittest.main()
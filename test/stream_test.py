@@ -0,0 +1,304 @@
+import asyncio
+import json
+import unittest
+
+import websockets
+
+import helper
+from stream import AccountFeed, KlineFeed
+
+MINUTE = 60000
+# aligned on a 5 minute boundary
+T0 = 1600000200000
+
+
+def candle(open_time, interval_ms, price=1.0):
+    return [
+        open_time,
+        str(price),
+        str(price + 1),
+        str(price - 1),
+        str(price), "1.0", open_time + interval_ms - 1, "1.0", 1, "1.0",
+        "1.0", "0"
+    ]
+
+
+def kline_event(interval, open_time, interval_ms, closed, price=1.0):
+    c = candle(open_time, interval_ms, price)
+    return json.dumps({
+        'stream': 'btcusdt@kline_' + interval,
+        'data': {
+            'e': 'kline',
+            's': 'BTCUSDT',
+            'k': {
+                't': c[0],
+                'T': c[6],
+                'i': interval,
+                'o': c[1],
+                'h': c[2],
+                'l': c[3],
+                'c': c[4],
+                'v': c[5],
+                'n': c[8],
+                'x': closed,
+                'q': c[7],
+                'V': c[9],
+                'Q': c[10],
+                'B': c[11]
+            }
+        }
+    })
+
+
+# REST stand-in, returns candles up to `now` from a fixed history
+class FakeRest():
+    def __init__(self):
+        self.now = T0 + 4 * MINUTE
+        self.calls = []
+
+    async def futures_klines(self, symbol, interval, limit=500, startTime=None):
+        self.calls.append((interval, startTime))
+        interval_ms = MINUTE if interval == '1m' else 5 * MINUTE
+        start = startTime if startTime is not None else (
+            self.now - self.now % interval_ms - 20 * interval_ms)
+        candles = []
+        t = start
+        while t <= self.now and len(candles) < limit:
+            candles.append(candle(t, interval_ms, price=t / MINUTE % 7))
+            t += interval_ms
+        return candles
+
+
+class TestKlineFeed(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.connections = asyncio.Queue()
+        self.handlers = []
+        self.server = await websockets.serve(self.handler, '127.0.0.1', 0)
+        port = self.server.sockets[0].getsockname()[1]
+        self.rest = FakeRest()
+        self.closes = []
+        self.closed = asyncio.Event()
+        self.feed = KlineFeed('BTCUSDT', ['1m', '5m'],
+                              fetch_klines=self.rest.futures_klines,
+                              on_close=self.on_close,
+                              url='ws://127.0.0.1:%d' % port,
+                              close_grace=0.5,
+                              max_backoff=0.01,
+                              clock=lambda: self.rest.now / 1000)
+        self.task = asyncio.ensure_future(self.feed.run())
+
+    async def handler(self, ws, *args):
+        done = asyncio.Event()
+        self.handlers.append(done)
+        await self.connections.put((ws, done))
+        await done.wait()
+
+    def on_close(self, close_time):
+        self.closes.append(close_time)
+        self.closed.set()
+
+    async def next_close(self):
+        await asyncio.wait_for(self.closed.wait(), 5)
+        self.closed.clear()
+        return self.closes[-1]
+
+    async def test_stream_and_reconnect(self):
+        ws, done = await asyncio.wait_for(self.connections.get(), 5)
+
+        # the first backfill loads the history
+        self.assertEqual(T0 + 4 * MINUTE - 1, await self.next_close())
+        self.assertTrue(self.feed.ready)
+        self.assertEqual(T0 + 3 * MINUTE,
+                         self.feed.closed_candles('1m')[-1][0])
+        self.assertEqual(T0 + 4 * MINUTE, self.feed.open_candle('1m')[0])
+
+        # on_close waits for both intervals closing at the same time
+        await ws.send(kline_event('1m', T0 + 4 * MINUTE, MINUTE, False))
+        await ws.send(kline_event('1m', T0 + 4 * MINUTE, MINUTE, True))
+        await asyncio.sleep(0.1)
+        self.assertEqual(1, len(self.closes))
+        await ws.send(kline_event('5m', T0, 5 * MINUTE, True))
+        self.assertEqual(T0 + 5 * MINUTE - 1, await self.next_close())
+        self.assertEqual(T0 + 4 * MINUTE,
+                         self.feed.closed_candles('1m')[-1][0])
+        self.assertIsNone(self.feed.open_candle('1m'))
+
+        # a lone interval is flushed after the grace period
+        await ws.send(kline_event('1m', T0 + 5 * MINUTE, MINUTE, True))
+        self.assertEqual(T0 + 6 * MINUTE - 1, await self.next_close())
+
+        # candles missed while disconnected are backfilled from the last one known
+        self.rest.now = T0 + 9 * MINUTE
+        done.set()
+        ws, done = await asyncio.wait_for(self.connections.get(), 5)
+        self.assertEqual(T0 + 9 * MINUTE - 1, await self.next_close())
+        self.assertIn(('1m', T0 + 5 * MINUTE), self.rest.calls)
+        self.assertIn(('5m', T0), self.rest.calls)
+        self.assertEqual(1, self.feed.reconnects)
+        opens = [c[0] for c in self.feed.closed_candles('1m')]
+        self.assertEqual(list(range(opens[0], T0 + 8 * MINUTE + 1, MINUTE)),
+                         opens)
+        done.set()
+
+    async def test_feed_signal_matches_rest(self):
+        ws, done = await asyncio.wait_for(self.connections.get(), 5)
+        await self.next_close()
+        candles = {}
+        for interval in ['1m', '5m']:
+            candles[interval] = await self.rest.futures_klines(
+                'BTCUSDT', interval)
+
+        class Client():
+            def futures_klines(self, symbol, interval, limit=500):
+                return candles[interval][-limit:]
+
+        expected = helper.get_streaming_signal(Client(), 'BTCUSDT', {},
+                                               ['1m', '5m'])
+        value = helper.get_feed_signal('BTCUSDT', {}, self.feed)
+        self.assertEqual(expected, value)
+        done.set()
+
+    async def asyncTearDown(self):
+        self.feed.stop()
+        await asyncio.wait_for(self.task, 5)
+        for done in self.handlers:
+            done.set()
+        self.server.close()
+        await self.server.wait_closed()
+
+
+def account_update(symbol, amount, entry):
+    return json.dumps({
+        'e': 'ACCOUNT_UPDATE',
+        'E': T0,
+        'a': {
+            'm': 'ORDER',
+            'B': [],
+            'P': [{
+                's': symbol,
+                'pa': str(amount),
+                'ep': str(entry),
+                'ps': 'BOTH'
+            }]
+        }
+    })
+
+
+def order_update(order_id, side, status, price, qty, orig_type):
+    return json.dumps({
+        'e': 'ORDER_TRADE_UPDATE',
+        'E': T0,
+        'o': {
+            's': 'BTCUSDT',
+            'S': side,
+            'o': 'MARKET',
+            'ot': orig_type,
+            'x': 'TRADE' if status == 'FILLED' else status,
+            'X': status,
+            'i': order_id,
+            'ap': str(price),
+            'L': str(price),
+            'l': str(qty),
+            'T': T0
+        }
+    })
+
+
+class TestAccountFeed(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.connections = asyncio.Queue()
+        self.handlers = []
+        self.server = await websockets.serve(self.handler, '127.0.0.1', 0)
+        port = self.server.sockets[0].getsockname()[1]
+        self.keys = 0
+        self.keepalives = []
+        self.amount = '0.5'
+        self.events = asyncio.Queue()
+        self.feed = AccountFeed(self.listen_key,
+                                self.keepalive,
+                                fetch_positions=self.fetch_positions,
+                                on_fill=self.on_event,
+                                on_position=self.on_event,
+                                url='ws://127.0.0.1:%d' % port,
+                                keepalive_seconds=0.05,
+                                max_backoff=0.01)
+        self.task = asyncio.ensure_future(self.feed.run())
+
+    async def handler(self, ws, *args):
+        done = asyncio.Event()
+        self.handlers.append(done)
+        path = getattr(ws, 'path', None) or ws.request.path
+        await self.connections.put((ws, path, done))
+        await done.wait()
+
+    async def listen_key(self):
+        self.keys += 1
+        return 'key%d' % self.keys
+
+    async def keepalive(self, listenKey):
+        self.keepalives.append(listenKey)
+
+    async def fetch_positions(self):
+        return [{
+            'symbol': 'BTCUSDT',
+            'positionAmt': self.amount,
+            'entryPrice': '100.0'
+        }]
+
+    def on_event(self, *args):
+        self.events.put_nowait(args)
+
+    async def next_event(self):
+        return await asyncio.wait_for(self.events.get(), 5)
+
+    async def test_position_closed(self):
+        ws, path, done = await asyncio.wait_for(self.connections.get(), 5)
+        self.assertEqual('/ws/key1', path)
+        # the sync loads the position
+        self.assertEqual(('BTCUSDT', 0.5, 100.0), await self.next_event())
+        self.assertTrue(self.feed.ready)
+        opened_at = self.feed.clock()
+        self.assertFalse(self.feed.position_closed('BTCUSDT', opened_at))
+
+        await ws.send(order_update(7, 'SELL', 'NEW', 0, 0,
+                                   'TRAILING_STOP_MARKET'))
+        await ws.send(order_update(7, 'SELL', 'FILLED', 99.5, 0.5,
+                                   'TRAILING_STOP_MARKET'))
+        await ws.send(account_update('BTCUSDT', 0, 0))
+        fill, = await self.next_event()
+        self.assertEqual((7, 'SELL', 'TRAILING_STOP_MARKET', 99.5, 0.5),
+                         (fill.order_id, fill.side, fill.type, fill.price,
+                          fill.qty))
+        self.assertEqual(('BTCUSDT', 0.0, 0.0), await self.next_event())
+        self.assertEqual([], self.feed.open_orders())
+        self.assertTrue(self.feed.position_closed('BTCUSDT', opened_at))
+        self.assertFalse(
+            self.feed.position_closed('BTCUSDT', self.feed.clock()))
+        self.assertEqual(fill,
+                         self.feed.last_fill('BTCUSDT', 'SELL', opened_at))
+        self.assertIsNone(self.feed.last_fill('BTCUSDT', 'BUY'))
+
+        # the key is kept alive, an expired one is replaced
+        while len(self.keepalives) == 0:
+            await asyncio.sleep(0.01)
+        self.assertEqual('key1', self.keepalives[0])
+        self.amount = '-0.2'
+        await ws.send(json.dumps({'e': 'listenKeyExpired', 'E': T0}))
+        ws, path, done = await asyncio.wait_for(self.connections.get(), 5)
+        self.assertEqual('/ws/key2', path)
+        self.assertEqual(('BTCUSDT', -0.2, 100.0), await self.next_event())
+        self.assertEqual(1, self.feed.reconnects)
+        self.assertEqual(-0.2, self.feed.position('BTCUSDT'))
+        done.set()
+
+    async def asyncTearDown(self):
+        self.feed.stop()
+        await asyncio.wait_for(self.task, 5)
+        for done in self.handlers:
+            done.set()
+        self.server.close()
+        await self.server.wait_closed()
+
+
+if __name__ == '__main__':
+    unittest.main()
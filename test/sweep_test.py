@@ -0,0 +1,123 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import backtest as bt
+import sweep
+from backtest_test import make_klines, resample
+
+BASE = {
+    "adx_threshold": 20.0,
+    "volume_threshold": None,
+    "trading_periods": "1m,5m,15m",
+    "trailing_percentage": 1.0,
+    "leverage": 10,
+    "market_time_out_minutes": 60.0,
+}
+
+
+class TestSpace(unittest.TestCase):
+    def test_grid(self):
+        configs = sweep.grid({'leverage': [5, 10], 'adx_threshold': [20, 30]})
+        self.assertEqual(4, len(configs))
+        self.assertIn({'leverage': 10, 'adx_threshold': 20}, configs)
+
+    def test_random_samples(self):
+        space = {
+            'trailing_percentage': {'low': 0.5, 'high': 2.0},
+            'trading_periods': ['1m,5m', '1m,5m,15m']
+        }
+        samples = sweep.random_samples(space, 20, seed=1)
+        self.assertEqual(samples, sweep.random_samples(space, 20, seed=1))
+        for sample in samples:
+            self.assertTrue(0.5 <= sample['trailing_percentage'] <= 2.0)
+            self.assertIn(sample['trading_periods'], space['trading_periods'])
+
+    def test_rank(self):
+        records = [{
+            'symbol': s,
+            'params': {'leverage': lev},
+            'stats': {'total_return': r, 'trades': 2, 'max_drawdown': d}
+        } for s, lev, r, d in [('A', 5, 0.1, 0.2), ('B', 5, 0.3, 0.1),
+                               ('A', 10, -0.1, 0.5), ('B', 10, 0.0, 0.4)]]
+        ranked = sweep.rank(records)
+        self.assertEqual({'leverage': 5}, ranked[0][0])
+        self.assertAlmostEqual(0.2, ranked[0][1])
+        self.assertEqual(4, ranked[0][2])
+        self.assertEqual(0.5, ranked[1][3])
+
+
+class TestSweep(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.checkpoint = os.path.join(self.dir, 'sweep.jsonl')
+        self.klines = {}
+        for seed, symbol in enumerate(['BTCUSDT', 'ETHUSDT']):
+            base = make_klines(3000, seed=seed)
+            self.klines[symbol] = dict(
+                (interval, resample(base, factor))
+                for interval, factor in (('1m', 1), ('5m', 5), ('15m', 15)))
+        self.configs = sweep.grid({
+            'trailing_percentage': [0.5, 2.0],
+            'trading_periods': ['1m,5m', '1m,5m,15m']
+        })
+
+    def test_matches_backtest(self):
+        records = sweep.run_sweep(None, ['BTCUSDT', 'ETHUSDT'], self.configs,
+                                  BASE, workers=2, klines=self.klines)
+        self.assertEqual(8, len(records))
+        for record in records:
+            kwargs = sweep._backtest_kwargs(BASE, record['params'])
+            expected = bt.backtest(self.klines[record['symbol']], **kwargs)
+            self.assertEqual(expected.stats, record['stats'])
+
+    def test_resume(self):
+        sweep.run_sweep(None, ['BTCUSDT'], self.configs[:2], BASE,
+                        self.checkpoint, workers=2, klines=self.klines)
+        # a crash in the middle of a write
+        with open(self.checkpoint, 'a') as f:
+            f.write('{"symbol": "BTC')
+
+        records = sweep.run_sweep(None, ['BTCUSDT'], self.configs, BASE,
+                                  self.checkpoint, workers=2,
+                                  klines=self.klines)
+        self.assertEqual(4, len(records))
+        with open(self.checkpoint) as f:
+            lines = f.read().splitlines()
+        self.assertEqual(5, len(lines))
+        self.assertEqual(4, len(sweep.load_checkpoint(self.checkpoint)))
+
+        # nothing left to run, the klines are not needed
+        again = sweep.run_sweep(None, ['BTCUSDT'], self.configs, BASE,
+                                self.checkpoint, workers=2, klines={})
+        self.assertEqual(sorted(json.dumps(r) for r in records),
+                         sorted(json.dumps(r) for r in again))
+
+    def test_resume_other_base(self):
+        sweep.run_sweep(None, ['BTCUSDT'], self.configs, BASE,
+                        self.checkpoint, workers=2, klines=self.klines)
+        base = dict(BASE, fee=0.001)
+        records = sweep.run_sweep(None, ['BTCUSDT'], self.configs, base,
+                                  self.checkpoint, workers=2,
+                                  klines=self.klines)
+        self.assertEqual(4, len(records))
+        for record in records:
+            self.assertEqual(base, record['base'])
+            kwargs = sweep._backtest_kwargs(base, record['params'])
+            expected = bt.backtest(self.klines['BTCUSDT'], **kwargs)
+            self.assertEqual(expected.stats, record['stats'])
+        self.assertEqual(8, len(sweep.load_checkpoint(self.checkpoint)))
+
+        # other klines
+        with self.assertRaises(KeyError):
+            sweep.run_sweep('other', ['BTCUSDT'], self.configs, base,
+                            self.checkpoint, workers=2, klines={})
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import async_helper as ah
+import config as cfg
+import helper
+import scheduler
+from exchange import ExchangeMetadata
+from fake_exchange import FakeExchange, FakeExchangeServer, synthetic_klines
+from fake_exchange_test import fake_keys
+from transport import KeepAlive, Transport
+
+
+class TestTransport(unittest.TestCase):
+    def setUp(self):
+        helper.exchange_metadata = ExchangeMetadata()
+        helper.request_scheduler = scheduler.RequestScheduler()
+        self.transport = helper.transport
+        helper.init_transport(pool_size=4, timeout=5)
+        self.exchange = FakeExchange({'BTCUSDT': synthetic_klines(600)})
+        self.exchange.advance(500)
+        self.server = FakeExchangeServer(self.exchange).start()
+
+    def test_clients_share_connections(self):
+        with mock.patch.object(cfg, 'getAPIKeys', fake_keys):
+            first = helper.init_client(self.server.url)
+            second = helper.init_client(self.server.url)
+        self.assertIs(first.session, second.session)
+        self.assertEqual('key', first.session.headers['X-MBX-APIKEY'])
+        self.assertEqual({'timeout': 5.0}, first._requests_params)
+        for client in (first, second, first):
+            helper.get_market_price(client, 'BTCUSDT')
+            helper.get_futures_balance(client)
+        # the pings of both clients and every request on one connection
+        self.assertEqual(1, self.server.connections)
+
+    def test_keep_alive(self):
+        with mock.patch.object(cfg, 'getAPIKeys', fake_keys):
+            client = helper.init_client(self.server.url)
+        keep_alive = KeepAlive(client, 0.01).start()
+        try:
+            while len(self.server.requests) < 4:
+                keep_alive._stop.wait(0.01)
+        finally:
+            keep_alive.stop()
+        self.assertEqual(('GET', 'ping'), self.server.requests[-1])
+        self.assertIsNone(KeepAlive(client, None).start().thread)
+
+    def tearDown(self):
+        self.server.stop()
+        helper.transport.close()
+        helper.transport = self.transport
+        helper.exchange_metadata = ExchangeMetadata()
+        helper.request_scheduler = scheduler.RequestScheduler()
+
+
+class TestAsyncTransport(unittest.IsolatedAsyncioTestCase):
+    async def test_pool(self):
+        exchange = FakeExchange({'BTCUSDT': synthetic_klines(600)})
+        exchange.advance(500)
+        server = FakeExchangeServer(exchange).start()
+        try:
+            with mock.patch.object(cfg, 'getAPIKeys', fake_keys), \
+                    mock.patch.object(helper, 'transport', Transport(3, 5)):
+                client = await ah.init_client(server.url)
+            try:
+                self.assertEqual(3, client.session.connector.limit)
+                for _ in range(3):
+                    await ah.get_market_price(client, 'BTCUSDT')
+            finally:
+                await client.close_connection()
+            self.assertEqual(1, server.connections)
+        finally:
+            server.stop()
+
+
+class TestConfig(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.dir = tempfile.mkdtemp()
+        os.chdir(self.dir)
+        cfg.reload()
+
+    def test_loaded_once(self):
+        with open('keys.json', 'w') as f:
+            f.write('{"api_key": "a", "api_secret": "b"}')
+        self.assertEqual('a', cfg.getPublicKey())
+        with open('keys.json', 'w') as f:
+            f.write('{"api_key": "c", "api_secret": "d"}')
+        self.assertEqual('a', cfg.getPublicKey())
+        self.assertEqual('b', cfg.getPrivateKey())
+        cfg.reload()
+        self.assertEqual('c', cfg.getPublicKey())
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.dir)
+        cfg.reload()
+
+
+if __name__ == '__main__':
+    unittest.main()
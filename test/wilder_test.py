@@ -0,0 +1,271 @@
+import unittest
+
+import numpy as np
+import talib
+
+import async_helper as ah
+import helper
+from cache import KlineCache
+from candles import CandleBuffer
+from engine_test import make_candles, ragged_matrices
+from fake_exchange import FakeExchange, synthetic_klines
+from wilder import WilderState, wilder_batch
+
+
+# the streaming values after every candle
+def stream(candles, timeperiod=14):
+    state = WilderState('BTCUSDT', '1m', timeperiod)
+    adx = []
+    atr = []
+    for candle in candles:
+        state.update(candle)
+        adx.append(state.adx)
+        atr.append(state.atr)
+    return np.array(adx), np.array(atr)
+
+
+# the klines as candles.Candles, the fields they lack are zero
+def columns(candles):
+    buffer = CandleBuffer(capacity=len(candles), interval='1m')
+    buffer.update(candles)
+    return buffer.columns()
+
+
+class TestWilderState(unittest.TestCase):
+    def assert_talib(self, candles, timeperiod=14):
+        arr = np.array(candles, dtype='float64')
+        high, low, close = arr[:, 2], arr[:, 3], arr[:, 4]
+        adx, atr = stream(candles, timeperiod)
+        np.testing.assert_allclose(
+            talib.ADX(high, low, close, timeperiod=timeperiod), adx,
+            rtol=1e-10, atol=1e-10)
+        np.testing.assert_allclose(
+            talib.ATR(high, low, close, timeperiod=timeperiod), atr,
+            rtol=1e-10, atol=1e-10)
+
+    def test_matches_talib(self):
+        for seed in range(5):
+            self.assert_talib(make_candles(700, seed=seed))
+        self.assert_talib(synthetic_klines(2000))
+        self.assert_talib(make_candles(300), timeperiod=5)
+
+    def test_flat_candles(self):
+        candles = make_candles(100)
+        for candle in candles[:60]:
+            candle[1:5] = ['1.0'] * 4
+        self.assert_talib(candles)
+
+    def test_short_history(self):
+        adx, atr = stream(make_candles(30))
+        self.assertEqual(27, np.count_nonzero(np.isnan(adx)))
+        self.assertEqual(14, np.count_nonzero(np.isnan(atr)))
+
+    def test_seen_candles_ignored(self):
+        candles = make_candles(100)
+        state = WilderState('BTCUSDT', '1m')
+        state.seed(candles)
+        adx = state.adx
+        for candle in candles[:-1]:
+            state.update(candle)
+        self.assertEqual(adx, state.adx)
+        self.assertEqual(99, state.count)
+
+    def test_resume(self):
+        candles = make_candles(700)
+        state = WilderState('BTCUSDT', '1m')
+        state.seed(candles[:500])
+        for end in range(501, 600, 3):
+            self.assertTrue(state.resume(columns(candles[end - 5:end])))
+            self.assertEqual(stream(candles[:end - 1])[0][-1], state.adx)
+        # more candles closed than were downloaded
+        self.assertFalse(state.resume(columns(candles[end + 1:end + 6])))
+        # another history
+        other = make_candles(700, seed=3)
+        self.assertFalse(state.resume(columns(other[end - 5:end + 1])))
+        self.assertEqual(end - 1, state.count)
+
+
+class TestWilderBatch(unittest.TestCase):
+    def test_matches_talib(self):
+        lengths = [300, 120, 29, 28, 15, 14, 1, 0, 300]
+        (o, high, low, close), histories = ragged_matrices(lengths)
+        adx, atr = wilder_batch(high, low, close)
+        for row, (length, (o, h, l, c)) in enumerate(zip(lengths, histories)):
+            self.assertTrue(np.isnan(adx[row, :300 - length]).all())
+            self.assertTrue(np.isnan(atr[row, :300 - length]).all())
+            if length == 0:
+                continue
+            np.testing.assert_allclose(talib.ADX(h, l, c, timeperiod=14),
+                                       adx[row, 300 - length:],
+                                       rtol=1e-10, atol=1e-10)
+            np.testing.assert_allclose(talib.ATR(h, l, c, timeperiod=14),
+                                       atr[row, 300 - length:],
+                                       rtol=1e-10, atol=1e-10)
+
+    def test_matches_state(self):
+        candles = make_candles(200, seed=0)
+        (o, high, low, close), histories = ragged_matrices([200], 200)
+        adx, atr = wilder_batch(high, low, close, timeperiod=5)
+        expected = stream(candles, timeperiod=5)
+        np.testing.assert_array_equal(expected[0], adx[0])
+        np.testing.assert_array_equal(expected[1], atr[0])
+
+    def test_short_matrix(self):
+        adx, atr = wilder_batch(np.ones((3, 10)), np.ones((3, 10)),
+                                np.ones((3, 10)))
+        self.assertEqual((3, 10), adx.shape)
+        self.assertTrue(np.isnan(atr).all())
+
+
+class ExchangeClient():
+    def __init__(self, exchange):
+        self.exchange = exchange
+        self.calls = []
+
+    def futures_klines(self, symbol, interval, limit=500):
+        self.calls.append((interval, limit))
+        return self.exchange.get_klines(symbol, interval, limit=limit)
+
+    def futures_continous_klines(self, symbol, contractType, interval,
+                                 limit=500):
+        return self.futures_klines(symbol, interval, limit)
+
+
+class TestHelperWilder(unittest.TestCase):
+    def setUp(self):
+        self.exchange = FakeExchange({'BTCUSDT': synthetic_klines(12000)})
+        self.exchange.advance(8000)
+        self.client = ExchangeClient(self.exchange)
+        helper.kline_cache = KlineCache(clock=self.clock)
+        helper.wilder_states = {}
+
+    def clock(self):
+        return self.exchange.now / 1000
+
+    def test_is_trend(self):
+        for cycle in range(40):
+            self.client.calls.clear()
+            trend, adx_5min, adx_15min = helper.is_trend(
+                self.client, 'BTCUSDT', 20)
+            # later cycles only download the latest candles
+            self.assertEqual(
+                [500, 500] if cycle == 0 else [5, 5],
+                [limit for interval, limit in self.client.calls])
+            self.assertAlmostEqual(
+                helper.adx_5min(self.client, 'BTCUSDT'), adx_5min, places=9)
+            self.assertAlmostEqual(
+                helper.adx_15min(self.client, 'BTCUSDT'), adx_15min, places=9)
+            self.assertEqual(adx_5min >= 20 and adx_15min >= 20, trend)
+            helper.kline_cache.clear()
+            self.exchange.advance(2)
+
+    def test_is_volatile(self):
+        for _ in range(10):
+            atr = min(helper.atr_5min(self.client, 'BTCUSDT'),
+                      helper.atr_15min(self.client, 'BTCUSDT'))
+            self.assertTrue(
+                helper.is_volatile(self.client, 'BTCUSDT', atr * 0.999))
+            self.assertFalse(
+                helper.is_volatile(self.client, 'BTCUSDT', atr * 1.001))
+            self.exchange.advance(7)
+
+    def tearDown(self):
+        helper.kline_cache = KlineCache()
+        helper.wilder_states = {}
+
+
+class TestHelperBatch(unittest.TestCase):
+    def setUp(self):
+        start = synthetic_klines(1)[0][0]
+        self.exchange = FakeExchange({
+            'BTCUSDT': synthetic_klines(12000, seed=1),
+            'ETHUSDT': synthetic_klines(12000, seed=2),
+            # listed 1000 and 100 minutes ago
+            'NEWUSDT': synthetic_klines(5000, start + 7000 * 60000, seed=3),
+            'FRESHUSDT': synthetic_klines(5000, start + 7900 * 60000, seed=4),
+        })
+        self.exchange.advance(8000)
+        self.client = ExchangeClient(self.exchange)
+        self.markets = ['BTCUSDT', 'NEWUSDT', 'ETHUSDT', 'FRESHUSDT']
+        helper.kline_cache = KlineCache(clock=self.clock)
+        helper.wilder_states = {}
+
+    def clock(self):
+        return self.exchange.now / 1000
+
+    def test_batch_indicators(self):
+        for interval in ('1m', '5m'):
+            adx, atr, entry = helper.batch_indicators(
+                helper.get_candle_matrix(self.client, self.markets, interval))
+            for i, market in enumerate(self.markets):
+                candles = helper.get_candles(self.client, market, interval)
+                np.testing.assert_allclose(helper.adx_from_candles(candles),
+                                           adx[i], rtol=1e-10)
+                np.testing.assert_allclose(helper.atr_from_candles(candles),
+                                           atr[i], rtol=1e-10)
+                self.assertEqual(
+                    helper.get_signal(self.client, market, interval, True)[-2],
+                    entry[i])
+
+    def test_batch_is_trend(self):
+        for _ in range(3):
+            expected = [helper.is_trend(self.client, market, 20)
+                        for market in self.markets]
+            value = helper.batch_is_trend(self.client, self.markets, 20)
+            self.assertEqual([e[0] for e in expected], [v[0] for v in value])
+            np.testing.assert_allclose([e[1:] for e in expected],
+                                       [v[1:] for v in value], rtol=1e-10)
+            # too few 15m candles for an ADX
+            self.assertTrue(np.isnan(value[3][2]))
+            self.exchange.advance(17)
+
+    def tearDown(self):
+        helper.kline_cache = KlineCache()
+        helper.wilder_states = {}
+
+
+class AsyncExchangeClient(ExchangeClient):
+    async def futures_klines(self, symbol, interval, limit=500):
+        return super().futures_klines(symbol, interval, limit)
+
+
+class TestAsyncWilder(unittest.IsolatedAsyncioTestCase):
+    async def test_is_trend_matches_sync(self):
+        exchange = FakeExchange({'BTCUSDT': synthetic_klines(12000)})
+        exchange.advance(8000)
+        clock = lambda: exchange.now / 1000
+        caches = KlineCache(clock=clock), KlineCache(clock=clock)
+        states = {}, {}
+        try:
+            for _ in range(10):
+                helper.kline_cache, helper.wilder_states = caches[0], states[0]
+                expected = helper.is_trend(ExchangeClient(exchange),
+                                           'BTCUSDT', 20)
+                helper.kline_cache, helper.wilder_states = caches[1], states[1]
+                self.assertEqual(
+                    expected, await ah.is_trend(AsyncExchangeClient(exchange),
+                                                'BTCUSDT', 20))
+                exchange.advance(11)
+        finally:
+            helper.kline_cache = KlineCache()
+            helper.wilder_states = {}
+
+    async def test_batch_is_trend_matches_sync(self):
+        exchange = FakeExchange({
+            'BTCUSDT': synthetic_klines(12000, seed=1),
+            'ETHUSDT': synthetic_klines(12000, seed=2),
+        })
+        exchange.advance(8000)
+        helper.kline_cache = KlineCache(clock=lambda: exchange.now / 1000)
+        try:
+            markets = ['ETHUSDT', 'BTCUSDT']
+            self.assertEqual(
+                helper.batch_is_trend(ExchangeClient(exchange), markets, 20),
+                await ah.batch_is_trend(AsyncExchangeClient(exchange),
+                                        markets, 20))
+        finally:
+            helper.kline_cache = KlineCache()
+
+
+if __name__ == '__main__':
+    unittest.main()
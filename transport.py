@@ -0,0 +1,110 @@
+"""
+Shared HTTP transport of the binance clients.
+
+Every Client made by helper.init_client sends its requests through one
+requests.Session holding a pool of `pool_size` keep-alive connections, so a
+request only pays the TCP and TLS handshake when no open connection is
+left. The AsyncClient of async_helper.init_client gets an aiohttp connector
+with the same pool size. Every request times out after `timeout` seconds.
+
+The exchange closes idle connections, KeepAlive pings it every
+`keep_alive_seconds` so an order finds an open connection.
+"""
+import inspect
+import logging
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger('bot')
+
+
+class Transport():
+    def __init__(self, pool_size=16, timeout=10.0, keep_alive_seconds=30.0):
+        self.pool_size = int(pool_size)
+        self.timeout = float(timeout)
+        self.keep_alive_seconds = keep_alive_seconds
+        self._session = None
+        self._lock = threading.Lock()
+
+    # the session shared by the clients, created on first use
+    def session(self):
+        with self._lock:
+            if self._session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4,
+                                      pool_maxsize=self.pool_size)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                self._session = session
+            return self._session
+
+    # requests_params of the clients, applied to every request
+    def requests_params(self):
+        return {"timeout": self.timeout}
+
+    # client_class using the shared session, with the headers (api key) the class sets up
+    def client_class(self, client_class):
+        transport = self
+
+        def _init_session(self):
+            session = client_class._init_session(self)
+            shared = transport.session()
+            shared.headers.update(session.headers)
+            session.close()
+            return shared
+
+        return type(client_class.__name__, (client_class, ),
+                    {"_init_session": _init_session})
+
+    # keyword arguments of AsyncClient.create for the pool and the timeout, call it on the event loop of the client.
+    # Releases of python-binance without session_params keep the aiohttp defaults.
+    def async_client_params(self, client_class):
+        import aiohttp
+
+        if "session_params" not in inspect.signature(
+                client_class.create).parameters:
+            return {}
+        return {
+            "session_params": {
+                "connector": aiohttp.TCPConnector(limit=self.pool_size),
+                "timeout": aiohttp.ClientTimeout(total=self.timeout),
+            }
+        }
+
+    def close(self):
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+
+class KeepAlive():
+    """
+    Pings the exchange every `interval` seconds on a background thread to keep a connection open.
+    """
+    def __init__(self, client, interval=30.0):
+        self.client = client
+        self.interval = interval
+        self._stop = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if self.interval:
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.client.futures_ping()
+            except Exception as e:
+                logger.warning("Keep alive ping failed: %s", e)
+
+    def stop(self):
+        self._stop.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
@@ -0,0 +1,225 @@
+"""
+Wilder smoothed indicators: ADX and ATR.
+
+A WilderState is the streaming version of talib.ADX and talib.ATR for one
+(market, interval), like engine.SignalState is the one of the signal. It
+is seeded once from a kline history and then advanced one closed candle
+at a time in O(1): only the previous candle and the smoothed +DM, -DM,
+true range, ATR and ADX are carried. The values are the ones talib gives
+for the same candles. talib starts its smoothing at the first candle it is
+handed, so over a moving window of the latest klines its values differ
+from the streaming ones by (1 - 1 / timeperiod) ** window, far below the
+precision of a float64 for the 500 klines the bot downloads.
+
+`resume` advances a state with a short download of the latest klines, as
+long as it still holds the last candle of the state. helper.is_trend and
+helper.is_volatile keep their states in helper.wilder_states.
+
+wilder_batch runs the same recursion for the rows of (symbols, candles)
+matrices at once, one column of all the symbols per step, like the
+`_batch` functions of engine.py: a symbol with a shorter history is right
+aligned after nan.
+"""
+import math
+
+import numpy as np
+
+import engine
+
+
+class WilderState():
+    """
+    Streaming talib.ADX and talib.ATR of one (market, interval).
+
+    `adx` and `atr` are nan until enough candles closed: 2 * timeperiod for the ADX, timeperiod + 1
+    for the ATR, like talib.
+    """
+    def __init__(self, market, interval, timeperiod=14):
+        self.market = market
+        self.interval = interval
+        self.timeperiod = timeperiod
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.open_time = None
+        self.high = 0.0
+        self.low = 0.0
+        self.close = 0.0
+        # sums of the first timeperiod - 1 values, then Wilder smoothed
+        self.plus_dm = 0.0
+        self.minus_dm = 0.0
+        self.tr = 0.0
+        # sum of the first timeperiod DX values
+        self.dx_sum = 0.0
+        self.adx = math.nan
+        self.atr = math.nan
+
+    # seed the state from raw klines, the last one is the candle still open and is skipped
+    def seed(self, candles):
+        self.reset()
+        for candle in candles[:-1]:
+            self.update(candle)
+        return self.adx
+
+    # DX of the smoothed directional movements, None when it is undefined
+    def _dx(self):
+        if abs(self.tr) < 1e-8:
+            return None
+        plus_di = 100.0 * self.plus_dm / self.tr
+        minus_di = 100.0 * self.minus_dm / self.tr
+        total = plus_di + minus_di
+        if abs(total) < 1e-8:
+            return None
+        return 100.0 * abs(minus_di - plus_di) / total
+
+    def _step(self, high, low, close):
+        n = self.timeperiod
+        k = self.count
+        up = high - self.high
+        down = self.low - low
+        tr = max(high - low, abs(high - self.close), abs(low - self.close))
+
+        # the ATR starts as the mean of the first n true ranges
+        if k <= n:
+            self.atr = self.atr if k < n else (self.tr + tr) / n
+        else:
+            self.atr = (self.atr * (n - 1) + tr) / n
+
+        if k >= n:
+            self.plus_dm -= self.plus_dm / n
+            self.minus_dm -= self.minus_dm / n
+            self.tr = self.tr - self.tr / n + tr
+        else:
+            self.tr += tr
+        if down > 0 and up < down:
+            self.minus_dm += down
+        elif up > 0 and up > down:
+            self.plus_dm += up
+        if k < n:
+            return
+
+        dx = self._dx()
+        if k < 2 * n - 1:
+            self.dx_sum += 0.0 if dx is None else dx
+        elif k == 2 * n - 1:
+            self.adx = (self.dx_sum + (0.0 if dx is None else dx)) / n
+        elif dx is not None:
+            self.adx = (self.adx * (n - 1) + dx) / n
+
+    # advance the state with one closed candle, candles already seen are ignored
+    def update(self, candle):
+        open_time = int(candle[0])
+        if self.open_time is not None and open_time <= self.open_time:
+            return self.adx
+        high, low, close = float(candle[2]), float(candle[3]), float(candle[4])
+        if self.count > 0:
+            self._step(high, low, close)
+        self.high, self.low, self.close = high, low, close
+        self.count += 1
+        self.open_time = open_time
+        return self.adx
+
+    def resume(self, candles):
+        """
+        Advance the state with the closed ones of candles.Candles, the last one is still open.
+
+        Returns False, leaving the state untouched, when the candles do not hold the last candle of the
+        state with the same close: more candles closed than were downloaded, or the history changed.
+        The state has to be seeded again then.
+        """
+        if self.open_time is None:
+            return False
+        i = int(np.searchsorted(candles.open_time, self.open_time))
+        if (i == len(candles.open_time)
+                or candles.open_time[i] != self.open_time
+                or candles.close[i] != self.close):
+            return False
+        for candle in np.column_stack(candles)[i + 1:-1].tolist():
+            self.update(candle)
+        return True
+
+
+# the rows of a (symbols, candles) matrix shifted left by `first` candles, nan after their end.
+# Only the rows of symbols with a shorter history move.
+def _left_align(values, first):
+    aligned = values.copy()
+    for row in np.flatnonzero(first):
+        shift = first[row]
+        aligned[row, :values.shape[1] - shift] = values[row, shift:]
+        aligned[row, values.shape[1] - shift:] = np.nan
+    return aligned
+
+
+# undo _left_align, nan before the first candle of a row
+def _right_align(values, first):
+    aligned = values.copy()
+    for row in np.flatnonzero(first):
+        shift = first[row]
+        aligned[row, shift:] = values[row, :values.shape[1] - shift]
+        aligned[row, :shift] = np.nan
+    return aligned
+
+
+def wilder_batch(high, low, close, timeperiod=14):
+    """
+    talib.ADX and talib.ATR of every row of (symbols, candles) matrices, see WilderState.
+
+    A row starts with nan where its symbol has no candles yet. Returns the (symbols, candles) matrices
+    adx and atr, nan where talib gives nan for the candles of the row.
+    """
+    n = timeperiod
+    high = np.asarray(high, dtype="float64")
+    low = np.asarray(low, dtype="float64")
+    close = np.asarray(close, dtype="float64")
+    rows, length = close.shape
+    adx = np.full((length, rows), np.nan)
+    atr = np.full((length, rows), np.nan)
+    if length <= n:
+        return adx.T, atr.T
+
+    # with the rows left aligned every symbol is at the same step of the recursion in a column
+    first = engine.first_candles(close)
+    high, low, close = (_left_align(values, first).T
+                        for values in (high, low, close))
+    up = np.zeros((length, rows))
+    down = np.zeros((length, rows))
+    up[1:] = high[1:] - high[:-1]
+    down[1:] = low[:-1] - low[1:]
+    tr = np.zeros((length, rows))
+    tr[1:] = np.maximum(np.maximum(high[1:] - low[1:], np.abs(high[1:] - close[:-1])),
+                        np.abs(low[1:] - close[:-1]))
+    is_minus = (down > 0) & (up < down)
+    is_plus = ~is_minus & (up > 0) & (up > down)
+    # +DM, -DM and the true range of every candle, smoothed together
+    moves = np.stack([np.where(is_plus, up, 0.0), np.where(is_minus, down, 0.0), tr],
+                     axis=1)
+
+    smoothed = np.zeros((length, 3, rows))
+    for i in range(1, n):
+        smoothed[i] = smoothed[i - 1] + moves[i]
+    atr[n] = (smoothed[n - 1, 2] + tr[n]) / n
+    for i in range(n, length):
+        smoothed[i] = smoothed[i - 1] - smoothed[i - 1] / n + moves[i]
+    for i in range(n + 1, length):
+        atr[i] = (atr[i - 1] * (n - 1) + tr[i]) / n
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        plus_dm, minus_dm, tr_sum = (smoothed[:, j] for j in range(3))
+        plus_di = 100.0 * plus_dm / tr_sum
+        minus_di = 100.0 * minus_dm / tr_sum
+        total = plus_di + minus_di
+        dx = 100.0 * np.abs(minus_di - plus_di) / total
+    defined = (np.abs(tr_sum) >= 1e-8) & (np.abs(total) >= 1e-8)
+    dx = np.where(defined, dx, 0.0)
+
+    if length >= 2 * n:
+        dx_sum = np.zeros(rows)
+        for i in range(n, 2 * n):
+            dx_sum = dx_sum + dx[i]
+        adx[2 * n - 1] = dx_sum / n
+        for i in range(2 * n, length):
+            adx[i] = np.where(defined[i], (adx[i - 1] * (n - 1) + dx[i]) / n,
+                              adx[i - 1])
+
+    return _right_align(adx.T, first), _right_align(atr.T, first)